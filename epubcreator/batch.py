@@ -0,0 +1,371 @@
+"""
+Conversión por lotes, sin interfaz gráfica (y sin necesidad de tener PyQt4 instalado).
+
+Uso:
+    python -m epubcreator.batch ENTRADA [ENTRADA ...] -o DIRECTORIO_DE_SALIDA [opciones]
+
+Cada ENTRADA puede ser:
+    --  Un archivo a convertir (por ejemplo, un docx).
+    --  Un directorio: se convierten todos los archivos que contiene para los cuales existe un converter.
+    --  Un manifiesto: un archivo de texto con el path de un archivo a convertir por línea. Los paths relativos
+        lo son respecto del directorio del manifiesto. Se ignoran las líneas en blanco y las que comienzan con "#".
+
+Los metadatos de cada archivo se leen de un archivo json con el mismo nombre (por ejemplo: para "libro.docx",
+se lee "libro.json"), si existe. Ver _readMetadata para las claves admitidas.
+
+Por cada archivo convertido se escribe, en formato json y en una línea, un registro con el resultado de la
+conversión: el estado ("ok", "error" o "timeout"), las advertencias, el error (si lo hubo) y los tiempos. El
+proceso termina con un código de salida distinto de 0 si alguna conversión falló.
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import json
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+import traceback
+
+from epubcreator.converters import converter_factory
+from epubcreator.epubbase import ebook, ebook_metadata, images
+
+_OK_STATUS = "ok"
+_ERROR_STATUS = "error"
+_TIMEOUT_STATUS = "timeout"
+
+_METADATA_EXTENSION = ".json"
+
+
+class ConversionTimeoutError(Exception):
+    def __str__(self):
+        return "Se superó el tiempo máximo permitido para la conversión."
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="epubcreator.batch",
+                                     description="Convierte archivos a epub por lotes, sin interfaz gráfica.")
+    parser.add_argument("inputs", nargs="+", metavar="ENTRADA",
+                        help="un archivo a convertir, un directorio o un manifiesto con un archivo por línea")
+    parser.add_argument("-o", "--output-dir", required=True,
+                        help="el directorio donde guardar los epubs generados")
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count(),
+                        help="la cantidad de procesos a utilizar (por defecto, uno por cpu)")
+    parser.add_argument("-t", "--timeout", type=float, default=0,
+                        help="el tiempo máximo en segundos para convertir cada archivo; 0 para no limitarlo (no "
+                             "disponible en los sistemas sin SIGALRM, como Windows)")
+    parser.add_argument("-r", "--report",
+                        help="el archivo donde escribir los registros json con los resultados (por defecto, la salida estándar)")
+    parser.add_argument("-c", "--converter-option", action="append", default=[], metavar="NOMBRE=VALOR",
+                        help="una opción de los converters, por ejemplo: ignoreEmptyParagraphs=false")
+    parser.add_argument("-e", "--ebook-option", action="append", default=[], metavar="NOMBRE=VALOR",
+                        help="una opción del epub generado, por ejemplo: includeOptionalFiles=false")
+
+    args = parser.parse_args(args)
+
+    if args.timeout > 0 and not _canLimitTime():
+        parser.error("--timeout no está disponible en este sistema, dado que no admite SIGALRM.")
+
+    try:
+        converterOptions = _parseOptions(args.converter_option, [o for c in converter_factory.ConverterFactory.getAllConverters()
+                                                                 for o in c.OPTIONS])
+        ebookOptions = _parseOptions(args.ebook_option, ebook.Ebook.OPTIONS)
+        inputFiles = findInputFiles(args.inputs)
+    except (ValueError, OSError) as e:
+        parser.error(str(e))
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    report = open(args.report, "w", encoding="utf-8") if args.report else sys.stdout
+    failuresCount = 0
+
+    try:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as executor:
+            futures = {executor.submit(convertFile, inputFile, args.output_dir, converterOptions, ebookOptions, args.timeout): inputFile
+                       for inputFile in inputFiles}
+
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    record = future.result()
+                except Exception:
+                    # Solamente puede suceder si el proceso que realizaba la conversión terminó abruptamente.
+                    record = _makeRecord(futures[future], _ERROR_STATUS, error=traceback.format_exc())
+
+                if record["status"] != _OK_STATUS:
+                    failuresCount += 1
+
+                report.write(json.dumps(record, ensure_ascii=False) + "\n")
+                report.flush()
+    finally:
+        if report is not sys.stdout:
+            report.close()
+
+    print("Archivos convertidos: {0}. Fallidos: {1}.".format(len(inputFiles) - failuresCount, failuresCount), file=sys.stderr)
+
+    return 1 if failuresCount else 0
+
+
+def findInputFiles(inputs):
+    """
+    Retorna todos los archivos a convertir.
+
+    @param inputs: una lista de strings, con paths a archivos, directorios o manifiestos.
+
+    @return: una lista de strings con los paths de los archivos a convertir.
+    """
+    fileTypes = set(converter_factory.ConverterFactory.getSupportedFileTypes())
+    inputFiles = []
+
+    for path in inputs:
+        if os.path.isdir(path):
+            inputFiles += [os.path.join(path, f) for f in sorted(os.listdir(path)) if _getFileType(f) in fileTypes]
+        elif _getFileType(path) in fileTypes:
+            inputFiles.append(path)
+        else:
+            manifestDir = os.path.dirname(path)
+
+            with open(path, encoding="utf-8") as manifest:
+                for line in manifest:
+                    line = line.strip()
+                    if line and not line.startswith("#"):
+                        inputFiles.append(os.path.join(manifestDir, line))
+
+    return inputFiles
+
+
+def convertFile(inputFile, outputDir, converterOptions, ebookOptions, timeout=0):
+    """
+    Convierte un archivo a epub. Nunca lanza una excepción: si la conversión falla, el error se informa en
+    el registro retornado.
+
+    @param inputFile: un string con el path del archivo a convertir.
+    @param outputDir: un string con el directorio donde guardar el epub.
+    @param converterOptions: un diccionario con las opciones para el converter.
+    @param ebookOptions: un diccionario con las opciones para el epub.
+    @param timeout: el tiempo máximo en segundos para la conversión, o 0 para no limitarlo.
+
+    @return: un diccionario con el resultado de la conversión, que puede serializarse a json.
+
+    @raise ValueError: si se indicó un timeout, pero el sistema no admite SIGALRM.
+    """
+    if timeout > 0 and not _canLimitTime():
+        raise ValueError("No puede limitarse el tiempo de la conversión: el sistema no admite SIGALRM.")
+
+    timings = {}
+    startTime = time.perf_counter()
+    hasTimer = timeout > 0
+
+    if hasTimer:
+        previousHandler = signal.signal(signal.SIGALRM, _raiseTimeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+
+    try:
+        metadata = _readMetadata(inputFile)
+
+        fileType = _getFileType(inputFile)
+        converter = converter_factory.ConverterFactory.getConverter(inputFile, **_filterOptions(converterOptions,
+                                                                                                fileType))
+        ebookData = converter.convert()
+        timings["convert"] = time.perf_counter() - startTime
+
+        warnings = []
+
+        sectionsWithMissingText = ebookData.compareText(converter.getTextDigests())
+        if sectionsWithMissingText:
+            warnings.append("Se ha perdido texto en la conversión ({0}).".format(", ".join(sectionsWithMissingText)))
+        warnings += ebookData.warnings()
+
+        saveStartTime = time.perf_counter()
+        outputFile = _saveEbook(ebook.Ebook(ebookData, metadata, **ebookOptions), outputDir)
+        timings["save"] = time.perf_counter() - saveStartTime
+
+        status, error = _OK_STATUS, None
+    except ConversionTimeoutError as e:
+        status, error, outputFile, warnings = _TIMEOUT_STATUS, str(e), None, []
+    except Exception:
+        status, error, outputFile, warnings = _ERROR_STATUS, traceback.format_exc(), None, []
+    finally:
+        if hasTimer:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previousHandler)
+
+    timings["total"] = time.perf_counter() - startTime
+
+    return _makeRecord(inputFile, status, outputFile, warnings, error, timings)
+
+
+def _makeRecord(inputFile, status, outputFile=None, warnings=None, error=None, timings=None):
+    return {"file": inputFile,
+            "status": status,
+            "output": outputFile,
+            "warnings": warnings or [],
+            "error": error,
+            "timings": timings or {}}
+
+
+def _saveEbook(eebook, outputDir):
+    """
+    Guarda el epub en outputDir. Dado que el nombre del epub se genera a partir de los metadatos, varios archivos
+    podrían resultar en un mismo nombre: en ese caso, en lugar de sobreescribir el epub existente, se le agrega
+    un número al nombre.
+
+    @return: un string con el path del epub generado.
+    """
+    with tempfile.NamedTemporaryFile(dir=outputDir, suffix=".tmp", delete=False) as file:
+        tempFileName = file.name
+
+        try:
+            epubName = eebook.save(file)
+        except Exception:
+            file.close()
+            os.remove(tempFileName)
+            raise
+
+    name, extension = os.path.splitext(epubName)
+    outputFile = os.path.join(outputDir, epubName)
+    i = 1
+
+    # Reservo el nombre creando el archivo de manera exclusiva, porque otros procesos pueden estar guardando
+    # sus epubs en el mismo directorio al mismo tiempo.
+    while True:
+        try:
+            os.close(os.open(outputFile, os.O_CREAT | os.O_EXCL))
+            break
+        except FileExistsError:
+            i += 1
+            outputFile = os.path.join(outputDir, "{0} ({1}){2}".format(name, i, extension))
+
+    os.replace(tempFileName, outputFile)
+
+    return outputFile
+
+
+def _readMetadata(inputFile):
+    """
+    Lee los metadatos del archivo json asociado a inputFile. El json es un objeto que puede contener las
+    siguientes claves (todas opcionales):
+
+        --  title, subtitle, synopsis, bookId, editor, originalTitle, collectionName, subCollectionName,
+            collectionVolume, coverModification, coverDesigner, language, dedication: un string.
+        --  publicationDate: un string con la fecha, en el formato "AAAA-MM-DD".
+        --  coverImage: un string con el path de la imagen de cubierta, relativo al json.
+        --  authors, translators, ilustrators: una lista de strings con los nombres, o de objetos con las claves
+            "name", "fileAs", "gender" ("male" o "female"), "biography" e "image" (un path relativo al json).
+        --  genres: una lista de listas de tres strings: el tipo de género, el género y el subgénero.
+
+    @return: un objeto Metadata.
+    """
+    metadata = ebook_metadata.Metadata()
+    metadataFile = os.path.splitext(inputFile)[0] + _METADATA_EXTENSION
+
+    if not os.path.isfile(metadataFile):
+        return metadata
+
+    with open(metadataFile, encoding="utf-8") as file:
+        values = json.load(file)
+
+    metadataDir = os.path.dirname(metadataFile)
+
+    for key in ("title", "subtitle", "synopsis", "bookId", "editor", "originalTitle", "collectionName", "subCollectionName",
+                "collectionVolume", "coverModification", "coverDesigner", "language", "dedication"):
+        if key in values:
+            setattr(metadata, key, values[key])
+
+    if values.get("publicationDate"):
+        metadata.publicationDate = datetime.datetime.strptime(values["publicationDate"], "%Y-%m-%d").date()
+
+    if values.get("coverImage"):
+        metadata.coverImage = images.CoverImage(os.path.join(metadataDir, values["coverImage"]))
+
+    for key in ("authors", "translators", "ilustrators"):
+        setattr(metadata, key, [_readPerson(person, metadataDir) for person in values.get(key, [])])
+
+    metadata.genres = [ebook_metadata.Genre(*genre) for genre in values.get("genres", [])]
+
+    return metadata
+
+
+def _readPerson(person, metadataDir):
+    if isinstance(person, str):
+        person = {"name": person}
+
+    name = person["name"]
+    fileAs = person.get("fileAs") or ebook_metadata.Metadata.convertNameToFileAsFormat(name)
+    gender = ebook_metadata.Person.FEMALE_GENDER if person.get("gender") == "female" else ebook_metadata.Person.MALE_GENDER
+    image = images.AuthorImage(os.path.join(metadataDir, person["image"])) if person.get("image") else None
+
+    return ebook_metadata.Person(name, fileAs, gender, image, person.get("biography"))
+
+
+def _parseOptions(values, options):
+    """
+    Convierte una lista de strings de la forma "nombre=valor" en un diccionario de opciones, convirtiendo
+    cada valor al tipo del valor por defecto de la opción correspondiente.
+
+    @param values: una lista de strings.
+    @param options: una lista de objetos Option, con todas las opciones admitidas.
+
+    @return: un diccionario.
+
+    @raise ValueError: si alguna de las opciones no existe, o su valor no es válido.
+    """
+    optionsByName = {option.name: option for option in options}
+    parsedOptions = {}
+
+    for value in values:
+        name, separator, value = value.partition("=")
+
+        if not separator or name not in optionsByName:
+            raise ValueError("Opción inválida: '{0}'.".format(name))
+
+        option = optionsByName[name]
+
+        if isinstance(option.value, bool):
+            if value.lower() not in ("true", "false", "1", "0"):
+                raise ValueError("La opción '{0}' debe ser true o false.".format(name))
+            value = value.lower() in ("true", "1")
+        else:
+            value = type(option.value)(value)
+
+        if option.choices and value not in option.choices:
+            raise ValueError("La opción '{0}' debe ser una de: {1}.".format(name, ", ".join(map(str, option.choices))))
+
+        parsedOptions[name] = value
+
+    return parsedOptions
+
+
+def _filterOptions(options, fileType):
+    """
+    Retorna, de todas las opciones de los converters, solamente aquellas que admite el converter para un tipo
+    de archivo dado.
+    """
+    if fileType not in converter_factory.ConverterFactory.getSupportedFileTypes():
+        return {}
+
+    optionsNames = {o.name for o in converter_factory.ConverterFactory.getConverterClass(fileType).OPTIONS}
+
+    return {name: value for name, value in options.items() if name in optionsNames}
+
+
+def _getFileType(path):
+    return os.path.splitext(path)[1][1:]
+
+
+def _canLimitTime():
+    return hasattr(signal, "SIGALRM")
+
+
+def _raiseTimeout(signum, frame):
+    raise ConversionTimeoutError()
+
+
+if __name__ == "__main__":
+    # Al ejecutarse congelado con cx_Freeze en Windows, cada proceso del pool vuelve a ejecutar este módulo: debe
+    # tomar el control antes de que main intente interpretar los argumentos con los que se lo inicia.
+    multiprocessing.freeze_support()
+
+    sys.exit(main())
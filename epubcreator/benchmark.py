@@ -0,0 +1,71 @@
+"""
+Compara, para cada una de las políticas de compresión predefinidas, el tamaño del epub generado y el tiempo
+que demora guardarlo.
+
+Uso:
+    python -m epubcreator.benchmark ARCHIVO [ARCHIVO ...] [-n REPETICIONES]
+
+Cada archivo se convierte una única vez, y luego se guarda el epub en memoria varias veces con cada política,
+informando el menor de los tiempos obtenidos.
+"""
+
+import argparse
+import io
+import sys
+import time
+
+from epubcreator.converters import converter_factory
+from epubcreator.epubbase import ebook
+from epubcreator.pyepub.pyepubwriter import epub
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="epubcreator.benchmark",
+                                     description="Compara el tamaño y el tiempo de guardado del epub con cada política de compresión.")
+    parser.add_argument("inputs", nargs="+", metavar="ARCHIVO",
+                        help="un archivo a convertir")
+    parser.add_argument("-n", "--repeat", type=int, default=3,
+                        help="la cantidad de veces que se guarda el epub con cada política (por defecto, 3)")
+
+    args = parser.parse_args(args)
+
+    for inputFile in args.inputs:
+        ebookData = converter_factory.ConverterFactory.getConverter(inputFile).convert()
+
+        print(inputFile)
+        print("  {0:<10}{1:>12}{2:>12}".format("política", "tamaño (KB)", "tiempo (s)"))
+
+        for compression, size, seconds in benchmarkCompression(ebookData, args.repeat):
+            print("  {0:<10}{1:>12.1f}{2:>12.3f}".format(compression, size / 1024, seconds))
+
+    return 0
+
+
+def benchmarkCompression(ebookData, repeat=3):
+    """
+    Guarda el epub con cada una de las políticas de compresión predefinidas.
+
+    @param ebookData: un objeto EbookData.
+    @param repeat: la cantidad de veces que se guarda el epub con cada política.
+
+    @return: una lista de tuplas de tres elementos: el nombre de la política, el tamaño en bytes del epub, y
+             el menor tiempo en segundos que demoró guardarlo.
+    """
+    results = []
+
+    for compression in sorted(epub.COMPRESSION_PRESETS):
+        times = []
+
+        for i in range(repeat):
+            outputFile = io.BytesIO()
+            startTime = time.perf_counter()
+            ebook.Ebook(ebookData, compression=compression).save(outputFile)
+            times.append(time.perf_counter() - startTime)
+
+        results.append((compression, len(outputFile.getvalue()), min(times)))
+
+    return results
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,6 @@
 import os
 import sys
 
-from PyQt4 import QtCore
-
 IS_FROZEN = getattr(sys, "frozen", False)
 
 IS_RUNNING_ON_WIN = sys.platform == "win32"
@@ -17,5 +15,9 @@ def getQtSpanishTranslation():
     if IS_FROZEN:
         return os.path.join(ROOT_DIR_PATH, "translations", "qt_es.qm")
     else:
+        # Importo Qt recién acá, para que el resto de la aplicación (los converters, la generación del epub, la
+        # conversión por lotes) pueda utilizarse sin tener PyQt4 instalado.
+        from PyQt4 import QtCore
+
         translationsPath = QtCore.QLibraryInfo.location(QtCore.QLibraryInfo.TranslationsPath)
         return os.path.join(translationsPath, "qt_es.qm")
\ No newline at end of file
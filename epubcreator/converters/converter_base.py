@@ -18,6 +18,17 @@ class AbstractConverter(epubcreator.misc.options.Options):
     def getRawText(self):
         raise NotImplemented
 
+    def getTextDigests(self):
+        """
+        Retorna, para cada sección generada en la conversión, un resumen del texto del documento fuente que le
+        corresponde. Ver EbookData.compareText.
+
+        @return: un diccionario donde:
+                    key     ->  el nombre de la sección.
+                    value   ->  un objeto ebook_data.TextDigest.
+        """
+        raise NotImplemented
+
 
 class InvalidFile(Exception):
     pass
\ No newline at end of file
@@ -1,36 +1,109 @@
 import os
+import importlib
 
 from epubcreator.converters.converter_base import AbstractConverter
 
-# Necesito realizar estos imports para que se registren las subclases y
-# AbstractConverter.__subclasses__() las retorne correctamente a todas.
-# TODO: cargar las subclases de AbstractConverter dinámicamente.
-from epubcreator.converters.docx import docx_converter
-
 
 class ConverterFactory():
+    # El grupo de entry points a través del cual otros paquetes pueden registrar sus propios converters. El nombre
+    # del entry point es el tipo de archivo, y su valor el path del converter. Por ejemplo, en el setup.py del paquete:
+    #   entry_points={"epubcreator.converters": ["fb2 = paquete.fb2_converter:Fb2Converter"]}
+    ENTRY_POINTS_GROUP = "epubcreator.converters"
+
+    # Los converters incluidos en la aplicación.
+    # Key: el tipo de archivo.
+    # Value: un string con el path del converter, de la forma "módulo:clase".
+    _BUILTIN_CONVERTERS = {"docx": "epubcreator.converters.docx.docx_converter:DocxConverter"}
+
+    # Todos los converters registrados, en el mismo formato que _BUILTIN_CONVERTERS. Los módulos de los converters
+    # no se importan al registrarlos, sino recién la primera vez que se necesita un converter de dicho tipo.
+    _registry = {}
+
+    # Los converters ya importados.
+    # Key: el tipo de archivo.
+    # Value: la clase del converter.
     _converters = {}
 
+    _isRegistryLoaded = False
+
     @staticmethod
     def getConverter(inputFilePath, **options):
-        if not ConverterFactory._converters:
-            ConverterFactory._loadConverters()
-
         fileType = os.path.splitext(inputFilePath)[1][1:]
+        return ConverterFactory.getConverterClass(fileType)(inputFilePath, **options)
+
+    @staticmethod
+    def getConverterClass(fileType):
+        """
+        Retorna la clase del converter para un tipo de archivo, importando su módulo si todavía no fue importado.
+
+        @param fileType: un string con el tipo de archivo. Ejemplo: "docx".
+        """
         if fileType not in ConverterFactory._converters:
-            raise Exception("No existe un convertidor para un archivo '{0}'.".format(fileType))
+            path = ConverterFactory._getRegistry().get(fileType)
+
+            if path is None:
+                raise Exception("No existe un convertidor para un archivo '{0}'.".format(fileType))
+
+            moduleName, _, className = path.partition(":")
+            converter = getattr(importlib.import_module(moduleName), className)
+
+            if not issubclass(converter, AbstractConverter):
+                raise Exception("'{0}' no es un convertidor.".format(path))
 
-        return ConverterFactory._converters[fileType](inputFilePath, **options)
+            ConverterFactory._converters[fileType] = converter
+
+        return ConverterFactory._converters[fileType]
+
+    @staticmethod
+    def getSupportedFileTypes():
+        """
+        Retorna los tipos de archivo para los cuales existe un converter, sin importar ninguno de ellos.
+
+        @return: una lista de strings.
+        """
+        return sorted(ConverterFactory._getRegistry())
 
     @staticmethod
     def getAllConverters():
-        if not ConverterFactory._converters:
-            ConverterFactory._loadConverters()
+        """
+        Retorna las clases de todos los converters registrados. A diferencia de getSupportedFileTypes, este método
+        importa todos los converters.
+        """
+        return [ConverterFactory.getConverterClass(fileType) for fileType in ConverterFactory.getSupportedFileTypes()]
+
+    @staticmethod
+    def registerConverter(fileType, path):
+        """
+        Registra un converter, sin importarlo.
 
-        return ConverterFactory._converters.values()
+        @param fileType: un string con el tipo de archivo. Ejemplo: "docx".
+        @param path: un string con el path del converter, de la forma "módulo:clase".
+        """
+        ConverterFactory._getRegistry()[fileType] = path
+        ConverterFactory._converters.pop(fileType, None)
 
     @staticmethod
-    def _loadConverters():
-        converterPackages = AbstractConverter.__subclasses__()
-        for converterPackage in converterPackages:
-            ConverterFactory._converters[converterPackage.FILE_TYPE] = converterPackage
\ No newline at end of file
+    def _getRegistry():
+        if not ConverterFactory._isRegistryLoaded:
+            ConverterFactory._registry.update(ConverterFactory._BUILTIN_CONVERTERS)
+            ConverterFactory._registry.update(ConverterFactory._loadEntryPoints())
+            ConverterFactory._isRegistryLoaded = True
+
+        return ConverterFactory._registry
+
+    @staticmethod
+    def _loadEntryPoints():
+        # Recién importo importlib.metadata al necesitarlo, dado que recorrer los paquetes instalados no es gratis.
+        from importlib import metadata
+
+        entryPoints = metadata.entry_points()
+
+        # A partir de python 3.10 los entry points se filtran mediante select; antes, entry_points retorna un
+        # diccionario donde la key es el grupo.
+        if hasattr(entryPoints, "select"):
+            entryPoints = entryPoints.select(group=ConverterFactory.ENTRY_POINTS_GROUP)
+        else:
+            entryPoints = entryPoints.get(ConverterFactory.ENTRY_POINTS_GROUP, ())
+
+        return {entryPoint.name: entryPoint.value for entryPoint in entryPoints
+                if entryPoint.name not in ConverterFactory._BUILTIN_CONVERTERS}
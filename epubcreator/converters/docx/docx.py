@@ -47,12 +47,18 @@ class Docx:
     def read(self, name):
         return self._docx.read(name)
 
+    def getInfo(self, name):
+        """
+        @return: el zipfile.ZipInfo de un archivo del docx.
+        """
+        return self._docx.getinfo(name)
+
     def close(self):
         self._docx.close()
 
     def _readDocumentFullPath(self):
         rels = etree.parse(self._docx.open("_rels/.rels"))
-        documentName = utils.xpath(rels.getroot(), "/rels:Relationships/rels:Relationship[@Type = '{0}']/@Target".format(Docx._DOCUMENT))
+        documentName = utils.xpath(rels.getroot(), "/rels:Relationships/rels:Relationship[@Type = $type]/@Target", type=Docx._DOCUMENT)
 
         if not documentName:
             raise converter_base.InvalidFile("No existe document.xml.")
@@ -1,10 +1,11 @@
 import os
+import collections
 
 from lxml import etree
 
 from epubcreator.converters import converter_base
-from epubcreator.epubbase import ebook_data
-from epubcreator.converters.docx import utils, styles, footnotes, docx
+from epubcreator.epubbase import ebook_data, files
+from epubcreator.converters.docx import utils, styles, footnotes, docx, paragraphs
 from epubcreator.misc.options import Option
 
 
@@ -14,7 +15,28 @@ class DocxConverter(converter_base.AbstractConverter):
                       value=True,
                       description='Indica si los párrafos en blanco deben ignorarse, o reemplazarse por la clase '
                                   '"salto" de acuerdo al siguiente criterio: un párrafo en blanco, se reemplaza por la '
-                                  'clase "salto10"; dos o más, por la clase "salto25".')]
+                                  'clase "salto10"; dos o más, por la clase "salto25".'),
+               Option(name="streamDocument",
+                      value=False,
+                      description="Indica si el documento debe procesarse a medida que se lee, en lugar de cargarlo completo en "
+                                  "memoria antes de convertirlo. Reduce notablemente el consumo de memoria en documentos muy extensos. "
+                                  "En este modo, getRawText no está disponible: para comprobar el texto debe usarse getTextDigests."),
+               Option(name="runFormatsCacheSize",
+                      value=4096,
+                      description="La cantidad máxima de combinaciones distintas de formatos y estilo de los runs que se "
+                                  "recuerdan, para no tener que volver a resolverlas cada vez que se repiten. Con 0 no se "
+                                  "recuerda ninguna."),
+               Option(name="streamSections",
+                      value=False,
+                      description=ebook_data.EbookData.getOptionDescription("streamSections")),
+               Option(name="memoryLimit",
+                      value=0,
+                      description=ebook_data.EbookData.getOptionDescription("memoryLimit")),
+               Option(name="maxSectionLength",
+                      value=0,
+                      description="La cantidad máxima aproximada de caracteres de cada sección. Una vez superada, la sección "
+                                  "se divide al comienzo del siguiente párrafo; si ya se superó la mitad, se divide antes "
+                                  "del siguiente título. Con 0 las secciones solamente se dividen en los saltos de página.")]
 
     _MAX_HEADING_NUMBER = 6
 
@@ -23,12 +45,15 @@ class DocxConverter(converter_base.AbstractConverter):
 
         self._docx = docx.Docx(file)
 
-        self._documentXml = etree.parse(self._docx.document())
-        self._styles = styles.Styles(self._docx.styles()) if self._docx.hasStyles() else None
+        # En modo streaming no cargo document.xml completo en memoria: lo voy procesando a medida que lo leo.
+        self._documentXml = etree.parse(self._docx.document()) if not self._options.streamDocument else None
+        self._styles = styles.Styles(self._docx.styles())
         self._footnotes = footnotes.Footnotes(self._docx.footnotes()) if self._docx.hasFootnotes() else None
 
-        # Contiene el nombre de las imágenes que ya fueron agregadas al ebook.
-        self._images = set()
+        # Las imágenes que ya fueron agregadas al ebook.
+        # Key: el nombre de la imagen en el docx.
+        # Value: el nombre con el que debe referenciarse la imagen en el ebook.
+        self._images = {}
 
         # El objeto Section actual en el cual estoy escribiendo.
         self._currentSection = None
@@ -58,7 +83,27 @@ class DocxConverter(converter_base.AbstractConverter):
         self._isProcessingFootnotes = False
 
         # Un objeto EbookData.
-        self._ebookData = ebook_data.EbookData()
+        self._ebookData = ebook_data.EbookData(streamSections=self._options.streamSections,
+                                               memoryLimit=self._options.memoryLimit)
+
+        # En modo streaming, el índice de los párrafos de w:body, y los ParagraphInfo de los párrafos ya leídos pero
+        # todavía no procesados.
+        self._streamedParagraphs = None
+        self._pendingStreamedParagraphs = collections.deque()
+
+        # Los formatos ya resueltos de los runs, de acuerdo a sus formatos propios y a su estilo. Es un diccionario donde:
+        # key   ->  una tupla: la clave que retorna utils.getFormatsSignature para el w:rPr, y el id del estilo del run.
+        # value ->  una tupla de strings con los formatos resultantes.
+        # Las claves se mantienen ordenadas desde la usada menos recientemente a la más recientemente usada, de manera
+        # tal de descartar la primera al superar el tamaño máximo.
+        self._runFormatsCache = collections.OrderedDict()
+        self._runFormatsCacheHits = 0
+        self._runFormatsCacheMisses = 0
+
+        # Un diccionario donde:
+        # key   ->  el nombre de una sección.
+        # value ->  un ebook_data.TextDigest con el texto de los w:t del docx que fueron procesados en dicha sección.
+        self._textDigests = {}
 
     def convert(self):
         self._processDocument()
@@ -67,68 +112,228 @@ class DocxConverter(converter_base.AbstractConverter):
             self._isProcessingFootnotes = True
             self._processFootnotes()
 
+        # Las notas que nunca se referencian desde el documento no se convierten, pero su texto forma parte del
+        # documento fuente igualmente.
+        if self._footnotes:
+            for footnote in self._footnotes.iterUnusedFootnotes():
+                self._updateTextDigest(files.EpubBaseFiles.NOTES_FILENAME, self._getSourceText(footnote))
+
+            # Ya no necesito el árbol de footnotes.xml: lo libero sin esperar a que se libere el converter.
+            self._footnotes.release()
+
         self._docx.close()
         return self._ebookData
 
     def getRawText(self):
+        """
+        @raise ValueError: en modo streaming, dado que el árbol de document.xml no persiste luego de la conversión y
+                           conservar su texto anularía el ahorro de memoria. En su lugar, debe usarse getTextDigests.
+        """
+        if self._documentXml is None:
+            raise ValueError("El texto del documento no está disponible en modo streaming: use getTextDigests.")
+
         docText = "".join(utils.xpath(self._documentXml, "//w:t[not(ancestor::mc:Fallback)]/text()"))
-        footnotesText = "".join(self._footnotes.getRawText()) if self._footnotes else ""
+        footnotesText = ""
+
+        # footnotes.xml se libera al terminar la conversión, por lo que vuelvo a leer su texto recién ahora que lo
+        # necesito, en lugar de conservarlo durante toda la conversión.
+        if self._footnotes:
+            sourceDocx = docx.Docx(self._file)
+            try:
+                footnotesText = footnotes.Footnotes.readRawText(sourceDocx.footnotes())
+            finally:
+                sourceDocx.close()
 
         return docText + footnotesText
 
+    def getTextDigests(self):
+        return self._textDigests
+
+    def getRunFormatsCacheStats(self):
+        """
+        Retorna las estadísticas de uso de la caché de formatos de los runs.
+
+        @return: un diccionario con las claves "hits", "misses" y "size" (la cantidad de entradas en la caché).
+        """
+        return {"hits": self._runFormatsCacheHits,
+                "misses": self._runFormatsCacheMisses,
+                "size": len(self._runFormatsCache)}
+
     def _processDocument(self):
         self._currentSection = self._ebookData.createTextSection()
 
-        body = utils.find(self._documentXml, "w:body")
-        self._processMainContent(body)
+        if self._options.streamDocument:
+            self._streamMainContent()
+        else:
+            body = utils.find(self._documentXml, "w:body")
+            self._processMainContent(body, isBody=True)
 
         self._currentSection.save()
 
-    def _processMainContent(self, node, tag="p"):
+    def _processMainContent(self, node, tag="p", isBody=False):
         """
         Procesa todos los párrafos y tablas de un nodo.
 
         @param node: un nodo lxml.
         @param tag: el tag a utilizar para los párrafos.
+        @param isBody: indica si el nodo es w:body, en cuyo caso se lleva la cuenta del texto de cada sección.
         """
         previousEmptyParagraphsCount = 0
 
-        for child in node:
-            if child.tag.endswith("}p"):
-                hasParagraphText = utils.hasText(child)
-                pageBreakPosition = utils.getPageBreakPosition(child)
+        # Primero indexo todos los párrafos, para que cada uno de ellos conozca a su párrafo siguiente.
+        index = paragraphs.ParagraphsIndex(self._styles)
+        blocks = [(child, index.add(child) if child.tag.endswith("}p") else None) for child in node]
 
-                if pageBreakPosition == utils.PAGE_BREAK_ON_BEGINNING:
-                    self._currentSection.save()
-                    self._currentSection = self._ebookData.createTextSection()
+        for child, paragraph in blocks:
+            sourceText = self._getSourceText(child) if isBody else None
+            previousEmptyParagraphsCount = self._processBlock(child, paragraph, tag, previousEmptyParagraphsCount,
+                                                              sourceText)
 
-                if self._styles.hasParagraphHeadingStyle(child):
-                    self._processHeading(child, hasParagraphText)
-                else:
-                    listLevel = utils.getListLevel(child)
-                    if listLevel > -1:
-                        self._processList(child, listLevel)
-                    else:
-                        self._processParagraph(child, hasParagraphText, tag, previousEmptyParagraphsCount)
-
-                if pageBreakPosition == utils.PAGE_BREAK_ON_END:
-                    self._currentSection.save()
-                    self._currentSection = self._ebookData.createTextSection()
-
-                if hasParagraphText or pageBreakPosition != utils.NO_PAGE_BREAK:
-                    previousEmptyParagraphsCount = 0
+    def _streamMainContent(self):
+        """
+        Procesa todos los párrafos y tablas de w:body de la misma manera que _processMainContent, pero leyendo
+        document.xml con iterparse. Cada hijo de w:body se procesa una vez que fue leído completamente y luego se
+        elimina del árbol, de manera tal que el consumo de memoria no depende del tamaño del documento.
+        """
+        bodyTag = "{{{0}}}body".format(utils.NAMESPACES["w"])
+        paragraphTag = "{{{0}}}p".format(utils.NAMESPACES["w"])
+        tableTag = "{{{0}}}tbl".format(utils.NAMESPACES["w"])
+
+        body = None
+        previousEmptyParagraphsCount = 0
+        self._streamedParagraphs = paragraphs.ParagraphsIndex(self._styles)
+
+        for _, element in etree.iterparse(self._docx.document(), tag=(paragraphTag, tableTag)):
+            # Los párrafos y tablas anidados (dentro de una tabla, un cuadro de texto, etc.) se procesan junto
+            # con el hijo de w:body que los contiene.
+            if element.getparent().tag != bodyTag:
+                continue
+
+            body = element.getparent()
+
+            # Para procesar un párrafo necesito conocer el párrafo siguiente (ver _getNextParagraph), por lo que
+            # solamente puedo procesar los elementos pendientes cuando terminé de leer un nuevo párrafo. Las tablas
+            # no tienen esta restricción, pero deben esperar igualmente para no alterar el orden del documento.
+            if element.tag == paragraphTag:
+                self._pendingStreamedParagraphs.append(self._streamedParagraphs.add(element))
+                previousEmptyParagraphsCount = self._processStreamedBlocks(body, element, previousEmptyParagraphsCount)
+
+        if body is not None:
+            self._processStreamedBlocks(body, None, previousEmptyParagraphsCount)
+
+    def _processStreamedBlocks(self, body, stopElement, previousEmptyParagraphsCount):
+        """
+        Procesa, en modo streaming, todos los hijos de w:body leídos hasta el momento y todavía no procesados, y
+        luego los elimina del árbol. Todo lo que necesito saber de los párrafos vecinos se encuentra en el índice de
+        párrafos, por lo que no necesito conservar ningún nodo ya procesado.
+
+        @param body: el nodo w:body.
+        @param stopElement: el hijo de w:body en el cual detenerse (sin procesarlo), o None para procesarlos a todos.
+        @param previousEmptyParagraphsCount: la cantidad de párrafos en blanco consecutivos procesados hasta el momento.
+
+        @return: la cantidad de párrafos en blanco consecutivos procesados hasta el momento.
+        """
+        for child in list(body):
+            if child is stopElement:
+                break
+
+            paragraph = self._pendingStreamedParagraphs.popleft() if child.tag.endswith("}p") else None
+
+            previousEmptyParagraphsCount = self._processBlock(child, paragraph, "p", previousEmptyParagraphsCount,
+                                                              self._getSourceText(child))
+
+            if paragraph is not None:
+                # El párrafo siguiente todavía necesita consultar a este párrafo, pero ya nadie va a consultar al
+                # anterior: corto la cadena para no ir acumulando un ParagraphInfo por cada párrafo del documento.
+                paragraph.previous = None
+
+            child.clear()
+            body.remove(child)
+
+        return previousEmptyParagraphsCount
+
+    def _processBlock(self, child, paragraph, tag, previousEmptyParagraphsCount, sourceText=None):
+        """
+        Procesa un hijo de w:body (o de cualquier otro nodo que contenga párrafos y tablas).
+
+        @param child: un nodo lxml.
+        @param paragraph: el ParagraphInfo de child si se trata de un párrafo, sino None.
+        @param tag: el tag a utilizar para los párrafos.
+        @param previousEmptyParagraphsCount: la cantidad de párrafos en blanco consecutivos procesados hasta el momento.
+        @param sourceText: el texto de child, tal como lo retorna _getSourceText, si debe llevarse la cuenta del
+                           texto de la sección en la cual se escribe el nodo (es decir, si child es un hijo de w:body y
+                           por lo tanto la sección puede dividirse antes de él), sino None.
+
+        @return: la cantidad de párrafos en blanco consecutivos procesados hasta el momento, incluyendo al nodo actual.
+        """
+        pageBreakPosition = paragraph.pageBreakPosition if paragraph is not None else utils.NO_PAGE_BREAK
+
+        if (pageBreakPosition == utils.PAGE_BREAK_ON_BEGINNING or
+                (sourceText is not None and self._needToSplitSection(child, paragraph))):
+            self._currentSection.save()
+            self._currentSection = self._ebookData.createTextSection()
+
+        if sourceText is not None:
+            self._updateTextDigest(self._currentSection.name, sourceText)
+
+        if paragraph is not None:
+            style = self._styles.getStyle(paragraph.styleId)
+
+            if style is not None and style.headingLevel is not None:
+                self._processHeading(paragraph, style.headingLevel)
+            else:
+                if paragraph.listLevel > -1:
+                    self._processList(paragraph)
                 else:
-                    previousEmptyParagraphsCount += 1
-            elif child.tag.endswith("}tbl"):
-                self._processTable(child)
+                    self._processParagraph(paragraph, tag, previousEmptyParagraphsCount)
 
-    def _processHeading(self, paragraph, hasText):
-        if hasText:
-            styleName = self._styles.getParagraphStyleName(paragraph)
-            headingLevel = int(styleName.split(" ")[1])
+            if pageBreakPosition == utils.PAGE_BREAK_ON_END:
+                self._currentSection.save()
+                self._currentSection = self._ebookData.createTextSection()
 
+            if paragraph.hasText or pageBreakPosition != utils.NO_PAGE_BREAK:
+                previousEmptyParagraphsCount = 0
+            else:
+                previousEmptyParagraphsCount += 1
+        elif child.tag.endswith("}tbl"):
+            self._processTable(child)
+
+        return previousEmptyParagraphsCount
+
+    def _needToSplitSection(self, child, paragraph):
+        """
+        Determina si la sección actual debe dividirse antes de un hijo de w:body, de acuerdo a la opción
+        maxSectionLength.
+
+        @param child: un nodo lxml.
+        @param paragraph: el ParagraphInfo de child si se trata de un párrafo, sino None.
+        """
+        maxLength = self._options.maxSectionLength
+        section = self._currentSection
+
+        # No puedo dividir la sección si hay tags abiertos, como por ejemplo en medio de una lista o de un div que
+        # agrupa párrafos con el mismo estilo. Además, solamente divido antes de un párrafo con texto o de una
+        # tabla, para que al final del documento no quede una sección vacía.
+        if maxLength <= 0 or section.textLength == 0 or section.hasOpenedTags():
+            return False
+
+        if not (paragraph.hasText if paragraph is not None else child.tag.endswith("}tbl")):
+            return False
+
+        if section.textLength >= maxLength:
+            return True
+
+        # Prefiero dividir justo antes de un título, siempre que la sección no quede demasiado chica.
+        if section.textLength >= maxLength / 2 and paragraph is not None:
+            style = self._styles.getStyle(paragraph.styleId)
+            return style is not None and style.headingLevel is not None and style.headingLevel <= DocxConverter._MAX_HEADING_NUMBER
+
+        return False
+
+    def _processHeading(self, paragraph, headingLevel):
+        if paragraph.hasText:
             if headingLevel > 6:
-                self._processParagraph(paragraph, hasText)
+                self._processParagraph(paragraph)
             else:
                 # Los títulos en un docx no necesariamente está correctamente anidados: se puede tener un Título 1
                 # seguido de un Titulo 3, por ejemplo. A medida que genero la toc, corrijo estos títulos, de manera
@@ -171,29 +376,26 @@ class DocxConverter(converter_base.AbstractConverter):
                 # cantidad de títulos que hay en la pila me da el nivel de anidamiento correcto para el título actual.
                 fixedHeadingNumber = len(self._titles)
 
+                # No aplico a los runs los formatos del estilo del párrafo: el h ya representa al estilo de título.
                 self._currentSection.openHeading(fixedHeadingNumber)
-                self._processParagraphContent(paragraph)
+                self._processParagraphContent(paragraph.element)
                 self._currentSection.closeHeading(fixedHeadingNumber)
 
-    def _processParagraph(self, paragraph, hasText, tag="p", previousEmptyParagraphsCount=0):
+    def _processParagraph(self, paragraph, tag="p", previousEmptyParagraphsCount=0):
         isParagraphInsideDiv = False
         needToCloseDiv = False
         classValue = []
 
-        className = self._styles.getParagraphClassName(paragraph)
+        style = self._styles.getStyle(paragraph.styleId)
+        className = style.className if style is not None else None
+
         if className:
             previousParagraph = self._getPreviousParagraph(paragraph)
             nextParagraph = self._getNextParagraph(paragraph)
 
-            styleId = self._styles.getParagraphStyleId(paragraph)
-            previousParagraphStyleId = None
-            nextParagraphStyleId = None
-
-            if previousParagraph is not None:
-                previousParagraphStyleId = self._styles.getParagraphStyleId(previousParagraph)
-
-            if nextParagraph is not None:
-                nextParagraphStyleId = self._styles.getParagraphStyleId(nextParagraph)
+            styleId = paragraph.styleId
+            previousParagraphStyleId = previousParagraph.styleId if previousParagraph is not None else None
+            nextParagraphStyleId = nextParagraph.styleId if nextParagraph is not None else None
 
             if styleId != previousParagraphStyleId and styleId == nextParagraphStyleId:
                 self._currentSection.openTag("div", **{"class": className})
@@ -203,7 +405,7 @@ class DocxConverter(converter_base.AbstractConverter):
                     needToCloseDiv = True
                 isParagraphInsideDiv = True
 
-        if hasText:
+        if paragraph.hasText:
             if not self._options.ignoreEmptyParagraphs and previousEmptyParagraphsCount > 0:
                 classValue.append("salto25" if previousEmptyParagraphsCount > 1 else "salto10")
 
@@ -213,14 +415,14 @@ class DocxConverter(converter_base.AbstractConverter):
             attributes = {"class": " ".join(classValue)} if classValue else {}
 
             self._currentSection.openTag(tag, **attributes)
-            self._processParagraphContent(paragraph)
+            self._processParagraphContent(paragraph.element, paragraph.styleId)
             self._currentSection.closeTag(tag)
         else:
-            imagesId = utils.getImagesId(paragraph)
+            imagesId = utils.getImagesId(paragraph.element)
 
             if imagesId:
                 self._currentSection.openTag("p", **{"class": "ilustra"})
-                self._processParagraphContent(paragraph)
+                self._processParagraphContent(paragraph.element, paragraph.styleId)
                 self._currentSection.closeTag("p")
 
         # Aun si el párrafo no tiene texto, debo cerrar el div que agrupa estilos si es necesario. Si no
@@ -231,12 +433,16 @@ class DocxConverter(converter_base.AbstractConverter):
         if needToCloseDiv:
             self._currentSection.closeTag("div")
 
-    def _processParagraphContent(self, paragraph):
-        previousRunFormats = []
+    def _processParagraphContent(self, paragraph, paragraphStyleId=None):
+        """
+        @param paragraph: el w:p a procesar, o alguno de los nodos que contiene.
+        @param paragraphStyleId: el id del estilo del w:p, cuyos formatos se aplican a todos sus runs, o None.
+        """
+        previousRunFormats = ()
 
         for child in paragraph:
             if child.tag.endswith("}r"):
-                previousRunFormats = self._processRun(child, previousRunFormats)
+                previousRunFormats = self._processRun(child, previousRunFormats, paragraphStyleId)
             else:
                 # Si de algún lado llame a este método que procesa el contenido de un párrafo, entonces
                 # probablemente significa que dentro del nodo, en alguna parte hay texto, es decir, un
@@ -245,28 +451,22 @@ class DocxConverter(converter_base.AbstractConverter):
                 # ellos pueden contener a su vez los mismos elementos que un w:p contiene, por lo que
                 # me basta hacer un call recursivo para procesar este nodo, de manera tal que eventualmente
                 # voy a terminar procesando los w:r que contienen el texto.
-                self._processParagraphContent(child)
+                self._processParagraphContent(child, paragraphStyleId)
 
-    def _processRun(self, run, previousRunFormats):
+    def _processRun(self, run, previousRunFormats, paragraphStyleId=None):
         styleId = self._styles.getRunStyleId(run)
+        style = self._styles.getStyle(styleId)
 
         rpr = utils.find(run, "w:rPr")
-        runFormats = utils.getFormats(rpr) if rpr is not None else []
+        runFormats = self._getRunFormats(rpr, styleId, style, paragraphStyleId)
 
         isLastRun = utils.getNextRun(run) is None
         needToCloseSpan = False
         needToOpenSpan = False
         className = ""
 
-        # Si el run tiene aplicado un estilo, este estilo puede tener asociado formatos, por
-        # ejemplo: negrita, cursiva, etc. Proceso también estos formatos.
-        if styleId:
-            disabledRunFormats = utils.getDisabledFormats(rpr) if rpr is not None else []
-            formats = runFormats + disabledRunFormats
-            for f in (f for f in self._styles.getStyleFormats(styleId) if f not in formats):
-                runFormats.append(f)
-
-            className = self._styles.getRunClassName(run)
+        if style is not None:
+            className = style.className
 
             if className:
                 previousRunStyleId = None
@@ -356,25 +556,72 @@ class DocxConverter(converter_base.AbstractConverter):
             # runFormats. Ahora bien, como al cerrar el span cerré todos los tags de formato, eso
             # significa que desde el punto de vista del run siguiente, no hay tags de formatos previos
             # abiertos, por eso debo retornar una lista vacía de formatos.
-            runFormats = []
+            runFormats = ()
         elif isLastRun:
             for f in reversed(runFormats):
                 self._currentSection.closeTag(f)
 
         return runFormats
 
-    def _processList(self, paragraph, listLevel):
+    def _getRunFormats(self, rpr, styleId, style, paragraphStyleId=None):
+        """
+        Retorna los formatos de un run: los que tiene aplicados directamente, más los de su estilo, los del
+        estilo del párrafo y los de w:docDefaults, en ese orden de precedencia.
+
+        @param rpr: el nodo w:rPr del run, o None si no tiene.
+        @param styleId: el id del estilo del run, o None si no tiene.
+        @param style: el Style correspondiente a styleId, o None.
+        @param paragraphStyleId: el id del estilo del párrafo que contiene al run, o None.
+
+        @return: una tupla de strings con los formatos.
+        """
+        key = (utils.getFormatsSignature(rpr) if rpr is not None else (), styleId, paragraphStyleId)
+        runFormats = self._runFormatsCache.get(key)
+
+        if runFormats is not None:
+            self._runFormatsCacheHits += 1
+            self._runFormatsCache.move_to_end(key)
+            return runFormats
+
+        self._runFormatsCacheMisses += 1
+        runFormats = utils.getFormats(rpr) if rpr is not None else []
+        disabledFormats = utils.getDisabledFormats(rpr) if rpr is not None else []
+
+        # Tanto el estilo del run como el del párrafo pueden tener asociado formatos, por ejemplo: negrita,
+        # cursiva, etc., y lo mismo sucede con w:docDefaults. Cada nivel agrega los formatos que no estén ya
+        # aplicados ni deshabilitados por un nivel de mayor precedencia.
+        paragraphStyle = self._styles.getStyle(paragraphStyleId)
+        levels = [(s.formats, s.disabledFormats) for s in (style, paragraphStyle) if s is not None]
+        levels.append((self._styles.getDefaultRunFormats(), ()))
+
+        for formats, levelDisabledFormats in levels:
+            for f in formats:
+                if f not in runFormats and f not in disabledFormats:
+                    runFormats.append(f)
+            disabledFormats += [f for f in levelDisabledFormats if f not in runFormats]
+
+        runFormats = tuple(runFormats)
+
+        if self._options.runFormatsCacheSize > 0:
+            self._runFormatsCache[key] = runFormats
+            if len(self._runFormatsCache) > self._options.runFormatsCacheSize:
+                self._runFormatsCache.popitem(last=False)
+
+        return runFormats
+
+    def _processList(self, paragraph):
+        listLevel = paragraph.listLevel
         previousParagraph = self._getPreviousParagraph(paragraph)
         nextParagraph = self._getNextParagraph(paragraph)
 
-        previousParagraphListLevel = utils.getListLevel(previousParagraph) if previousParagraph is not None else -1
-        nextParagraphListLevel = utils.getListLevel(nextParagraph) if nextParagraph is not None else -1
+        previousParagraphListLevel = previousParagraph.listLevel if previousParagraph is not None else -1
+        nextParagraphListLevel = nextParagraph.listLevel if nextParagraph is not None else -1
 
         if listLevel > previousParagraphListLevel:
             self._currentSection.openTag("ul")
 
         self._currentSection.openTag("li")
-        self._processParagraphContent(paragraph)
+        self._processParagraphContent(paragraph.element, paragraph.styleId)
 
         if nextParagraphListLevel == listLevel:
             self._currentSection.closeTag("li")
@@ -439,12 +686,15 @@ class DocxConverter(converter_base.AbstractConverter):
         self._currentSection.save()
 
     def _processFootnote(self, footnote):
+        self._updateTextDigest(self._currentSection.name, self._getSourceText(footnote))
         self._currentSection.openNote()
 
-        for child in footnote:
-            if child.tag.endswith("}p"):
-                hasText = utils.hasText(child)
-                self._processParagraph(child, hasText)
+        index = paragraphs.ParagraphsIndex(self._styles)
+        blocks = [(child, index.add(child) if child.tag.endswith("}p") else None) for child in footnote]
+
+        for child, paragraph in blocks:
+            if paragraph is not None:
+                self._processParagraph(paragraph)
             elif child.tag.endswith("}tbl"):
                 self._processTable(child)
 
@@ -454,25 +704,49 @@ class DocxConverter(converter_base.AbstractConverter):
         imageFullName = self._docx.documentTarget(imageId) if not self._isProcessingFootnotes else self._docx.footnotesTarget(imageId)
         imageName = os.path.split(imageFullName)[-1]
 
-        self._currentSection.appendImg(imageName)
-
         if not imageName in self._images:
-            self._ebookData.addImage(imageName, self._docx.read(imageFullName))
-            self._images.add(imageName)
+            # Si el docx es un archivo en disco, no leo la imagen: se copia directamente del docx al generar el epub.
+            # El crc32 y el tamaño de la imagen los tomo del docx, que ya está abierto.
+            if isinstance(self._file, str):
+                info = self._docx.getInfo(imageFullName)
+                self._images[imageName] = self._ebookData.addZipImage(imageName, self._file, imageFullName,
+                                                                      (info.CRC, info.file_size))
+            else:
+                self._images[imageName] = self._ebookData.addImage(imageName, self._docx.read(imageFullName))
+
+        # Si el docx contiene la misma imagen con distintos nombres, siempre la referencio con el mismo nombre.
+        self._currentSection.appendImg(self._images[imageName])
 
     def _processAlternateContent(self, alternateContent):
-        paragraphs = utils.xpath(alternateContent, "mc:Choice//w:p")
+        choiceParagraphs = utils.xpath(alternateContent, "mc:Choice//w:p")
 
         # En mc:AlternateContent los párrafos generalmente se encuentran dentro de w:txtbxContent.
         # Sin embargo, ese nodo puede contener otro nodo w:sdt, que a su vez puede contener párrafos...
         # Lo que significa que necesito todos estos párrafos bajo un mismo padre, para poder procesarlos con
         # el método _processMainContent, por eso es que los agrego directamente como hijos de AlternateContent.
-        for p in paragraphs:
+        for p in choiceParagraphs:
             alternateContent.append(p)
             pass
 
         self._processMainContent(alternateContent, "span")
 
+    def _getSourceText(self, node):
+        """
+        Retorna el texto de todos los w:t de un nodo, tal como se encuentra en el docx.
+
+        @return: una lista de strings.
+        """
+        return utils.xpath(node, "descendant::w:t[not(ancestor::mc:Fallback)]/text()")
+
+    def _updateTextDigest(self, sectionName, sourceText):
+        textDigest = self._textDigests.get(sectionName)
+
+        if textDigest is None:
+            textDigest = self._textDigests[sectionName] = ebook_data.TextDigest()
+
+        for text in sourceText:
+            textDigest.update(text)
+
     def _getNextParagraph(self, paragraph):
         # Debo tener en cuenta los saltos de página en este método. Si el párrafo
         # en cuestión tiene un salto de página al final, o el párrafo siguiente lo tiene
@@ -481,22 +755,24 @@ class DocxConverter(converter_base.AbstractConverter):
         # debo retornar nada. De no tener en cuenta esto, algunos tags pueden no cerrarse o abrirse
         # correctamente, como por ejemplo, las listas, que necesitan examinar el párrafo anterior y
         # siguiente al actual. Un razonamiento similar se aplica para el método getPreviousParagraph().
-        nextP = utils.getNextParagraph(paragraph)
+        # Todos los párrafos involucrados son objetos ParagraphInfo, por lo que ya tengo calculada la posición de los
+        # saltos de página.
+        nextP = paragraph.next
 
         if nextP is not None:
-            nextPBrPos = utils.getPageBreakPosition(nextP)
-            currentPBrPos = utils.getPageBreakPosition(paragraph)
+            nextPBrPos = nextP.pageBreakPosition
+            currentPBrPos = paragraph.pageBreakPosition
 
             return nextP if nextPBrPos != utils.PAGE_BREAK_ON_BEGINNING and currentPBrPos != utils.PAGE_BREAK_ON_END else None
         else:
             return None
 
     def _getPreviousParagraph(self, paragraph):
-        previousP = utils.getPreviousParagraph(paragraph)
+        previousP = paragraph.previous
 
         if previousP is not None:
-            previousPBrPos = utils.getPageBreakPosition(previousP)
-            currentPBrPos = utils.getPageBreakPosition(paragraph)
+            previousPBrPos = previousP.pageBreakPosition
+            currentPBrPos = paragraph.pageBreakPosition
 
             return previousP if previousPBrPos != utils.PAGE_BREAK_ON_END and currentPBrPos != utils.PAGE_BREAK_ON_BEGINNING else None
         else:
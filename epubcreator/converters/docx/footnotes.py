@@ -7,8 +7,61 @@ class Footnotes:
     def __init__(self, file):
         self._footnotesXml = etree.parse(file)
 
+        # Un diccionario donde:
+        # key   ->  id de la nota.
+        # value ->  el nodo w:footnote.
+        # Solamente contiene las notas propiamente dichas, y no los separadores y demás elementos especiales que
+        # word también guarda como w:footnote, dado que estos nunca se referencian desde el documento.
+        self._footnotes = {}
+
+        # Los ids de las notas que ya fueron obtenidas mediante getFootnote.
+        self._usedFootnotesId = set()
+
+        for child in self._footnotesXml.getroot():
+            if child.tag.endswith("}footnote") and utils.getAttr(child, "w:type") in (None, "normal"):
+                self._footnotes[utils.getAttr(child, "w:id")] = child
+
     def getFootnote(self, footnoteId):
-        return utils.xpath(self._footnotesXml, 'w:footnote[@w:id = "{0}"]'.format(footnoteId))[0]
+        """
+        Retorna una nota. Una misma nota puede obtenerse más de una vez, dado que un docx mal formado podría
+        referenciarla desde varios lugares.
+
+        @param footnoteId: un string con el id de la nota.
+
+        @return: el nodo w:footnote.
+        """
+        self._usedFootnotesId.add(footnoteId)
+        return self._footnotes[footnoteId]
+
+    def iterUnusedFootnotes(self):
+        """
+        Itera sobre las notas que todavía no fueron obtenidas mediante getFootnote.
+        """
+        for footnoteId, footnote in self._footnotes.items():
+            if footnoteId not in self._usedFootnotesId:
+                yield footnote
+
+    def release(self):
+        """
+        Libera footnotes.xml. Luego de llamar a este método el objeto ya no puede usarse.
+        """
+        self._footnotes = {}
+        self._usedFootnotesId = set()
+        self._footnotesXml = None
+
+    @staticmethod
+    def readRawText(file):
+        """
+        Lee el texto de todas las notas, sin conservar el árbol de footnotes.xml.
+
+        @param file: un objeto file-like con el contenido de footnotes.xml.
+
+        @return: un string.
+        """
+        text = []
+
+        for _, element in etree.iterparse(file, tag="{{{0}}}t".format(utils.NAMESPACES["w"])):
+            text.append(element.text or "")
+            element.clear()
 
-    def getRawText(self):
-        return "".join(utils.xpath(self._footnotesXml, "//w:t/text()"))
\ No newline at end of file
+        return "".join(text)
@@ -0,0 +1,62 @@
+from epubcreator.converters.docx import utils
+
+
+class ParagraphsIndex:
+    """
+    Índice de los párrafos (w:p) hijos directos de un nodo: w:body, una celda de una tabla, una nota al pie, etc.
+
+    Al agregar un párrafo se calcula, en una única pasada, toda la información que el converter necesita consultar
+    sobre él, y se lo enlaza con el párrafo anterior. De esta manera, al procesar un párrafo y sus vecinos no es
+    necesario evaluar una y otra vez las mismas expresiones xpath sobre los mismos nodos.
+    """
+
+    def __init__(self, styles):
+        self._styles = styles
+
+        # El último ParagraphInfo agregado al índice.
+        self._lastParagraph = None
+
+    def add(self, paragraph):
+        """
+        Agrega un párrafo al índice, a continuación del último párrafo agregado.
+
+        @param paragraph: un nodo w:p.
+
+        @return: el ParagraphInfo correspondiente al párrafo.
+        """
+        info = ParagraphInfo(paragraph,
+                             self._styles.getParagraphStyleId(paragraph),
+                             utils.getListLevel(paragraph),
+                             utils.getPageBreakPosition(paragraph),
+                             utils.hasText(paragraph))
+
+        if self._lastParagraph is not None:
+            self._lastParagraph.next = info
+            info.previous = self._lastParagraph
+
+        self._lastParagraph = info
+
+        return info
+
+
+class ParagraphInfo:
+    __slots__ = ("element", "styleId", "listLevel", "pageBreakPosition", "hasText", "previous", "next")
+
+    def __init__(self, element, styleId, listLevel, pageBreakPosition, hasText):
+        # El nodo w:p.
+        self.element = element
+
+        # El id del estilo del párrafo, o None si no tiene un estilo aplicado.
+        self.styleId = styleId
+
+        # El nivel de lista del párrafo, o -1 si no es un elemento de una lista.
+        self.listLevel = listLevel
+
+        # Alguna de las constantes PAGE_BREAK_ON_BEGINNING, PAGE_BREAK_ON_END o NO_PAGE_BREAK de utils.
+        self.pageBreakPosition = pageBreakPosition
+
+        self.hasText = hasText
+
+        # Los ParagraphInfo del párrafo anterior y siguiente, o None si no existen.
+        self.previous = None
+        self.next = None
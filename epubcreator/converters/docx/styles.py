@@ -1,20 +1,49 @@
+import collections
+
 from lxml import etree
 
 from epubcreator.converters.docx import utils
 
+# Un estilo del docx, con todos sus valores ya resueltos:
+#   name            ->  el nombre del estilo.
+#   className       ->  el nombre tal como debe ir en el epub al ser usado como clase, si es un estilo custom, sino None.
+#   headingLevel    ->  el nivel de título (un int), si es un estilo de título, sino None.
+#   formats         ->  una tupla de strings con los formatos de run efectivos del estilo, es decir, incluyendo los
+#                       heredados a través de w:basedOn. Los de w:docDefaults no se incluyen: se aplican a todos los
+#                       runs, tengan o no un estilo (ver getDefaultRunFormats).
+#   disabledFormats ->  una tupla de strings con los formatos que el estilo deshabilita, incluyendo los heredados.
+Style = collections.namedtuple("Style", ("name", "className", "headingLevel", "formats", "disabledFormats"))
+
 
 class Styles:
     def __init__(self, file):
+        """
+        @param file: un objeto file-like con el contenido de styles.xml, o None si el docx no tiene estilos.
+        """
         # Un diccionario donde:
         # key   ->  id del estilo.
-        # value ->  una tupla de tres elementos: el nombre del estilo
-        #                                        el nombre tal como debe ir en el epub al ser usado como clase, si es un estilo custom, sino None
-        #                                        una lista de strings con los formatos que el estilo tiene aplicado
-        self._stylesIdToName = self._readStyles(file)
+        # value ->  un objeto Style.
+        self._styles = {}
+
+        # Los formatos de run por defecto del documento (w:docDefaults/w:rPrDefault).
+        self._defaultRunFormats = ()
+
+        if file is not None:
+            self._readStyles(file)
+
+    def getStyle(self, styleId):
+        """
+        Retorna el Style correspondiente a un id de estilo.
+
+        @param styleId: un string con el id del estilo, o None.
+
+        @return: un objeto Style, o None si styleId es None o no corresponde a ningún estilo definido.
+        """
+        return self._styles.get(styleId) if styleId else None
 
     def hasParagraphHeadingStyle(self, paragraph):
-        styleId = self.getParagraphStyleId(paragraph)
-        return styleId and (self._stylesIdToName[styleId][0].startswith("heading") or self._stylesIdToName[styleId][0].startswith("Encabezado"))
+        style = self.getStyle(self.getParagraphStyleId(paragraph))
+        return style is not None and style.headingLevel is not None
 
     def getParagraphStyleId(self, paragraph):
         styleId = utils.xpath(paragraph, "w:pPr/w:pStyle/@w:val")
@@ -25,12 +54,12 @@ class Styles:
         return styleId[0] if styleId else None
 
     def getParagraphStyleName(self, paragraph):
-        styleId = self.getParagraphStyleId(paragraph)
-        return self._stylesIdToName[styleId][0] if styleId else None
+        style = self.getStyle(self.getParagraphStyleId(paragraph))
+        return style.name if style else None
 
     def getRunStyleName(self, run):
-        styleId = self.getRunStyleId(run)
-        return self._stylesIdToName[styleId][0] if styleId else None
+        style = self.getStyle(self.getRunStyleId(run))
+        return style.name if style else None
 
     def getParagraphClassName(self, paragraph):
         """
@@ -38,13 +67,8 @@ class Styles:
         estilo custom, el nombre de la clase correspondiente tal como debe ir en el epub. Caso contrario
         se retorna None.
         """
-        styleId = self.getParagraphStyleId(paragraph)
-        className = None
-
-        if styleId:
-            className = self._stylesIdToName[styleId][1]
-
-        return className
+        style = self.getStyle(self.getParagraphStyleId(paragraph))
+        return style.className if style else None
 
     def getRunClassName(self, run):
         """
@@ -52,20 +76,35 @@ class Styles:
         estilo custom, el nombre de la clase correspondiente tal como debe ir en el epub. Caso contrario
         se retorna None.
         """
-        styleId = self.getRunStyleId(run)
-        className = None
+        style = self.getStyle(self.getRunStyleId(run))
+        return style.className if style else None
 
-        if styleId:
-            className = self._stylesIdToName[styleId][1]
+    def getStyleFormats(self, styleId):
+        style = self.getStyle(styleId)
+        return style.formats if style else ()
 
-        return className
+    def getDefaultRunFormats(self):
+        """
+        Retorna los formatos que w:docDefaults aplica a todos los runs del documento.
 
-    def getStyleFormats(self, styleId):
-        return self._stylesIdToName[styleId][2]
+        @return: una tupla de strings.
+        """
+        return self._defaultRunFormats
 
     def _readStyles(self, stylesXml):
         xml = etree.parse(stylesXml)
-        styles = {}
+
+        # Un diccionario donde:
+        # key   ->  id del estilo.
+        # value ->  una tupla de cuatro elementos: el nombre del estilo
+        #                                         el id del estilo en el cual está basado, o None
+        #                                         una lista de strings con los formatos que el propio estilo tiene aplicado
+        #                                         una lista de strings con los formatos que el propio estilo tiene deshabilitado
+        rawStyles = {}
+
+        defaultFormatNode = utils.find(xml, "w:docDefaults/w:rPrDefault/w:rPr")
+        if defaultFormatNode is not None:
+            self._defaultRunFormats = tuple(utils.getFormats(defaultFormatNode, False))
 
         for child in xml.getroot():
             if child.tag.endswith("}style"):
@@ -73,8 +112,10 @@ class Styles:
                 if attr == "paragraph" or attr == "character":
                     styleId = utils.getAttr(child, "w:styleId")
                     styleName = utils.xpath(child, "w:name/@w:val")[0]
+                    basedOn = utils.xpath(child, "w:basedOn/@w:val")
 
-                    formatNode = utils.find(child, "w:rPr" if attr == "character" else "w:pPr")
+                    # Tanto los estilos de carácter como los de párrafo indican los formatos de sus runs en w:rPr.
+                    formatNode = utils.find(child, "w:rPr")
 
                     # En los estilos, ignoro si tienen aplicado el formato subíndice o superíndice. Una de las
                     # razones es que abby finereader no parece utilizar este mecanismo al utilizar subs o sups, sino
@@ -84,9 +125,48 @@ class Styles:
                     # que word usa para las referencias a las notas, y en ese caso ignorar el formato, pero esto
                     # solo me complicaría las cosas.
                     formats = utils.getFormats(formatNode, False) if formatNode is not None else []
-                    styles[styleId] = (styleName, self._styleNameToClassName(styleName), formats)
+                    disabledFormats = utils.getDisabledFormats(formatNode) if formatNode is not None else []
+
+                    rawStyles[styleId] = (styleName, basedOn[0] if basedOn else None, formats, disabledFormats)
+
+        for styleId in rawStyles:
+            self._resolveStyle(styleId, rawStyles, self._styles, set())
+
+    def _resolveStyle(self, styleId, rawStyles, styles, visitedStylesId):
+        """
+        Resuelve un estilo, y recursivamente todos los estilos en los cuales está basado, y lo agrega a styles.
+
+        @return: el Style resuelto, o None si styleId no corresponde a ningún estilo definido.
+        """
+        if styleId in styles:
+            return styles[styleId]
 
-        return styles
+        if styleId not in rawStyles:
+            return None
+
+        styleName, basedOn, ownFormats, ownDisabledFormats = rawStyles[styleId]
+
+        # Un docx mal formado podría tener estilos basados en sí mismos, directa o indirectamente.
+        visitedStylesId.add(styleId)
+        parent = None
+
+        if basedOn and basedOn not in visitedStylesId:
+            parent = self._resolveStyle(basedOn, rawStyles, styles, visitedStylesId)
+
+        # Primero van los formatos propios del estilo, y a continuación los heredados del estilo padre. El estilo
+        # puede además deshabilitar alguno de los heredados, o habilitar alguno que el padre deshabilita.
+        inheritedFormats = parent.formats if parent is not None else ()
+        inheritedDisabledFormats = parent.disabledFormats if parent is not None else ()
+        formats = tuple(ownFormats) + tuple(f for f in inheritedFormats if f not in ownFormats and
+                                            f not in ownDisabledFormats)
+        disabledFormats = tuple(ownDisabledFormats) + tuple(f for f in inheritedDisabledFormats if f not in ownFormats and
+                                                            f not in ownDisabledFormats)
+
+        style = Style(styleName, self._styleNameToClassName(styleName), self._styleNameToHeadingLevel(styleName),
+                      formats, disabledFormats)
+        styles[styleId] = style
+
+        return style
 
     def _styleNameToClassName(self, styleName):
         className = None
@@ -96,4 +176,16 @@ class Styles:
             # con el nombre normal (párrafo) y la otra con el string " Car" al final (carácter).
             className = styleName[5:len(styleName) if not styleName.endswith(" Car") else -4]
 
-        return className
\ No newline at end of file
+        return className
+
+    def _styleNameToHeadingLevel(self, styleName):
+        headingLevel = None
+
+        if styleName.startswith("heading") or styleName.startswith("Encabezado"):
+            try:
+                headingLevel = int(styleName.split(" ")[1])
+            except (IndexError, ValueError):
+                # Por ejemplo, "Encabezado de tabla": no se trata de un estilo de título.
+                pass
+
+        return headingLevel
@@ -1,3 +1,7 @@
+import time
+
+from lxml import etree
+
 NAMESPACES = {"w": "http://schemas.openxmlformats.org/wordprocessingml/2006/main",
               "wp": "http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing",
               "a": "http://schemas.openxmlformats.org/drawingml/2006/main",
@@ -13,6 +17,21 @@ PAGE_BREAK_ON_BEGINNING = 0
 PAGE_BREAK_ON_END = 1
 NO_PAGE_BREAK = 2
 
+# Los elementos de w:rPr y w:pPr que son tenidos en cuenta por getFormats y getDisabledFormats.
+_FORMAT_TAGS = frozenset("{{{0}}}{1}".format(NAMESPACES["w"], tag) for tag in ("b", "i", "u", "vertAlign"))
+_VAL_ATTR = "{{{0}}}val".format(NAMESPACES["w"])
+
+# Las expresiones xpath ya compiladas, con los namespaces del docx ligados.
+# Key: un string con la expresión xpath.
+# Value: el objeto etree.XPath correspondiente.
+_compiledXPaths = {}
+
+# Las estadísticas de evaluación de cada expresión xpath, o None si no deben recolectarse.
+# Key: un string con la expresión xpath.
+# Value: una lista de dos elementos: la cantidad de veces que se reutilizó la expresión compilada
+#                                    el tiempo total en segundos que llevó evaluarla
+_xpathStats = None
+
 
 def getDisabledFormats(node):
     """
@@ -63,6 +82,18 @@ def getFormats(node, processSubAndSup=True):
     return formats
 
 
+def getFormatsSignature(node):
+    """
+    Dado un nodo w:rPr o w:pPr, retorna una clave que identifica a los formatos que contiene: dos nodos con
+    la misma clave tienen exactamente los mismos formatos, y los mismos formatos deshabilitados.
+
+    @param node: un lxml Element.
+
+    @return: una tupla con el nombre y el valor de cada uno de los elementos de formato, en el orden en que aparecen.
+    """
+    return tuple((child.tag, child.get(_VAL_ATTR)) for child in node if child.tag in _FORMAT_TAGS)
+
+
 def getPageBreakPosition(paragraph):
     if xpath(paragraph, "w:pPr/w:pageBreakBefore"):
         return PAGE_BREAK_ON_BEGINNING
@@ -80,16 +111,6 @@ def getPageBreakPosition(paragraph):
         return NO_PAGE_BREAK
 
 
-def getNextParagraph(paragraph):
-    nextParagraph = xpath(paragraph, "following-sibling::w:p[1]")
-    return nextParagraph[0] if nextParagraph else None
-
-
-def getPreviousParagraph(paragraph):
-    previousParagraph = xpath(paragraph, "preceding-sibling::w:p[1]")
-    return previousParagraph[0] if previousParagraph else None
-
-
 def getNextRun(run):
     nextRun = xpath(run, "following-sibling::w:r[1]")
     return nextRun[0] if nextRun else None
@@ -122,12 +143,64 @@ def getAttr(node, attr):
     return node.get("{{{0}}}{1}".format(NAMESPACES.get(ns), name))
 
 
-def xpath(node, path):
-    return node.xpath(path, namespaces=NAMESPACES)
+def xpath(node, path, **variables):
+    """
+    Evalúa una expresión xpath sobre un nodo. La expresión se compila solamente la primera vez que se
+    utiliza, y a partir de allí se reutiliza la versión compilada.
+
+    @param node: un lxml Element o ElementTree.
+    @param path: un string con la expresión xpath. Si la expresión depende de algún valor, no debe
+                 incluirse en el string, sino referenciarse como una variable ($nombre) y pasarse en variables,
+                 de manera tal de no compilar una expresión distinta por cada valor.
+    @param variables: los valores de las variables referenciadas en la expresión.
+    """
+    compiledXPath = _compiledXPaths.get(path)
+
+    if compiledXPath is None:
+        compiledXPath = etree.XPath(path, namespaces=NAMESPACES)
+        _compiledXPaths[path] = compiledXPath
+    elif _xpathStats is not None:
+        _xpathStats.setdefault(path, [0, 0.0])[0] += 1
+
+    if _xpathStats is None:
+        return compiledXPath(node, **variables)
+
+    start = time.perf_counter()
+    result = compiledXPath(node, **variables)
+    _xpathStats.setdefault(path, [0, 0.0])[1] += time.perf_counter() - start
+
+    return result
 
 
 def find(node, path):
-    return node.find(path, namespaces=NAMESPACES)
+    result = xpath(node, path)
+    return result[0] if result else None
+
+
+def enableXPathStats(enabled=True):
+    """
+    Habilita o deshabilita la recolección de estadísticas de las expresiones xpath evaluadas a través
+    de xpath() y find(). Al habilitarla se descartan las estadísticas recolectadas anteriormente.
+    """
+    global _xpathStats
+
+    _xpathStats = {} if enabled else None
+
+
+def getXPathStats():
+    """
+    Retorna las estadísticas recolectadas desde la última llamada a enableXPathStats.
+
+    @return: una lista de tuplas de tres elementos, ordenada de mayor a menor tiempo de evaluación:
+                la expresión xpath
+                la cantidad de veces que se reutilizó la expresión ya compilada
+                el tiempo total en segundos que llevó evaluarla
+    """
+    if _xpathStats is None:
+        return []
+
+    stats = ((path, hits, seconds) for path, (hits, seconds) in _xpathStats.items())
+    return sorted(stats, key=lambda s: s[2], reverse=True)
 
 
 def getAllText(node):
@@ -1,6 +1,5 @@
 import os
-
-from lxml import etree
+import concurrent.futures
 
 from epubcreator.pyepub.pyepubwriter import epub
 from epubcreator.epubbase import ebook_metadata, ebook_data, files, images
@@ -12,7 +11,37 @@ class Ebook(Options):
     OPTIONS = [Option(name="includeOptionalFiles",
                       value=True,
                       description="Indica si los archivos opcionales (dedicatoria.xhtml y autor.xhtml) deben incluirse en el epub "
-                                  "incluso si los respectivos campos no fueron ingresados.")]
+                                  "incluso si los respectivos campos no fueron ingresados."),
+               Option(name="notesPerFile",
+                      value=0,
+                      description="La cantidad máxima de notas de cada xhtml de notas. Si el libro tiene más notas, se "
+                                  "dividen en varios xhtml (notas1.xhtml, notas2.xhtml, etc.), para que ninguno resulte "
+                                  "demasiado extenso. Con 0 todas las notas van en notas.xhtml."),
+               Option(name="compactOutput",
+                      value=False,
+                      description="Indica si los xhtml de las secciones y de las notas, content.opf y toc.ncx deben "
+                                  "generarse sin indentación, lo que reduce su tamaño sin alterar el texto."),
+               Option(name="workers",
+                      value=1,
+                      description="La cantidad de hilos con los cuales generar en paralelo el xhtml de las secciones y "
+                                  "comprimir los archivos al guardar el epub. El orden de las secciones y de la toc no "
+                                  "se ve afectado."),
+               Option(name="streamOutput",
+                      value=False,
+                      description="Indica si cada archivo debe escribirse en el epub apenas se genera, en lugar de "
+                                  "conservarlos todos en memoria hasta terminar. Reduce el consumo de memoria en libros "
+                                  "muy extensos."),
+               Option(name="compression",
+                      value="default",
+                      choices=sorted(epub.COMPRESSION_PRESETS),
+                      description="Cómo comprimir los archivos del epub: \"fast\" comprime lo menos posible, lo que "
+                                  "resulta útil para generar borradores, y \"max\" genera el epub más pequeño posible, "
+                                  "a cambio de demorar más."),
+               Option(name="reproducible",
+                      value=False,
+                      description="Indica si el epub debe ser idéntico byte a byte cada vez que se lo genera a partir del "
+                                  "mismo contenido: las fechas se toman de la variable de entorno SOURCE_DATE_EPOCH (o "
+                                  "son fijas), y el identificador se genera a partir del contenido.")]
 
     def __init__(self, ebookData, metadata=None, **options):
         super().__init__(**options)
@@ -30,23 +59,37 @@ class Ebook(Options):
         @return: el path del archivo generado, si "file" es un string. Si "file" es un objeto de tipo
                  file-like, se retorna el nombre de archivo del epub.
         """
-        outputEpub = epub.EpubWriter()
-
-        self._addEpubBaseFiles(outputEpub)
-        self._addSectionsAndToc(outputEpub)
-        self._addImages(outputEpub)
-        self._addMetadata(outputEpub)
-
         epubName = self._getOutputFileName()
 
         # Compruebo si estoy ante un string (o sea, un directorio) o un objeto file-like.
-        if isinstance(file, str):
-            fileName = os.path.join(file, epubName)
-            outputEpub.generate(fileName)
-            return fileName
+        outputFile = os.path.join(file, epubName) if isinstance(file, str) else file
+
+        writerOptions = dict(prettyPrint=not self._options.compactOutput,
+                             compression=epub.COMPRESSION_PRESETS[self._options.compression],
+                             reproducible=self._options.reproducible)
+
+        if self._options.streamOutput:
+            outputEpub = epub.EpubWriter(outputFile=outputFile, **writerOptions)
         else:
-            outputEpub.generate(file)
-            return epubName
+            outputEpub = epub.EpubWriter(workers=self._options.workers, **writerOptions)
+
+        try:
+            self._addEpubBaseFiles(outputEpub)
+            self._addSectionsAndToc(outputEpub)
+            self._addImages(outputEpub)
+            self._addMetadata(outputEpub)
+
+            outputEpub.generate(None if self._options.streamOutput else outputFile)
+        except Exception:
+            outputEpub.close()
+
+            # No dejo un epub a medio escribir.
+            if self._options.streamOutput and isinstance(file, str):
+                os.remove(outputFile)
+
+            raise
+
+        return outputFile if isinstance(file, str) else epubName
 
     def _addEpubBaseFiles(self, outputEpub):
         synopsis = self._metadata.synopsis or ebook_metadata.Metadata.DEFAULT_SYNOPSIS
@@ -92,34 +135,37 @@ class Ebook(Options):
         outputEpub.addMetaFile(files.EpubBaseFiles.APPLE_XML, files.EpubBaseFiles.getFile(files.EpubBaseFiles.APPLE_XML))
 
     def _addSectionsAndToc(self, outputEpub):
-        def processSections(sections):
+        def processSections(htmlFiles, headings, sectionsNames=None):
+            """
+            @param htmlFiles: un iterable de tuplas de dos elementos: el nombre de la sección y su xhtml.
+            @param headings: un iterable de objetos Heading.
+            @param sectionsNames: un diccionario con el nombre que debe usarse en la toc en lugar del nombre de
+                                  la sección de cada título, en caso de que una sección haya sido dividida en
+                                  varios xhtml.
+            """
+            for name, html in htmlFiles:
+                outputEpub.addHtmlData(name, html)
+
             navPoints = []
-            previousLevel = "1"
-
-            for section in sections:
-                outputEpub.addHtmlData(section.name, section.toHtml())
-                hs = section.xpath("//h1 | //h2 | //h3 | //h4 | //h5 | //h6")
-
-                for h in hs:
-                    currentLevel = h.tag[-1]
-
-                    titleText = self._getTitleText(h)
-                    titleId = h.get("id")
-                    titleSrc = "{0}{1}".format(section.name, "#" + titleId if titleId else "")
-
-                    if currentLevel == "1":
-                        navPoints.append(outputEpub.addNavPoint(titleSrc, titleText))
-                    else:
-                        if currentLevel < previousLevel:
-                            for i in range(int(previousLevel) - int(currentLevel) + 1):
-                                navPoints.pop()
-                        elif currentLevel == previousLevel:
+            previousLevel = 1
+
+            for heading in headings:
+                sectionName = sectionsNames.get(heading.sectionName, heading.sectionName) if sectionsNames else heading.sectionName
+                titleSrc = "{0}{1}".format(sectionName, "#" + heading.id if heading.id else "")
+
+                if heading.level == 1:
+                    navPoints.append(outputEpub.addNavPoint(titleSrc, heading.title))
+                else:
+                    if heading.level < previousLevel:
+                        for i in range(previousLevel - heading.level + 1):
                             navPoints.pop()
+                    elif heading.level == previousLevel:
+                        navPoints.pop()
 
-                        childNavPoint = navPoints[-1].addNavPoint(titleSrc, titleText)
-                        navPoints.append(childNavPoint)
+                    childNavPoint = navPoints[-1].addNavPoint(titleSrc, heading.title)
+                    navPoints.append(childNavPoint)
 
-                    previousLevel = currentLevel
+                previousLevel = heading.level
 
         # La cubierta debe ser la primera entrada en la toc.
         outputEpub.addNavPoint(files.EpubBaseFiles.COVER_FILENAME, "Cubierta")
@@ -127,7 +173,14 @@ class Ebook(Options):
         # El título del libro debe ser la segunda entrada en la toc.
         outputEpub.addNavPoint(files.EpubBaseFiles.TITLE_FILENAME, self._metadata.title or ebook_metadata.Metadata.DEFAULT_TITLE)
 
-        processSections(self._ebookData.iterTextSections())
+        # Solamente divido las notas en varios xhtml si no entran todas en uno solo.
+        notesPerFile = self._options.notesPerFile if self._ebookData.countNotes() > self._options.notesPerFile else 0
+
+        prettyPrint = not self._options.compactOutput
+
+        processSections(self._serializeSections(self._ebookData.iterTextSections(),
+                                                lambda section: section.toHtml(prettyPrint, notesPerFile)),
+                        self._ebookData.iterTextHeadings())
 
         authors = self._metadata.authors or [ebook_metadata.Person(ebook_metadata.Metadata.DEFAULT_AUTHOR, ebook_metadata.Metadata.DEFAULT_AUTHOR)]
         authorsWithBiographyOrImage = [a for a in authors if a.biography or a.image or self._options.includeOptionalFiles]
@@ -146,11 +199,54 @@ class Ebook(Options):
         if len(authorsWithBiographyOrImage) > 0:
             outputEpub.addNavPoint(files.EpubBaseFiles.AUTHOR_FILENAME, self._getTocTitleForAuthorFile(authors))
 
-        processSections(self._ebookData.iterNotesSections())
+        if notesPerFile > 0:
+            notesFiles = []
+            sectionsNames = {}
+
+            for section in self._ebookData.iterNotesSections():
+                htmlFiles = section.toHtmlFiles(notesPerFile, prettyPrint)
+                notesFiles += htmlFiles
+                sectionsNames[section.name] = htmlFiles[0][0]
+
+            processSections(notesFiles, self._ebookData.iterNotesHeadings(), sectionsNames)
+        else:
+            processSections(self._serializeSections(self._ebookData.iterNotesSections(),
+                                                    lambda section: section.toHtml(prettyPrint)),
+                            self._ebookData.iterNotesHeadings())
+
+    def _serializeSections(self, sections, serialize):
+        """
+        Genera el xhtml de cada sección, en paralelo si así lo indica la opción workers.
+
+        @param sections: un iterable de objetos Section.
+        @param serialize: una función que recibe una sección y retorna su xhtml.
+
+        @return: un iterable de tuplas de dos elementos: el nombre de la sección y su xhtml, en el mismo orden
+                 que las secciones.
+        """
+        if self._options.workers <= 1:
+            # Genero el xhtml de cada sección recién al necesitarlo, para no tener que conservar el de todas las
+            # secciones a la vez si el epub se escribe a medida que se agregan los archivos.
+            return ((section.name, serialize(section)) for section in sections)
+
+        sections = list(sections)
+
+        if len(sections) > 1:
+            # lxml libera el GIL durante buena parte de la serialización. Además, map retorna los resultados en el
+            # orden de las secciones, independientemente del orden en el que terminen los hilos.
+            with concurrent.futures.ThreadPoolExecutor(self._options.workers) as executor:
+                htmls = list(executor.map(serialize, sections))
+        else:
+            htmls = [serialize(section) for section in sections]
+
+        return [(section.name, html) for section, html in zip(sections, htmls)]
 
     def _addImages(self, outputEpub):
         for image in self._ebookData.iterImages():
-            outputEpub.addImageData(image.name, image.content)
+            if isinstance(image, ebook_data.ZipImage):
+                outputEpub.addImageFromZip(image.name, image.zipFile, image.memberName)
+            else:
+                outputEpub.addImageData(image.name, image.content)
 
     def _addMetadata(self, outputEpub):
         authors = self._metadata.authors or [ebook_metadata.Person(ebook_metadata.Metadata.DEFAULT_AUTHOR, ebook_metadata.Metadata.DEFAULT_AUTHOR)]
@@ -267,20 +363,3 @@ class Ebook(Options):
             return "Autor"
         else:
             return "Autores" if len(authors) > 1 else "Autora"
-
-    def _getTitleText(self, h):
-        """
-        Retorna el texto de un título, reemplazando los tags "br" por un espacio.
-        """
-        if h.xpath("descendant::br"):
-            # No puedo modificar el element "h" directamente, sino que necesito
-            # trabajar sobre una copia. Una deep copy es otra opción, pero creo
-            # que va a terminar copiando todoo el tree...
-            h = etree.fromstring(etree.tostring(h))
-
-            for br in h.xpath("descendant::br"):
-                br.text = " "
-
-            etree.strip_tags(h, "br")
-
-        return "".join(h.xpath("descendant::text()"))
\ No newline at end of file
@@ -1,19 +1,97 @@
+import collections
+import hashlib
+import io
 import itertools
+import os
+import shutil
+import tempfile
+import weakref
+import zipfile
+import zlib
 
 from lxml import etree
 
 from epubcreator.epubbase import files
+from epubcreator.misc.options import Options, Option
+
+# Un título de una sección:
+#   level       ->  un int con el nivel del título (de 1 a 6).
+#   id          ->  un string con el id del título, o None si no tiene.
+#   sectionName ->  el nombre de la sección en la cual se encuentra el título.
+#   title       ->  un string con el texto del título, sin tags, y con los saltos de línea reemplazados por un espacio.
+Heading = collections.namedtuple("Heading", ("level", "id", "sectionName", "title"))
+
+# El contenido de body de una sección, ya serializado, tal como lo retorna el método getBody de los builders:
+#   content         ->  los bytes.
+#   noteReferences  ->  una lista de tuplas de tres elementos, una por cada referencia a una nota: la posición en
+#                       content donde comienza y donde termina el nombre del xhtml de las notas en el href de la
+#                       referencia, y el número de la nota.
+#   blocksOffsets   ->  una lista con la posición en content donde comienza cada uno de los hijos de body.
+_Body = collections.namedtuple("_Body", ("content", "noteReferences", "blocksOffsets"))
+
+_DOCTYPE = ('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"'
+            ' "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">')
+
+# El xhtml de una sección antes y después del contenido de body, tal como lo genera lxml con pretty print (True) y
+# sin él (False).
+_HTML_HEADER = {True: ("<?xml version='1.0' encoding='utf-8'?>\n" + _DOCTYPE + "\n"
+                       '<html xmlns="http://www.w3.org/1999/xhtml">\n'
+                       "  <head>\n"
+                       "    <title/>\n"
+                       '    <link href="../Styles/style.css" rel="stylesheet" type="text/css"/>\n'
+                       "  </head>\n"
+                       "  <body>").encode("utf-8"),
+                False: ("<?xml version='1.0' encoding='utf-8'?>\n" + _DOCTYPE + "\n"
+                        '<html xmlns="http://www.w3.org/1999/xhtml"><head><title/>'
+                        '<link href="../Styles/style.css" rel="stylesheet" type="text/css"/></head><body>').encode("utf-8")}
+
+_HTML_FOOTER = {True: "</body>\n</html>\n".encode("utf-8"),
+                False: "</body></html>".encode("utf-8")}
+
+# Lo mismo que _HTML_HEADER y _HTML_FOOTER, pero sin el namespace, para obtener el mismo árbol que construye
+# _TreeSectionBuilder.
+_TREE_HEADER = ('<html><head><title/><link href="../Styles/style.css" rel="stylesheet" type="text/css"/></head>'
+                "<body>").encode("utf-8")
+_TREE_FOOTER = "</body></html>".encode("utf-8")
+
+
+class EbookData(Options):
+    OPTIONS = [Option(name="streamSections",
+                      value=False,
+                      description="Indica si el xhtml de cada sección debe escribirse directamente en bytes a medida que se "
+                                  "genera, en lugar de construir un árbol con todos sus elementos. Reduce el consumo de "
+                                  "memoria en libros muy extensos."),
+               Option(name="memoryLimit",
+                      value=0,
+                      description="La cantidad máxima de bytes que pueden ocupar en memoria las secciones ya terminadas y "
+                                  "las imágenes. Una vez guardada, cada sección se serializa y se libera su contenido; "
+                                  "superado el límite, el resto se guarda en archivos temporales hasta generar el epub. "
+                                  "Con 0 no hay límite, y las secciones y las imágenes permanecen en memoria tal cual.")]
+
+    def __init__(self, **options):
+        super().__init__(**options)
 
-
-class EbookData:
-    def __init__(self):
         self._textSections = []
         self._notesSections = []
+
+        # Los títulos de las secciones de texto y de notas respectivamente, en orden: una lista de objetos Heading.
+        self._textHeadings = []
+        self._notesHeadings = []
         self._images = []
+
+        # Las imágenes agregadas, para no incluir más de una vez una misma imagen que el documento fuente contiene
+        # con distintos nombres.
+        # Key: una tupla con el crc32 y el tamaño del contenido de la imagen.
+        # Value: una lista con las imágenes con ese crc32 y tamaño.
+        self._imagesBySignature = collections.defaultdict(list)
+
         self._headingsCount = 0
         self._notesReferences = []
         self._warnings = []
 
+        # Donde guardo el contenido de las secciones terminadas y de las imágenes, si hay un límite de memoria.
+        self._store = _SpillStore(self._options.memoryLimit) if self._options.memoryLimit > 0 else None
+
     def createTextSection(self):
         return TextSection(self)
 
@@ -21,7 +99,64 @@ class EbookData:
         return NotesSection(self)
 
     def addImage(self, imageName, imageContent):
-        self._images.append(Image(imageName, imageContent))
+        """
+        Agrega una imagen. Si ya se agregó una imagen con exactamente el mismo contenido, no se agrega nuevamente.
+
+        @param imageName: el nombre de la imagen.
+        @param imageContent: el contenido de la imagen, en bytes.
+
+        @return: el nombre con el que debe referenciarse la imagen: el de la imagen con el mismo contenido que ya
+                 había sido agregada, o imageName.
+        """
+        signature = (zlib.crc32(imageContent), len(imageContent))
+        duplicatedImage = self._findImage(signature, lambda: imageContent)
+
+        if duplicatedImage is not None:
+            return duplicatedImage.name
+
+        if self._store is not None:
+            image = _StoredImage(imageName, self._store.put(imageContent))
+        else:
+            image = Image(imageName, imageContent)
+
+        self._images.append(image)
+        self._imagesBySignature[signature].append(image)
+
+        return imageName
+
+    def addZipImage(self, imageName, zipFile, memberName, signature=None):
+        """
+        Agrega una imagen que se encuentra dentro de un archivo zip, sin leerla. El contenido de la imagen
+        recién se lee al generar el epub, por lo que el zip debe seguir existiendo hasta ese momento. Al igual
+        que en addImage, una imagen con el mismo contenido que otra ya agregada no se agrega nuevamente.
+
+        @param imageName: el nombre de la imagen.
+        @param zipFile: un string con el path del archivo zip.
+        @param memberName: el nombre completo de la imagen dentro del zip.
+        @param signature: una tupla con el crc32 y el tamaño de la imagen tal como figuran en el zip, o None para
+                          leerlos del zip. Conviene pasarlos si quien llama ya tiene el zip abierto, para no tener
+                          que abrirlo nuevamente por cada imagen.
+
+        @return: el nombre con el que debe referenciarse la imagen.
+        """
+        image = ZipImage(imageName, zipFile, memberName)
+
+        # Gracias al crc32 y el tamaño que figuran en el zip, solamente necesito leer la imagen si ya agregué otra
+        # con el mismo crc32 y tamaño.
+        if signature is None:
+            with zipfile.ZipFile(zipFile) as file:
+                info = file.getinfo(memberName)
+            signature = (info.CRC, info.file_size)
+
+        duplicatedImage = self._findImage(signature, lambda: image.content)
+
+        if duplicatedImage is not None:
+            return duplicatedImage.name
+
+        self._images.append(image)
+        self._imagesBySignature[signature].append(image)
+
+        return imageName
 
     def iterTextSections(self):
         for section in self._textSections:
@@ -31,6 +166,14 @@ class EbookData:
         for section in self._notesSections:
             yield section
 
+    def iterTextHeadings(self):
+        for heading in self._textHeadings:
+            yield heading
+
+    def iterNotesHeadings(self):
+        for heading in self._notesHeadings:
+            yield heading
+
     def iterAllSections(self):
         return itertools.chain(self.iterTextSections(), self.iterNotesSections())
 
@@ -44,20 +187,46 @@ class EbookData:
     def countNotesSections(self):
         return len(self._notesSections)
 
+    def countNotes(self):
+        return len(self._notesReferences)
+
     def addWarning(self, warning):
         self._warnings.append(warning)
 
     def warnings(self):
         return self._warnings
 
+    def compareText(self, textDigests):
+        """
+        Compara el texto de cada sección con el texto del documento fuente que le corresponde, para detectar si
+        se ha perdido (o agregado) texto en la conversión.
+
+        @param textDigests: un diccionario donde:
+                                key     ->  el nombre de la sección.
+                                value   ->  un TextDigest con el texto del documento fuente correspondiente a la sección.
+
+        @return: una lista con los nombres de las secciones cuyo texto no coincide con el del documento fuente.
+        """
+        sectionsTextDigests = {section.name: section.textDigest for section in self.iterAllSections()}
+        emptyTextDigest = TextDigest()
+
+        sectionsNames = list(sectionsTextDigests) + [name for name in textDigests if name not in sectionsTextDigests]
+
+        return [name for name in sectionsNames if
+                sectionsTextDigests.get(name, emptyTextDigest) != textDigests.get(name, emptyTextDigest)]
+
     ### #################################################################################### ###
     ### Métodos visibles solamente a este módulo, con el único fin de ser usados por Section ###
     ### #################################################################################### ###
-    def _addTextSection(self, section):
+    def _addTextSection(self, section, headings):
+        self._spillSection(section)
         self._textSections.append(section)
+        self._textHeadings += headings
 
-    def _addNotesSection(self, section):
+    def _addNotesSection(self, section, headings):
+        self._spillSection(section)
         self._notesSections.append(section)
+        self._notesHeadings += headings
 
     def _countHeadings(self):
         self._headingsCount += 1
@@ -72,112 +241,156 @@ class EbookData:
     def _getNoteReference(self, i):
         return self._notesReferences[i]
 
+    def _spillSection(self, section):
+        if self._store is not None:
+            body = section._builder.getBody()
+            section._builder = _StoredSectionBuilder(self._store.put(body.content), body.noteReferences, body.blocksOffsets)
 
-class Section:
-    _DOCTYPE = ('<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN"'
-                ' "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">')
+    def _findImage(self, signature, getContent):
+        """
+        Busca, entre las imágenes ya agregadas, una con un contenido determinado.
 
-    _TEXT = 0
-    _TAIL = 1
+        @param signature: una tupla con el crc32 y el tamaño del contenido.
+        @param getContent: una función que retorna el contenido. Solamente se la llama si hay alguna imagen con
+                           el mismo crc32 y tamaño, en cuyo caso debo compararlas byte a byte.
 
+        @return: un objeto _BaseImage, o None si no hay ninguna imagen con ese contenido.
+        """
+        candidates = self._imagesBySignature.get(signature)
+
+        if candidates:
+            content = getContent()
+            return next((image for image in candidates if image.content == content), None)
+
+        return None
+
+
+class Section:
     def __init__(self, ebookData):
         self._ebookData = ebookData
 
         self.name = self._generateSectionName()
-        self._html = etree.Element("html", xmlns="http://www.w3.org/1999/xhtml")
 
-        head = etree.Element("head")
-        head.append(etree.Element("title"))
-        head.append(etree.Element("link", href="../Styles/style.css", rel="stylesheet", type="text/css"))
+        # El objeto que construye el xhtml de la sección: ya sea como un árbol de lxml, o escribiéndolo
+        # directamente en bytes, de acuerdo a la opción streamSections de EbookData.
+        self._builder = _StreamSectionBuilder() if ebookData._options.streamSections else _TreeSectionBuilder()
 
-        self._html.append(head)
+        # El resumen del texto agregado a la sección mediante appendText. No incluye el texto que la propia
+        # sección genera, como las referencias a las notas.
+        self.textDigest = TextDigest()
 
-        body = etree.Element("body")
+        # Los títulos de la sección, que paso a EbookData al guardar la sección: una lista de objetos Heading.
+        self._headings = []
 
-        self._html.append(body)
+        # El título abierto actualmente, o None: una lista con el nivel, el id y una lista con las partes de su texto.
+        self._currentHeading = None
 
-        # Una pila que contiene los elementos abiertos anidados. La necesito para saber en qué
-        # elemento debo escribir el texto.
-        self._openedElements = [body]
+        # La cantidad de caracteres de texto de la sección, incluyendo el texto que la propia sección genera.
+        self.textLength = 0
 
-        # El último elemento en ser abierto o cerrado. Representa el elemento en el cual debo
-        # escribir el texto cuando sea necesario.
-        self._lastElement = body
+        # La cantidad de tags abiertos y todavía no cerrados.
+        self._openedTagsCount = 0
 
-        # Tener el último elemento en ser abierto o cerrado no me basta, sino que necesito saber
-        # en qué posición debo escribir: text o tail, ya que lxml hace esta diferencia.
-        self._textWritePos = Section._TEXT
+        # Indica si la sección puede conservar el xhtml generado: solamente las secciones ya guardadas, dado que
+        # hasta entonces se siguen modificando.
+        self._isHtmlCacheable = False
 
-        # El texto propiamente dicho de cada nodo. Solamente lo vuelco al nodo (ya sea en su
-        # atributo text o tail) al momento de abrir o cerrar otro nodo.
-        self._textBuffer = []
+        # El último xhtml generado de la sección, para no tener que volver a generarlo mientras la sección no se
+        # modifique: una tupla con los parámetros con los cuales se lo generó y el xhtml, o None.
+        self._htmlCache = None
 
     def appendText(self, text):
-        self._textBuffer.append(text)
+        self.textDigest.update(text)
+        self._appendText(text)
 
     def openTag(self, tag, **attributes):
-        self._writeTextBuffer()
-
-        e = etree.Element(tag, **attributes)
+        self._builder.openTag(tag, attributes)
+        self._openedTagsCount += 1
+        self._setModified()
 
-        self._openedElements[-1].append(e)
-        self._openedElements.append(e)
-
-        self._lastElement = e
-        self._textWritePos = Section._TEXT
+        # En el texto del título, los saltos de línea se reemplazan por un espacio.
+        if tag == "br" and self._currentHeading is not None:
+            self._currentHeading[2].append(" ")
 
     def closeTag(self, tag):
-        e = self._openedElements[-1]
-
-        if e.tag != tag:
-            raise CloseTagMismatchError(e.tag, tag)
-
-        self._writeTextBuffer()
-        self._openedElements.pop()
+        self._builder.closeTag(tag)
+        self._openedTagsCount -= 1
+        self._setModified()
 
-        self._lastElement = e
-        self._textWritePos = Section._TAIL
+    def hasOpenedTags(self):
+        return self._openedTagsCount > 0
 
     def openHeading(self, level, hasIdAttr=True):
         tag = "h{0}".format(level)
-        if hasIdAttr:
-            self.openTag(tag, id="heading_id_{0}".format(self._ebookData._countHeadings()))
+        headingId = "heading_id_{0}".format(self._ebookData._countHeadings()) if hasIdAttr else None
+
+        if headingId:
+            self.openTag(tag, id=headingId)
         else:
             self.openTag(tag)
 
+        self._currentHeading = [level, headingId, []]
+
     def closeHeading(self, level):
         tag = "h{0}".format(level)
         self.closeTag(tag)
 
+        level, headingId, text = self._currentHeading
+        self._headings.append(Heading(level, headingId, self.name, "".join(text)))
+        self._currentHeading = None
+
     def appendImg(self, imageName):
         self.openTag("img", alt="", src="../Images/{0}".format(imageName))
         self.closeTag("img")
 
     def xpath(self, expr):
-        return self._html.xpath(expr)
+        return self._builder.getTree().xpath(expr)
 
-    def toHtml(self):
-        return etree.tostring(self._html, xml_declaration=True, pretty_print=True, encoding="utf-8", doctype=Section._DOCTYPE)
+    def toHtml(self, prettyPrint=True):
+        """
+        @param prettyPrint: indica si el xhtml debe indentarse, o generarse de la manera más compacta posible.
+        """
+        return self._getHtml(prettyPrint, lambda: self._builder.toHtml(prettyPrint))
 
     def toRawText(self):
-        text = self._html.xpath("//text()")
+        text = self.xpath("//text()")
         return "".join(text)
 
     def save(self):
-        raise NotImplemented
+        # Una vez guardada, la sección ya no se modifica, por lo que puede conservar el xhtml generado. Si la
+        # sección fue volcada al _SpillStore, el xhtml se genera cada vez que se lo necesita, ya que conservarlo
+        # anularía el límite de memoria.
+        self._isHtmlCacheable = not isinstance(self._builder, _StoredSectionBuilder)
 
     def _generateSectionName(self):
         raise NotImplemented
 
-    def _writeTextBuffer(self):
-        text = "".join(self._textBuffer)
+    def _appendText(self, text):
+        self._builder.appendText(text)
+        self.textLength += len(text)
+        self._setModified()
 
-        if self._textWritePos == Section._TEXT:
-            self._lastElement.text = text
-        else:
-            self._lastElement.tail = text
+        if self._currentHeading is not None:
+            self._currentHeading[2].append(text)
 
-        self._textBuffer = []
+    def _getHtml(self, key, generate):
+        """
+        Retorna el xhtml de la sección, generándolo solamente si no fue generado la última vez con los mismos
+        parámetros o si la sección fue modificada desde entonces.
+
+        @param key: los parámetros con los cuales se genera el xhtml.
+        @param generate: una función sin parámetros que genera el xhtml.
+        """
+        if not self._isHtmlCacheable:
+            return generate()
+
+        if self._htmlCache is None or self._htmlCache[0] != key:
+            self._htmlCache = (key, generate())
+
+        return self._htmlCache[1]
+
+    def _setModified(self):
+        self._htmlCache = None
 
 
 class TextSection(Section):
@@ -188,18 +401,52 @@ class TextSection(Section):
         self._ebookData._addNoteReference(self.name)
         noteNumber = self._ebookData._countNotesReferences()
 
-        self.openTag("a", id="rf{0}".format(noteNumber), href="../Text/notas.xhtml#nt{0}".format(noteNumber))
+        # El builder conserva el número de la nota, para poder generar luego el href que le corresponde si las notas
+        # se dividen en varios xhtml.
+        self._builder.openNoteReference(noteNumber)
+        self._openedTagsCount += 1
+        self._setModified()
+
         self.openTag("sup")
-        self.appendText("[{0}]".format(str(noteNumber)))
+        self._appendText("[{0}]".format(str(noteNumber)))
         self.closeTag("sup")
         self.closeTag("a")
 
     def save(self):
-        self._ebookData._addTextSection(self)
+        self._ebookData._addTextSection(self, self._headings)
+        super().save()
+
+    def toHtml(self, prettyPrint=True, notesPerFile=0):
+        """
+        @param prettyPrint: indica si el xhtml debe indentarse, o generarse de la manera más compacta posible.
+        @param notesPerFile: si las notas se dividen en varios xhtml (ver NotesSection.toHtmlFiles), la cantidad
+                             máxima de notas de cada uno, para que las referencias apunten al xhtml correcto.
+        """
+        if notesPerFile <= 0:
+            return super().toHtml(prettyPrint)
+
+        def generate():
+            # En el href de cada referencia, reemplazo el nombre del xhtml de las notas por el del xhtml en el cual
+            # quedó la nota.
+            body = self._builder.getBody()
+            parts = []
+            position = 0
+
+            for start, end, noteNumber in body.noteReferences:
+                notesFileName = files.EpubBaseFiles.generateNotesFileName((noteNumber - 1) // notesPerFile + 1)
+                parts.append(body.content[position:start])
+                parts.append(notesFileName.encode("utf-8"))
+                position = end
+
+            parts.append(body.content[position:])
+
+            return _bodyToHtml(b"".join(parts), prettyPrint)
+
+        return self._getHtml((prettyPrint, notesPerFile), generate)
 
     def toRawText(self):
         # Debo ignorar las referencias a las notas al pie.
-        text = self._html.xpath("//*[not(self::sup[parent::a[starts-with(@id, 'rf')]])]/text()")
+        text = self.xpath("//*[not(self::sup[parent::a[starts-with(@id, 'rf')]])]/text()")
         return "".join(text)
 
     def _generateSectionName(self):
@@ -214,7 +461,7 @@ class NotesSection(Section):
         self._hasCurrentFootnoteContent = True
 
         self.openHeading(1, hasIdAttr=False)
-        self.appendText("Notas")
+        self._appendText("Notas")
         self.closeHeading(1)
 
     def openTag(self, tag, **attributes):
@@ -223,7 +470,7 @@ class NotesSection(Section):
 
             super().openTag(tag, **attributes)
             super().openTag("sup")
-            self.appendText("[{0}]".format(self._footnotesCount))
+            self._appendText("[{0}]".format(self._footnotesCount))
             super().closeTag("sup")
 
             self._hasCurrentFootnoteContent = True
@@ -244,55 +491,504 @@ class NotesSection(Section):
         self._hasCurrentFootnoteContent = False
 
     def closeNote(self):
-        # Debe haber un espacio antes del link de retorno, y debo escribirlo en el nodo correcto.
-        # Al cerrar la nota, lo único que sé es que _lastElement contiene el último elemento en ser cerrado
-        # y por ende, es el elemento donde debo insertar el tag "a". Ahora, dependiendo de si dicho elemento
-        # tiene hijos o no, escribo el texto donde corresponda.
-        children = list(self._lastElement)
+        # Debe haber un espacio antes del link de retorno, y ambos deben ir dentro del último elemento de la nota
+        # en ser cerrado (generalmente, el último párrafo).
+        sectionName = self._ebookData._getNoteReference(self._footnotesCount - 1)
+
+        self._builder.appendToLastElement(" ", "a", "<<", {"href": "../Text/{0}#rf{1}".format(sectionName, self._footnotesCount)})
+        self.closeTag("div")
+
+    def save(self):
+        self._ebookData._addNotesSection(self, self._headings)
+        super().save()
+
+    def toHtmlFiles(self, notesPerFile, prettyPrint=True):
+        """
+        Divide las notas en varios xhtml, para que ninguno resulte demasiado extenso. El título "Notas" se incluye
+        solamente en el primero.
+
+        @param notesPerFile: la cantidad máxima de notas de cada xhtml.
+        @param prettyPrint: indica si el xhtml debe indentarse, o generarse de la manera más compacta posible.
+
+        @return: una lista de tuplas de dos elementos: el nombre del xhtml (ver
+                 files.EpubBaseFiles.generateNotesFileName) y su contenido.
+        """
+        # El primer hijo de body es el título, y cada uno de los restantes es una nota.
+        body = self._builder.getBody()
+        notesCount = len(body.blocksOffsets) - 1
+        htmlFiles = []
+
+        for i in range(0, max(notesCount, 1), notesPerFile):
+            start = body.blocksOffsets[0 if i == 0 else i + 1]
+            end = body.blocksOffsets[i + notesPerFile + 1] if i + notesPerFile < notesCount else len(body.content)
+
+            htmlFiles.append((files.EpubBaseFiles.generateNotesFileName(i // notesPerFile + 1),
+                              _bodyToHtml(body.content[start:end], prettyPrint)))
+
+        return htmlFiles
+
+    def toRawText(self):
+        # Debo obviar el título "Notas", el texto del primer superíndice de cada nota (el número de la nota) y el
+        # texto de los links de retorno. Recorro el árbol una sola vez: el texto de cada elemento va al abrirlo, y
+        # su tail al cerrarlo, siempre y cuando el elemento padre no deba obviarse.
+        body = self.xpath("/html/body")[0]
+        title = body[0] if len(body) else None
+        noteNumber = None
+
+        text = []
+        ignoredElements = []
+
+        for event, e in etree.iterwalk(body, events=("start", "end")):
+            if event == "start":
+                if e.get("id", "").startswith("nt"):
+                    noteNumber = e.find("sup")
+
+                isIgnored = e.tag == "a" or e is title or e is noteNumber
+                ignoredElements.append(isIgnored)
+
+                if not isIgnored and e.text:
+                    text.append(e.text)
+            else:
+                ignoredElements.pop()
+
+                if e is not body and not ignoredElements[-1] and e.tail:
+                    text.append(e.tail)
+
+        return "".join(text)
+
+    def _generateSectionName(self):
+        return files.EpubBaseFiles.NOTES_FILENAME
+
+
+class _TreeSectionBuilder:
+    """
+    Construye el xhtml de una sección como un árbol de lxml.
+    """
+
+    _TEXT = 0
+    _TAIL = 1
+
+    def __init__(self):
+        self._html = etree.Element("html", xmlns="http://www.w3.org/1999/xhtml")
+
+        head = etree.Element("head")
+        head.append(etree.Element("title"))
+        head.append(etree.Element("link", href="../Styles/style.css", rel="stylesheet", type="text/css"))
+
+        self._html.append(head)
+
+        body = etree.Element("body")
+
+        self._html.append(body)
+
+        # Una pila que contiene los elementos abiertos anidados. La necesito para saber en qué
+        # elemento debo escribir el texto.
+        self._openedElements = [body]
+
+        # El último elemento en ser abierto o cerrado. Representa el elemento en el cual debo
+        # escribir el texto cuando sea necesario.
+        self._lastElement = body
+
+        # Tener el último elemento en ser abierto o cerrado no me basta, sino que necesito saber
+        # en qué posición debo escribir: text o tail, ya que lxml hace esta diferencia.
+        self._textWritePos = _TreeSectionBuilder._TEXT
+
+        # El texto propiamente dicho de cada nodo. Solamente lo vuelco al nodo (ya sea en su
+        # atributo text o tail) al momento de abrir o cerrar otro nodo.
+        self._textBuffer = []
+
+        # Un diccionario donde:
+        # key   ->  el elemento de una referencia a una nota (ver openNoteReference).
+        # value ->  el número de la nota.
+        self._noteReferences = {}
+
+    def appendText(self, text):
+        self._textBuffer.append(text)
+
+    def openTag(self, tag, attributes):
+        self._writeTextBuffer()
+
+        e = etree.Element(tag, **attributes)
+
+        self._openedElements[-1].append(e)
+        self._openedElements.append(e)
+
+        self._lastElement = e
+        self._textWritePos = _TreeSectionBuilder._TEXT
+
+    def openNoteReference(self, noteNumber):
+        """
+        Abre el elemento a de una referencia a una nota, que apunta al xhtml de las notas sin dividir.
+        """
+        self.openTag("a", _getNoteReferenceAttributes(noteNumber))
+        self._noteReferences[self._lastElement] = noteNumber
 
-        if children:
-            lastChild = children[-1]
+    def closeTag(self, tag):
+        e = self._openedElements[-1]
 
+        if e.tag != tag:
+            raise CloseTagMismatchError(e.tag, tag)
+
+        self._writeTextBuffer()
+        self._openedElements.pop()
+
+        self._lastElement = e
+        self._textWritePos = _TreeSectionBuilder._TAIL
+
+    def appendToLastElement(self, text, tag, tagText, attributes):
+        """
+        Agrega un texto, seguido de un elemento, al final del último elemento en ser abierto o cerrado.
+        """
+        # Dependiendo de si dicho elemento tiene hijos o no, escribo el texto donde corresponda. Obtengo el último
+        # hijo directamente, sin recorrer todos los hijos.
+        lastChild = next(self._lastElement.iterchildren(reversed=True), None)
+
+        if lastChild is not None:
             if lastChild.tail:
-                lastChild.tail += " "
+                lastChild.tail += text
             else:
-                lastChild.tail = " "
+                lastChild.tail = text
         else:
             if self._lastElement.text:
-                self._lastElement.text += " "
+                self._lastElement.text += text
             else:
-                self._lastElement.text = " "
+                self._lastElement.text = text
 
-        sectionName = self._ebookData._getNoteReference(self._footnotesCount - 1)
-        anchor = etree.Element("a", href="../Text/{0}#rf{1}".format(sectionName, self._footnotesCount))
-        anchor.text = "<<"
+        e = etree.Element(tag, **attributes)
+        e.text = tagText
+
+        self._lastElement.append(e)
+
+    def getTree(self):
+        return self._html
+
+    def getBody(self):
+        # Escribo nuevamente el árbol con un _StreamSectionBuilder, de manera tal que el contenido (y las posiciones
+        # que describen a las referencias y a los hijos de body) sea exactamente el mismo para ambos builders.
+        body = self._html[1]
+        builder = _StreamSectionBuilder()
+        builder.appendText(body.text or "")
+
+        for event, e in etree.iterwalk(body, events=("start", "end")):
+            if e is body:
+                continue
+
+            if event == "start":
+                noteNumber = self._noteReferences.get(e)
+                if noteNumber is not None:
+                    builder.openNoteReference(noteNumber)
+                else:
+                    builder.openTag(e.tag, dict(e.attrib))
+                builder.appendText(e.text or "")
+            else:
+                builder.closeTag(e.tag)
+                builder.appendText(e.tail or "")
 
-        self._lastElement.append(anchor)
-        self.closeTag("div")
+        return builder.getBody()
 
-    def save(self):
-        self._ebookData._addNotesSection(self)
+    def toHtml(self, prettyPrint):
+        return etree.tostring(self._html, xml_declaration=True, pretty_print=prettyPrint, encoding="utf-8", doctype=_DOCTYPE)
 
-    def toRawText(self):
-        # Debo obviar el título "Notas", el texto del primer superíndice y el texto del link de retorno.
-        text = self._html.xpath("//*[not(self::a) and "
-                                "not(. = ./parent::*[starts-with(@id, 'nt')]/child::sup[1]) and "
-                                ". != /html/body/child::*[1]]/text()")
-        return "".join(text)
+    def _writeTextBuffer(self):
+        text = "".join(self._textBuffer)
 
-    def _generateSectionName(self):
-        return files.EpubBaseFiles.NOTES_FILENAME
+        if self._textWritePos == _TreeSectionBuilder._TEXT:
+            self._lastElement.text = text
+        else:
+            self._lastElement.tail = text
 
+        self._textBuffer = []
 
-class Image:
-    def __init__(self, name, content):
+
+class _StreamSectionBuilder:
+    """
+    Construye el xhtml de una sección escribiéndolo directamente en bytes, a medida que se abren y cierran
+    los tags, sin construir un árbol. El resultado es el mismo que el de _TreeSectionBuilder.
+    """
+
+    def __init__(self):
+        # El contenido de body.
+        self._buffer = io.BytesIO()
+
+        # Una pila con los tags de los elementos abiertos.
+        self._openedTags = ["body"]
+
+        # El tag de cierre del último elemento cerrado, todavía sin escribir. Lo escribo recién con la próxima
+        # operación, para poder agregar contenido al final del último elemento cerrado (ver appendToLastElement).
+        self._pendingCloseTag = None
+
+        # Lo mismo que los atributos noteReferences y blocksOffsets de _Body.
+        self._noteReferences = []
+        self._blocksOffsets = []
+
+    def appendText(self, text):
+        if text:
+            self._writePendingCloseTag()
+            self._buffer.write(_escapeText(text).encode("utf-8"))
+
+    def openTag(self, tag, attributes):
+        self._writePendingCloseTag()
+        self._addBlockOffset()
+
+        self._writeOpenTag(tag, attributes)
+
+    def openNoteReference(self, noteNumber):
+        """
+        Abre el elemento a de una referencia a una nota, que apunta al xhtml de las notas sin dividir, y registra
+        la posición del nombre de dicho xhtml dentro del href.
+        """
+        self._writePendingCloseTag()
+        self._addBlockOffset()
+
+        # El nombre del xhtml de las notas es la única parte del tag que contiene dicho string, ya que el id y el
+        # número de nota son números.
+        tag = self._formatOpenTag("a", _getNoteReferenceAttributes(noteNumber))
+        fileName = _escapeAttribute(files.EpubBaseFiles.NOTES_FILENAME).encode("utf-8")
+        start = self._buffer.tell() + tag.index(fileName)
+
+        self._noteReferences.append((start, start + len(fileName), noteNumber))
+        self._buffer.write(tag)
+        self._openedTags.append("a")
+
+    def closeTag(self, tag):
+        if self._openedTags[-1] != tag:
+            raise CloseTagMismatchError(self._openedTags[-1], tag)
+
+        self._writePendingCloseTag()
+        self._openedTags.pop()
+
+        self._pendingCloseTag = "</{0}>".format(tag).encode("utf-8")
+
+    def appendToLastElement(self, text, tag, tagText, attributes):
+        pendingCloseTag = self._pendingCloseTag
+        self._pendingCloseTag = None
+
+        # El elemento se agrega dentro de otro, por lo que nunca es un hijo de body.
+        self.appendText(text)
+        self._writeOpenTag(tag, attributes)
+        self.appendText(tagText)
+        self.closeTag(tag)
+
+        self._writePendingCloseTag()
+        self._pendingCloseTag = pendingCloseTag
+
+    def getTree(self):
+        # No tengo un árbol, por lo que debo construirlo a partir del xhtml generado.
+        return _bodyToTree(self.getBody().content)
+
+    def getBody(self):
+        self._writePendingCloseTag()
+        return _Body(self._buffer.getvalue(), list(self._noteReferences), list(self._blocksOffsets))
+
+    def toHtml(self, prettyPrint):
+        self._writePendingCloseTag()
+        return _bodyToHtml(self._buffer.getvalue(), prettyPrint)
+
+    def _writeOpenTag(self, tag, attributes):
+        self._buffer.write(self._formatOpenTag(tag, attributes))
+        self._openedTags.append(tag)
+
+    def _formatOpenTag(self, tag, attributes):
+        attributes = "".join(' {0}="{1}"'.format(name, _escapeAttribute(value)) for name, value in attributes.items())
+        return "<{0}{1}>".format(tag, attributes).encode("utf-8")
+
+    def _addBlockOffset(self):
+        if len(self._openedTags) == 1:
+            self._blocksOffsets.append(self._buffer.tell())
+
+    def _writePendingCloseTag(self):
+        if self._pendingCloseTag is not None:
+            self._buffer.write(self._pendingCloseTag)
+            self._pendingCloseTag = None
+
+
+class _StoredSectionBuilder:
+    """
+    El contenido de body de una sección ya guardada, que se encuentra en un _SpillStore. Ya no es posible
+    modificar la sección: solamente obtener su xhtml o consultarla.
+    """
+
+    def __init__(self, storedContent, noteReferences, blocksOffsets):
+        """
+        @param storedContent: un objeto _StoredContent, con el atributo content de _Body.
+        @param noteReferences: el atributo noteReferences de _Body.
+        @param blocksOffsets: el atributo blocksOffsets de _Body.
+        """
+        self._storedContent = storedContent
+        self._noteReferences = noteReferences
+        self._blocksOffsets = blocksOffsets
+
+    def getTree(self):
+        return _bodyToTree(self._storedContent.read())
+
+    def getBody(self):
+        return _Body(self._storedContent.read(), self._noteReferences, self._blocksOffsets)
+
+    def toHtml(self, prettyPrint):
+        return _bodyToHtml(self._storedContent.read(), prettyPrint)
+
+
+class _SpillStore:
+    """
+    Guarda contenido ya serializado: en memoria mientras no se supere el límite indicado, y a partir de allí en
+    archivos dentro de un directorio temporal, que se borra junto con el _SpillStore.
+    """
+
+    def __init__(self, memoryLimit):
+        self._memoryLimit = memoryLimit
+        self._memoryUsed = 0
+        self._directory = None
+        self._filesCount = 0
+
+    def put(self, content):
+        """
+        @param content: los bytes a guardar.
+
+        @return: un objeto _StoredContent, a través del cual puede leerse el contenido.
+        """
+        if self._memoryUsed + len(content) <= self._memoryLimit:
+            self._memoryUsed += len(content)
+            return _StoredContent(content=content)
+
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="epubcreator-")
+            weakref.finalize(self, shutil.rmtree, self._directory, ignore_errors=True)
+
+        self._filesCount += 1
+        path = os.path.join(self._directory, str(self._filesCount))
+
+        with open(path, "wb") as file:
+            file.write(content)
+
+        return _StoredContent(path=path)
+
+
+class _StoredContent:
+    __slots__ = ("_content", "_path")
+
+    def __init__(self, content=None, path=None):
+        self._content = content
+        self._path = path
+
+    def read(self):
+        if self._path is None:
+            return self._content
+
+        with open(self._path, "rb") as file:
+            return file.read()
+
+
+def _bodyToHtml(body, prettyPrint):
+    """
+    Genera el xhtml de una sección a partir del contenido de body, tal como lo haría _TreeSectionBuilder.
+    """
+    return _HTML_HEADER[prettyPrint] + body + _HTML_FOOTER[prettyPrint]
+
+
+def _getNoteReferenceAttributes(noteNumber):
+    """
+    Retorna los atributos del elemento a de una referencia a una nota, que apunta al xhtml de las notas sin dividir.
+    """
+    return {"id": "rf{0}".format(noteNumber),
+            "href": "../Text/{0}#nt{1}".format(files.EpubBaseFiles.NOTES_FILENAME, noteNumber)}
+
+
+def _bodyToTree(body):
+    return etree.fromstring(_TREE_HEADER + body + _TREE_FOOTER)
+
+
+def _escapeText(text):
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;").replace("\r", "&#13;")
+
+
+def _escapeAttribute(value):
+    return (_escapeText(value).replace('"', "&quot;").replace("\n", "&#10;").replace("\t", "&#9;"))
+
+
+class _BaseImage:
+    """
+    Una imagen del ebook. Cada subclase define el atributo content, con los bytes de la imagen.
+    """
+
+    __slots__ = ("name",)
+
+    def __init__(self, name):
         self.name = name
-        self.content = content
 
     def __str__(self):
         return self.name
 
 
+class Image(_BaseImage):
+    __slots__ = ("content",)
+
+    def __init__(self, name, content):
+        super().__init__(name)
+
+        self.content = content
+
+
+class ZipImage(_BaseImage):
+    __slots__ = ("zipFile", "memberName")
+
+    def __init__(self, name, zipFile, memberName):
+        super().__init__(name)
+
+        self.zipFile = zipFile
+        self.memberName = memberName
+
+    @property
+    def content(self):
+        # El contenido siempre se lee del zip, por lo que no puede modificarse.
+        with zipfile.ZipFile(self.zipFile) as file:
+            return file.read(self.memberName)
+
+
+class _StoredImage(_BaseImage):
+    __slots__ = ("_storedContent",)
+
+    def __init__(self, name, storedContent):
+        super().__init__(name)
+
+        self._storedContent = storedContent
+
+    @property
+    def content(self):
+        # El contenido siempre se lee del _SpillStore, por lo que no puede modificarse.
+        return self._storedContent.read()
+
+
+class TextDigest:
+    """
+    Un resumen de un texto, que se va calculando a medida que se agrega el texto, sin necesidad de conservarlo. Se
+    ignoran absolutamente todos los espacios (espacios, tabs, non breaking spaces, etc): el documento fuente y el
+    texto resultante de la conversión no necesariamente deben coincidir en un 100%, dado que el documento fuente
+    puede contener párrafos en blanco (tal vez con espacios incluso, o no), por ejemplo, que tal vez no haya
+    que convertir.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.sha1()
+
+        # La cantidad de caracteres del texto, sin contar los espacios.
+        self.length = 0
+
+    def update(self, text):
+        text = "".join(text.split())
+
+        self._hash.update(text.encode("utf-8"))
+        self.length += len(text)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def __eq__(self, other):
+        return self.length == other.length and self.hexdigest() == other.hexdigest()
+
+    def __ne__(self, other):
+        return not self == other
+
+
 class CloseTagMismatchError(Exception):
     def __init__(self, expected, got):
         self.expected = expected
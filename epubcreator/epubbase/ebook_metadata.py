@@ -216,6 +216,8 @@ class Metadata:
 
 
 class Person:
+    __slots__ = ("name", "fileAs", "gender", "image", "biography")
+
     MALE_GENDER = 0
     FEMALE_GENDER = 1
 
@@ -236,6 +238,8 @@ class Person:
 
 
 class Genre:
+    __slots__ = ("genreType", "genre", "subGenre")
+
     def __init__(self, genreType, genre, subGenre):
         self.genreType = genreType
         self.genre = genre
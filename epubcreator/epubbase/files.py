@@ -94,6 +94,10 @@ class EpubBaseFiles:
 
         return EpubBaseFiles.AUTHOR_FILENAME[:-6] + str(authorNumber) + EpubBaseFiles.AUTHOR_FILENAME[-6:]
 
+    @staticmethod
+    def generateNotesFileName(notesFileNumber):
+        return EpubBaseFiles.NOTES_FILENAME[:-6] + str(notesFileNumber) + EpubBaseFiles.NOTES_FILENAME[-6:]
+
     @staticmethod
     def _getFile(fileName, **kwargs):
         if fileName not in EpubBaseFiles._FILES:
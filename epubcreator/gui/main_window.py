@@ -1,5 +1,4 @@
 import os
-import re
 import subprocess
 import traceback
 
@@ -62,7 +61,7 @@ class MainWindow(QtGui.QMainWindow, main_window_ui.Ui_MainWindow):
         self._writeSettings()
 
     def _openFile(self):
-        fileFilter = "Archivos (*.{0})".format("*.".join(f.FILE_TYPE for f in converter_factory.ConverterFactory.getAllConverters()))
+        fileFilter = "Archivos (*.{0})".format(" *.".join(converter_factory.ConverterFactory.getSupportedFileTypes()))
         fileName = QtGui.QFileDialog.getOpenFileName(self, "", self._lastFolderOpen, fileFilter)
 
         if fileName:
@@ -251,7 +250,7 @@ class EpubGenerationRunner(QtCore.QObject):
             settings = settings_store.SettingsStore()
 
             ebookData = None
-            rawText = None
+            textDigests = None
 
             if self._inputFile:
                 fileType = os.path.splitext(self._inputFile)[1][1:]
@@ -260,15 +259,16 @@ class EpubGenerationRunner(QtCore.QObject):
                 converter = converter_factory.ConverterFactory.getConverter(self._inputFile, **options)
 
                 ebookData = converter.convert()
-                rawText = converter.getRawText()
+                textDigests = converter.getTextDigests()
 
             eebook = ebook.Ebook(ebookData, self._metadata, **settings.getAllSettingsForEbook())
             warnings = []
 
             if ebookData:
-                if self._checkForMissingText(ebookData, rawText):
-                    warnings.append("Se ha perdido texto en la conversión. Por favor, repórtalo a los desarrolladores y adjunta el "
-                                    "documento fuente.")
+                sectionsWithMissingText = ebookData.compareText(textDigests)
+                if sectionsWithMissingText:
+                    warnings.append("Se ha perdido texto en la conversión ({0}). Por favor, repórtalo a los desarrolladores y "
+                                    "adjunta el documento fuente.".format(", ".join(sectionsWithMissingText)))
                 warnings += ebookData.warnings()
 
             fileName = eebook.save(self._outputDir)
@@ -280,17 +280,6 @@ class EpubGenerationRunner(QtCore.QObject):
         except Exception:
             self.error.emit(sys.exc_info())
 
-    def _checkForMissingText(self, ebookData, rawText):
-        sectionsText = "".join((s.toRawText() for s in ebookData.iterAllSections()))
-
-        # Elimino absolutamente todos los espacios (espacios, tabs, non breaking spaces, etc) al comparar el texto.
-        # No solo lo hago porque principalemente lo único que me importa es que no se haya perdido texto en la
-        # conversión, sino porque el documento fuente y el texto resultante de la conversión no necesariamente deben
-        # coincidir en un 100%: el documento fuente puede contener párrafos en blanco (tal vez con espacios
-        # incluso, o no), por ejemplo, que tal vez no haya que convertir.
-        isTextMissing = re.sub(r"\s+", "", rawText) != re.sub(r"\s+", "", sectionsText)
-        return isTextMissing
-
     def _saveCoverForWeb(self):
         if self._metadata.coverImage is not None:
             with open(os.path.join(self._outputDir, "cover_web.jpg"), "wb") as file:
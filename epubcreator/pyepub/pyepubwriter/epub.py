@@ -1,6 +1,12 @@
+import os
+import time
+import zlib
+import hashlib
+import shutil
 import zipfile
 import uuid
 import datetime
+import concurrent.futures
 
 from lxml import etree
 
@@ -8,15 +14,62 @@ from epubcreator.pyepub.pyepubwriter import opf, toc
 
 
 class EpubWriter:
-    def __init__(self):
+    # El tamaño de cada una de las partes en las que se copia un archivo desde otro zip.
+    _COPY_BUFFER_SIZE = 1024 * 1024
+
+    # La fecha más antigua que admite el formato zip (1980-01-01 00:00:00 UTC), como timestamp.
+    _MIN_ZIP_TIMESTAMP = 315532800
+
+    # Los atributos internos de zipfile.ZipFile de los cuales depende _writeCompressedFile. No forman parte de la
+    # api pública, por lo que si alguno no existe (en otra versión de python) los archivos se comprimen de a uno.
+    _ZIPFILE_INTERNALS = ("_seekable", "_writing", "_allowZip64", "_lock", "_writecheck", "_didModify", "fp",
+                          "start_dir", "filelist", "NameToInfo")
+
+    def __init__(self, prettyPrint=True, outputFile=None, workers=1, compression=None, reproducible=False):
+        """
+        @param prettyPrint: indica si los xml que genera el propio EpubWriter (content.opf, toc.ncx y container.xml)
+                            deben indentarse, o generarse de la manera más compacta posible.
+        @param outputFile: el path del archivo a generar, o un objeto de tipo file, si el epub debe escribirse a
+                           medida que se agregan los archivos, en lugar de conservarlos todos en memoria hasta
+                           llamar a generate. En ese caso, generate solamente agrega content.opf y toc.ncx y cierra
+                           el epub, por lo que no debe recibir ningún archivo.
+        @param workers: la cantidad de hilos con los cuales comprimir en paralelo, al llamar a generate, los
+                        archivos que todavía no fueron escritos. El epub resultante es idéntico al que se obtiene
+                        comprimiéndolos de a uno.
+        @param compression: un objeto CompressionPolicy, que indica cómo guardar cada archivo en el epub. Si es
+                            None, se utiliza COMPRESSION_PRESETS["default"].
+        @param reproducible: indica si el epub debe ser idéntico byte a byte cada vez que se lo genera con el mismo
+                             contenido. En ese caso, la fecha de los archivos dentro del zip y la de modificación
+                             se toman de la variable de entorno SOURCE_DATE_EPOCH (o, si no existe, se utiliza el
+                             1 de enero de 1980), y el identificador se genera a partir del contenido del epub.
+
+        @raise: IOError, si no pudo crearse el epub.
+        """
         self._opf = opf.Opf()
         self._toc = toc.Toc()
+        self._prettyPrint = prettyPrint
+        self._workers = workers
+        self._compression = compression or COMPRESSION_PRESETS["default"]
+
+        # Si el epub debe ser reproducible, el timestamp de todas las fechas del epub, y el resumen de su contenido,
+        # a partir del cual genero el identificador.
+        self._timestamp = self._getReproducibleTimestamp() if reproducible else None
+        self._contentDigest = hashlib.sha1() if reproducible else None
 
-        # Contiene todos los archivos agregados por el usuario al epub.
+        # Contiene todos los archivos agregados por el usuario al epub, todavía no escritos.
         # La key representa el path completo donde guardar el archivo dentro del epub, y el value es el contenido
-        # del archivo, en string o bytes.
+        # del archivo, en string o bytes, o un objeto _ZipMember.
         self._files = {}
 
+        # El zip del epub, una vez abierto.
+        self._epubFile = None
+
+        # Los zips desde los cuales copio archivos, para no tener que abrirlos una vez por cada archivo.
+        self._sourceZips = {}
+
+        if outputFile is not None:
+            self._open(outputFile)
+
     def addHtmlData(self, name, content):
         """
         Agrega un html al epub.
@@ -26,7 +79,7 @@ class EpubWriter:
         """
         self._opf.manifest.addItem("Text/{0}".format(name), name)
         self._opf.spine.addItemRef(name)
-        self._files["OEBPS/Text/{0}".format(name)] = content
+        self._addFile("OEBPS/Text/{0}".format(name), content)
 
     def addImageData(self, name, content):
         """
@@ -36,7 +89,19 @@ class EpubWriter:
         @param content: el contenido de la imagen, en bytes.
         """
         self._opf.manifest.addItem("Images/{0}".format(name), name)
-        self._files["OEBPS/Images/{0}".format(name)] = content
+        self._addFile("OEBPS/Images/{0}".format(name), content)
+
+    def addImageFromZip(self, name, zipFile, memberName):
+        """
+        Agrega al epub una imagen que se encuentra dentro de otro archivo zip. La imagen no se lee sino hasta
+        generar el epub, y en ese momento se copia por partes, sin cargarla completa en memoria.
+
+        @param name: el nombre con el que se va a guardar la imagen en el epub.
+        @param zipFile: un string con el path del archivo zip que contiene la imagen.
+        @param memberName: el nombre completo de la imagen dentro del zip.
+        """
+        self._opf.manifest.addItem("Images/{0}".format(name), name)
+        self._addFile("OEBPS/Images/{0}".format(name), _ZipMember(zipFile, memberName))
 
     def addStyleData(self, name, content):
         """
@@ -46,7 +111,7 @@ class EpubWriter:
         @param content: el contenido del css. Puede ser un string o bytes.
         """
         self._opf.manifest.addItem("Styles/{0}".format(name), name)
-        self._files["OEBPS/Styles/{0}".format(name)] = content
+        self._addFile("OEBPS/Styles/{0}".format(name), content)
 
     def addMetaFile(self, name, content):
         """
@@ -55,7 +120,7 @@ class EpubWriter:
         @param name: el nombre con el que se va a guardar el archivo en el epub.
         @param content: el contenido del archivo. Puede ser un string o bytes.
         """
-        self._files["META-INF/{0}".format(name)] = content
+        self._addFile("META-INF/{0}".format(name), content)
 
     def addNavPoint(self, ref, title):
         """
@@ -102,31 +167,218 @@ class EpubWriter:
     def addCustomMetadata(self, name, content):
         self._opf.metadata.addCustom(name, content)
 
-    def generate(self, outputFile):
+    def generate(self, outputFile=None):
         """
         Genera el epub.
         
-        @param outputFile: el path del archivo a generar, o un objeto de tipo file.
+        @param outputFile: el path del archivo a generar, o un objeto de tipo file. Si el epub se escribe a medida
+                           que se agregan los archivos (ver __init__), debe ser None.
 
         @raise: IOError, si el epub no pudo guardarse.
         """
-        epubFile = zipfile.ZipFile(outputFile, "w")
+        try:
+            if self._epubFile is None:
+                self._open(outputFile)
+
+            if self._contentDigest is not None:
+                # Los metadatos, el manifest, el spine y la toc también determinan el identificador.
+                self._contentDigest.update(self._opf.toXml())
+                self._contentDigest.update(self._toc.toXml())
+
+            self._addIdentifier()
+            self._opf.metadata.addModificationDate(self._getModificationDate().strftime("%Y-%m-%d"))
+
+            self._writeFile("OEBPS/content.opf", self._opf.toXml(self._prettyPrint))
+            self._writeFile("OEBPS/toc.ncx", self._toc.toXml(self._prettyPrint))
+
+            if self._workers > 1 and self._canWriteCompressedFiles():
+                self._writeFilesInParallel()
+            else:
+                for filePath, fileContent in self._files.items():
+                    self._writeFile(filePath, fileContent)
+            self._files.clear()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Cierra el epub sin terminar de generarlo. Solamente es necesario llamarlo si el epub se escribe a medida que
+        se agregan los archivos, y se decide no llamar a generate (por ejemplo, ante un error).
+        """
+        for sourceZip in self._sourceZips.values():
+            sourceZip.close()
+        self._sourceZips.clear()
+
+        if self._epubFile is not None:
+            self._epubFile.close()
+            self._epubFile = None
+
+    def _open(self, outputFile):
+        self._epubFile = zipfile.ZipFile(outputFile, "w")
+
+        self._epubFile.writestr(self._createZipInfo("mimetype"), "application/epub+zip", zipfile.ZIP_STORED)
+        self._writeFile("META-INF/container.xml", self._generateContainer())
+
+    def _addFile(self, filePath, fileContent):
+        if self._contentDigest is not None:
+            self._contentDigest.update(filePath.encode("utf-8"))
+
+            if isinstance(fileContent, _ZipMember):
+                # No necesito leer el archivo: el crc32 y el tamaño que figuran en el zip lo identifican.
+                info = self._getSourceZip(fileContent.zipFile).getinfo(fileContent.memberName)
+                self._contentDigest.update("{0}:{1}".format(info.CRC, info.file_size).encode())
+            else:
+                self._contentDigest.update(hashlib.sha1(_toBytes(fileContent)).digest())
+
+        if self._epubFile is not None:
+            self._writeFile(filePath, fileContent)
+        else:
+            self._files[filePath] = fileContent
+
+    def _writeFile(self, filePath, fileContent):
+        if isinstance(fileContent, _ZipMember):
+            self._copyZipMember(filePath, self._getSourceZip(fileContent.zipFile), fileContent.memberName)
+        else:
+            fileContent = _toBytes(fileContent)
+            compressType, level = self._getCompression(filePath, len(fileContent))
+            self._epubFile.writestr(self._createZipInfo(filePath), fileContent, compress_type=compressType, compresslevel=level)
+
+    def _writeFilesInParallel(self):
+        def compress(fileContentAndLevel):
+            fileContent, level = fileContentAndLevel
+
+            # Comprimo de la misma forma que ZipFile.writestr, para que el resultado sea exactamente el mismo.
+            compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level, zlib.DEFLATED, -15)
+            return zlib.crc32(fileContent), compressor.compress(fileContent) + compressor.flush()
+
+        # Solamente comprimo en paralelo los archivos que tengo en memoria y que deben comprimirse. El resto se
+        # escribe igual que siempre, pero respetando el orden en el que fueron agregados.
+        toCompress = {}
+        for filePath, fileContent in self._files.items():
+            if not isinstance(fileContent, _ZipMember):
+                fileContent = _toBytes(fileContent)
+                compressType, level = self._getCompression(filePath, len(fileContent))
 
-        self._addIdentifier()
-        self._opf.metadata.addModificationDate(datetime.datetime.now().strftime("%Y-%m-%d"))
+                if compressType == zipfile.ZIP_DEFLATED:
+                    toCompress[filePath] = (fileContent, level)
 
-        epubFile.writestr("mimetype", "application/epub+zip", zipfile.ZIP_STORED)
-        epubFile.writestr("META-INF/container.xml", self._generateContainer(), compress_type=zipfile.ZIP_DEFLATED)
-        epubFile.writestr("OEBPS/content.opf", self._opf.toXml(), compress_type=zipfile.ZIP_DEFLATED)
-        epubFile.writestr("OEBPS/toc.ncx", self._toc.toXml(), compress_type=zipfile.ZIP_DEFLATED)
+        # zlib libera el GIL mientras comprime, y map retorna los resultados en el orden de los archivos.
+        with concurrent.futures.ThreadPoolExecutor(self._workers) as executor:
+            compressedFiles = executor.map(compress, toCompress.values())
 
-        for filePath, fileContent in self._files.items():
-            epubFile.writestr(filePath, fileContent, compress_type=zipfile.ZIP_DEFLATED)
+            for filePath, fileContent in self._files.items():
+                if filePath in toCompress:
+                    crc, compressedContent = next(compressedFiles)
+                    self._writeCompressedFile(filePath, len(toCompress[filePath][0]), crc, compressedContent)
+                else:
+                    self._writeFile(filePath, fileContent)
+
+    def _canWriteCompressedFiles(self):
+        """
+        Indica si puede usarse _writeCompressedFile: el epub debe escribirse en un archivo seekable que no tenga
+        otra escritura en curso, y zipfile debe tener todos los atributos internos que utiliza dicho método.
+        """
+        if not all(hasattr(self._epubFile, attr) for attr in EpubWriter._ZIPFILE_INTERNALS):
+            return False
+
+        return self._epubFile._seekable and not self._epubFile._writing and hasattr(zipfile.ZipInfo, "FileHeader")
+
+    def _writeCompressedFile(self, filePath, fileSize, crc, compressedContent):
+        """
+        Escribe en el epub un archivo ya comprimido con deflate. zipfile no permite agregar datos ya comprimidos,
+        por lo que escribo la entrada tal como lo haría ZipFile.writestr con un archivo seekable: el header local,
+        con el crc y los tamaños ya calculados, seguido de los datos comprimidos. Solamente puede llamarse si
+        _canWriteCompressedFiles retorna True.
+
+        @raise zipfile.LargeZipFile: si el archivo requiere ZIP64 y el epub no lo admite.
+        """
+        info = self._createZipInfo(filePath)
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o600 << 16
+        info.file_size = fileSize
+        info.compress_size = len(compressedContent)
+        info.CRC = crc
+
+        epubFile = self._epubFile
+
+        # Los mismos controles que hace ZipFile._open_to_write antes de escribir el header local.
+        zip64 = fileSize * 1.05 > zipfile.ZIP64_LIMIT
+        if zip64 and not epubFile._allowZip64:
+            raise zipfile.LargeZipFile("Filesize would require ZIP64 extensions")
+
+        with epubFile._lock:
+            if epubFile._writing:
+                raise ValueError("Can't write to ZIP archive while an open writing handle exists.")
+
+            epubFile.fp.seek(epubFile.start_dir)
+            info.header_offset = epubFile.fp.tell()
+            epubFile._writecheck(info)
+            epubFile._didModify = True
 
-        epubFile.close()
+            epubFile.fp.write(info.FileHeader(zip64))
+            epubFile.fp.write(compressedContent)
+
+            epubFile.start_dir = epubFile.fp.tell()
+            epubFile.filelist.append(info)
+            epubFile.NameToInfo[info.filename] = info
+
+    def _getCompression(self, filePath, fileSize):
+        return self._compression.getCompression(opf.getMediaType(filePath), fileSize)
+
+    def _copyZipMember(self, filePath, sourceZip, memberName):
+        sourceInfo = sourceZip.getinfo(memberName)
+
+        info = self._createZipInfo(filePath, sourceInfo.date_time)
+        info.compress_type, level = self._getCompression(filePath, sourceInfo.file_size)
+        info.file_size = sourceInfo.file_size
+
+        # ZipFile.open no recibe el nivel de compresión: se toma del ZipInfo. Solamente hace falta indicarlo si el
+        # archivo se comprime con un nivel distinto al de por defecto; los archivos sin comprimir no lo utilizan.
+        if level is not None:
+            if hasattr(info, "compress_level"):
+                info.compress_level = level
+            else:
+                # Antes de python 3.13, el atributo no era público.
+                info._compresslevel = level
+
+        with sourceZip.open(sourceInfo) as source, self._epubFile.open(info, "w") as target:
+            shutil.copyfileobj(source, target, EpubWriter._COPY_BUFFER_SIZE)
+
+    def _getSourceZip(self, zipFile):
+        if zipFile not in self._sourceZips:
+            self._sourceZips[zipFile] = zipfile.ZipFile(zipFile)
+
+        return self._sourceZips[zipFile]
+
+    def _createZipInfo(self, filePath, dateTime=None):
+        """
+        @param dateTime: la fecha del archivo, como una tupla de seis elementos (año, mes, día, hora, minutos y
+                         segundos). Si es None, se utiliza la fecha actual. Si el epub debe ser reproducible, se
+                         ignora.
+        """
+        if self._timestamp is not None:
+            dateTime = time.gmtime(self._timestamp)[:6]
+        elif dateTime is None:
+            dateTime = time.localtime(time.time())[:6]
+
+        return zipfile.ZipInfo(filePath, dateTime)
+
+    def _getModificationDate(self):
+        if self._timestamp is not None:
+            return datetime.datetime.fromtimestamp(self._timestamp, datetime.timezone.utc)
+        else:
+            return datetime.datetime.now()
+
+    def _getReproducibleTimestamp(self):
+        # Ver https://reproducible-builds.org/specs/source-date-epoch/.
+        timestamp = int(os.environ.get("SOURCE_DATE_EPOCH", EpubWriter._MIN_ZIP_TIMESTAMP))
+        return max(timestamp, EpubWriter._MIN_ZIP_TIMESTAMP)
 
     def _addIdentifier(self):
-        uid = "urn:uuid:{0}".format(str(uuid.uuid4()))
+        if self._contentDigest is not None:
+            uid = "urn:uuid:{0}".format(str(uuid.uuid5(uuid.NAMESPACE_OID, self._contentDigest.hexdigest())))
+        else:
+            uid = "urn:uuid:{0}".format(str(uuid.uuid4()))
         self._opf.metadata.addIdentifier(uid)
         self._toc.addIdentifier(uid)
 
@@ -140,4 +392,59 @@ class EpubWriter:
         rootFiles = etree.SubElement(container, "rootfiles")
         etree.SubElement(rootFiles, "rootfile", {"full-path": "OEBPS/content.opf", "media-type": "application/oebps-package+xml"})
 
-        return etree.tostring(container, encoding="UTF-8", xml_declaration=True, pretty_print=True)
\ No newline at end of file
+        return etree.tostring(container, encoding="UTF-8", xml_declaration=True, pretty_print=self._prettyPrint)
+
+
+class CompressionPolicy:
+    """
+    Indica cómo guardar cada archivo en el epub, de acuerdo a su media type y a su tamaño. El archivo mimetype
+    siempre se guarda sin comprimir, tal como lo exige el estándar.
+    """
+
+    __slots__ = ("level", "storeImages", "minSize")
+
+    def __init__(self, level=None, storeImages=True, minSize=0):
+        """
+        @param level: el nivel de compresión, de 1 (el más rápido) a 9 (el que mejor comprime), o None para
+                      utilizar el nivel por defecto de zlib.
+        @param storeImages: indica si las imágenes deben guardarse sin comprimir. Los formatos de imagen que
+                            admite el epub ya se encuentran comprimidos, por lo que volver a comprimirlos
+                            solamente consume tiempo.
+        @param minSize: el tamaño en bytes por debajo del cual los archivos se guardan sin comprimir.
+        """
+        self.level = level
+        self.storeImages = storeImages
+        self.minSize = minSize
+
+    def getCompression(self, mediaType, fileSize):
+        """
+        @param mediaType: el media type del archivo, o None si no figura en el manifest (por ejemplo, container.xml).
+        @param fileSize: el tamaño en bytes del archivo sin comprimir.
+
+        @return: una tupla de dos elementos: el método de compresión del zip y el nivel de compresión.
+        """
+        if (self.storeImages and mediaType and mediaType.startswith("image/")) or fileSize < self.minSize:
+            return zipfile.ZIP_STORED, None
+        else:
+            return zipfile.ZIP_DEFLATED, self.level
+
+
+# Las políticas de compresión predefinidas.
+# "default": comprime con el nivel por defecto todo salvo las imágenes.
+# "fast": pensada para generar borradores; comprime lo menos posible y no comprime los archivos pequeños.
+# "max": pensada para la versión final; obtiene el epub más pequeño a cambio de demorar más.
+COMPRESSION_PRESETS = {"default": CompressionPolicy(),
+                       "fast": CompressionPolicy(level=1, minSize=1024),
+                       "max": CompressionPolicy(level=9)}
+
+
+def _toBytes(content):
+    return content.encode("utf-8") if isinstance(content, str) else content
+
+
+class _ZipMember:
+    __slots__ = ("zipFile", "memberName")
+
+    def __init__(self, zipFile, memberName):
+        self.zipFile = zipFile
+        self.memberName = memberName
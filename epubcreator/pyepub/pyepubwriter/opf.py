@@ -1,4 +1,17 @@
-from lxml import etree
+import io
+
+from epubcreator.pyepub.pyepubwriter import xmlwriter
+
+
+def getMediaType(href):
+    """
+    Retorna el media type de un archivo de acuerdo a su extensión.
+
+    @param href: el nombre o path del archivo.
+
+    @return: un string, o None si la extensión no corresponde a ninguno de los tipos de archivo que admite el manifest.
+    """
+    return _ManifestItem._mediaTypes.get(href[href.rfind(".") + 1:].lower())
 
 
 class Opf:
@@ -11,18 +24,29 @@ class Opf:
         self.spine = Spine()
         self.guide = Guide()
 
-    def toXml(self):
-        return etree.tostring(self._generateOpf(), encoding="utf-8", xml_declaration=True, pretty_print=True)
+    def toXml(self, prettyPrint=True):
+        output = io.BytesIO()
+        self.write(output, prettyPrint)
+
+        return output.getvalue()
 
-    def _generateOpf(self):
-        opf = etree.Element("{{{0}}}package".format(Opf.OPF_NS), {"unique-identifier": "BookId", "version": "2.0"}, nsmap={None: Opf.OPF_NS})
+    def write(self, file, prettyPrint=True):
+        """
+        Escribe el opf a medida que lo genera, sin construir antes el árbol completo.
 
-        opf.append(self.metadata.toElement())
-        opf.append(self.manifest.toElement())
-        opf.append(self.spine.toElement())
-        opf.append(self.guide.toElement())
+        @param file: un objeto de tipo file.
+        @param prettyPrint: indica si el xml debe indentarse.
+        """
+        with xmlwriter.XmlWriter(file, prettyPrint) as writer:
+            writer.startElement("{{{0}}}package".format(Opf.OPF_NS), {"unique-identifier": "BookId", "version": "2.0"},
+                                nsmap={None: Opf.OPF_NS})
 
-        return opf
+            self.metadata.write(writer)
+            self.manifest.write(writer)
+            self.spine.write(writer)
+            self.guide.write(writer)
+
+            writer.endElement()
 
 
 class Manifest:
@@ -33,13 +57,13 @@ class Manifest:
     def addItem(self, href, itemId):
         self._items.append(_ManifestItem(href, itemId))
 
-    def toElement(self):
-        manifest = etree.Element("manifest")
+    def write(self, writer):
+        writer.startElement("manifest")
 
         for item in self._items:
-            manifest.append(item.toElement())
+            item.write(writer)
 
-        return manifest
+        writer.endElement()
 
 
 class Spine:
@@ -49,13 +73,17 @@ class Spine:
     def addItemRef(self, idRef):
         self._idsRef.append(idRef)
 
-    def toElement(self):
-        spine = etree.Element("spine", {"toc": "ncx"})
+    def write(self, writer):
+        if not self._idsRef:
+            writer.writeElement("spine", {"toc": "ncx"})
+            return
+
+        writer.startElement("spine", {"toc": "ncx"})
 
         for idRef in self._idsRef:
-            etree.SubElement(spine, "itemref", {"idref": idRef})
+            writer.writeElement("itemref", {"idref": idRef})
 
-        return spine
+        writer.endElement()
 
 
 class Metadata:
@@ -121,30 +149,46 @@ class Metadata:
         item = _MetadataItem(name, content)
         self._items.append(item)
 
-    def toElement(self):
-        metadata = etree.Element("metadata", nsmap={"opf": Opf.OPF_NS, "dc": Opf.DC_NS})
+    def write(self, writer):
+        if not self._dcItems and not self._items:
+            writer.writeElement("metadata")
+            return
+
+        writer.startElement("metadata", nsmap={"opf": Opf.OPF_NS, "dc": Opf.DC_NS})
 
         for dcItem in self._dcItems:
-            metadata.append(dcItem.toElement())
+            dcItem.write(writer)
 
         for item in self._items:
-            metadata.append(item.toElement())
+            item.write(writer)
 
-        return metadata
+        writer.endElement()
 
 
 class Guide:
     def __init__(self):
-        self._guide = etree.Element("guide")
+        # Una lista con los atributos de cada referencia.
+        self._references = []
 
     def addReference(self, href, title, type):
-        etree.SubElement(self._guide, "reference", {"href": href, "title": title, "type": type})
+        self._references.append({"href": href, "title": title, "type": type})
+
+    def write(self, writer):
+        if not self._references:
+            writer.writeElement("guide")
+            return
+
+        writer.startElement("guide")
+
+        for reference in self._references:
+            writer.writeElement("reference", reference)
 
-    def toElement(self):
-        return self._guide
+        writer.endElement()
 
 
 class _ManifestItem:
+    __slots__ = ("_href", "_itemId", "_mediaType")
+
     _mediaTypes = {"ncx": "application/x-dtbncx+xml",
                    "xhtml": "application/xhtml+xml",
                    "css": "text/css",
@@ -158,8 +202,8 @@ class _ManifestItem:
         self._itemId = itemId
         self._mediaType = self._getMediaType(href)
 
-    def toElement(self):
-        return etree.Element("item", {"href": self._href, "id": self._itemId, "media-type": self._mediaType})
+    def write(self, writer):
+        writer.writeElement("item", {"href": self._href, "id": self._itemId, "media-type": self._mediaType})
 
     def _getMediaType(self, href):
         ext = href[href.rfind(".") + 1:]
@@ -167,6 +211,8 @@ class _ManifestItem:
 
 
 class _MetadataDCItem:
+    __slots__ = ("_name", "_content", "_attributes", "_opfAttributes")
+
     def __init__(self, name, content):
         self._name = name
         self._content = content
@@ -179,26 +225,24 @@ class _MetadataDCItem:
     def addOpfAttribute(self, name, value):
         self._opfAttributes[name] = value
 
-    def toElement(self):
+    def write(self, writer):
         dc_ns = "{{{0}}}".format(Opf.DC_NS)
         opf_ns = "{{{0}}}".format(Opf.OPF_NS)
 
-        element = etree.Element(dc_ns + self._name)
-
-        for name, value in self._attributes.items():
-            element.set(name, value)
+        attributes = dict(self._attributes)
 
         for name, value in self._opfAttributes.items():
-            element.set(opf_ns + name, value)
+            attributes[opf_ns + name] = value
 
-        element.text = self._content
-        return element
+        writer.writeElement(dc_ns + self._name, attributes, self._content)
 
 
 class _MetadataItem:
+    __slots__ = ("_name", "_content")
+
     def __init__(self, name, content):
         self._name = name
         self._content = content
 
-    def toElement(self):
-        return etree.Element("meta", {"name": self._name, "content": self._content})
\ No newline at end of file
+    def write(self, writer):
+        writer.writeElement("meta", {"name": self._name, "content": self._content})
\ No newline at end of file
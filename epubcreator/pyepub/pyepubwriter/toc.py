@@ -1,4 +1,6 @@
-from lxml import etree
+import io
+
+from epubcreator.pyepub.pyepubwriter import xmlwriter
 
 
 class Toc:
@@ -21,55 +23,80 @@ class Toc:
 
         return navPoint
 
-    def toXml(self):
-        toc = etree.Element("{{{0}}}ncx".format(Toc._TOC_NS), {"version": "2005-1"}, nsmap={None: Toc._TOC_NS})
+    def toXml(self, prettyPrint=True):
+        output = io.BytesIO()
+        self.write(output, prettyPrint)
 
-        # Agrego todos los playorders e ids de los navpoints.
-        playOrder = 1
-        for navPoint in self._navPoints:
-            playOrder = self._appendNavPointsPlayOrderAndId(navPoint, playOrder)
+        return output.getvalue()
 
-        tocHead = etree.SubElement(toc, "head")
-        self._addRequiredTocHeadItems()
-        for headItem in self._headItems:
-            tocHead.append(headItem.toElement())
+    def write(self, file, prettyPrint=True):
+        """
+        Escribe la toc a medida que la genera, sin construir antes el árbol completo.
 
-        for metadataItem in self._metadataItems:
-            toc.append(metadataItem.toElement())
+        @param file: un objeto de tipo file.
+        @param prettyPrint: indica si el xml debe indentarse.
+        """
+        doctypeText = '<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN" "http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">'
 
-        navMap = etree.SubElement(toc, "navMap")
-        for navPoint in self._navPoints:
-            navMap.append(navPoint.toElement())
+        with xmlwriter.XmlWriter(file, prettyPrint, doctypeText) as writer:
+            writer.startElement("{{{0}}}ncx".format(Toc._TOC_NS), {"version": "2005-1"}, nsmap={None: Toc._TOC_NS})
 
-        doctypeText = '<!DOCTYPE ncx PUBLIC "-//NISO//DTD ncx 2005-1//EN" "http://www.daisy.org/z3986/2005/ncx-2005-1.dtd">'
-        return etree.tostring(toc, encoding="utf-8", xml_declaration=True, doctype=doctypeText, pretty_print=True)
+            writer.startElement("head")
+            for headItem in self._headItems + self._getRequiredTocHeadItems():
+                headItem.write(writer)
+            writer.endElement()
 
-    def _appendNavPointsPlayOrderAndId(self, navPoint, startPlayOrder):
-        """
-        Agrego los playorders e ids al navpoint pasado como parámetro, y recursivamente a todos sus navpoints
-        hijos también.
+            for metadataItem in self._metadataItems:
+                metadataItem.write(writer)
+
+            if self._navPoints:
+                writer.startElement("navMap")
+                self._writeNavPoints(writer)
+                writer.endElement()
+            else:
+                writer.writeElement("navMap")
 
-        @param navPoint: un objeto NavPoint.
-        @param startPlayOrder: el número de playorder desde el cual empezar a contar.
+            writer.endElement()
 
-        @return: el próximo número de playorder válido.
+    def _writeNavPoints(self, writer):
+        """
+        Escribe todos los navpoints, a la vez que les asigna los playorders e ids. Los recorro sin recursión, dado
+        que una toc puede tener miles de navpoints anidados: por cada nivel abierto, conservo un iterador sobre los
+        navpoints de dicho nivel que todavía falta escribir.
         """
-        navPoint.playOrder = startPlayOrder
-        navPoint.navId = "navPoint-{0}".format(startPlayOrder)
+        playOrder = 1
+        pending = [iter(self._navPoints)]
+
+        while pending:
+            navPoint = next(pending[-1], None)
+
+            if navPoint is None:
+                pending.pop()
 
-        nextPlayOrder = startPlayOrder + 1
-        for childNavPoint in navPoint.navPoints:
-            nextPlayOrder = self._appendNavPointsPlayOrderAndId(childNavPoint, nextPlayOrder)
+                # Terminé de escribir los hijos de un navpoint, por lo que debo cerrarlo.
+                if pending:
+                    writer.endElement()
+                continue
 
-        return nextPlayOrder
+            navPoint.playOrder = playOrder
+            navPoint.navId = "navPoint-{0}".format(playOrder)
+            playOrder += 1
 
-    def _addRequiredTocHeadItems(self):
-        self._headItems.append(_HeadItem("depth", "1"))
-        self._headItems.append(_HeadItem("totalPageCount", "0"))
-        self._headItems.append(_HeadItem("maxPageNumber", "0"))
+            writer.startElement("navPoint", {"id": navPoint.navId, "playOrder": str(navPoint.playOrder)})
+            writer.startElement("navLabel")
+            writer.writeElement("text", text=navPoint.title)
+            writer.endElement()
+            writer.writeElement("content", {"src": navPoint.ref})
+
+            pending.append(iter(navPoint.navPoints))
+
+    def _getRequiredTocHeadItems(self):
+        return [_HeadItem("depth", "1"), _HeadItem("totalPageCount", "0"), _HeadItem("maxPageNumber", "0")]
 
 
 class NavPoint:
+    __slots__ = ("navPoints", "ref", "title", "playOrder", "navId")
+
     def __init__(self, ref, title):
         # Una lista de NavPoint con los navpoints hijos.
         self.navPoints = []
@@ -89,37 +116,26 @@ class NavPoint:
 
         return navPoint
 
-    def toElement(self):
-        navPoint = etree.Element("navPoint", {"id": str(self.navId), "playOrder": str(self.playOrder)})
-        navLabel = etree.SubElement(navPoint, "navLabel")
-
-        textElement = etree.SubElement(navLabel, "text")
-        textElement.text = self.title
-
-        etree.SubElement(navPoint, "content", {"src": self.ref})
-
-        for nvPoint in self.navPoints:
-            navPoint.append(nvPoint.toElement())
-
-        return navPoint
-
 
 class _HeadItem:
+    __slots__ = ("_name", "_ref")
+
     def __init__(self, name, content):
         self._name = name
         self._ref = content
 
-    def toElement(self):
-        return etree.Element("meta", {"name": "dtb:{0}".format(self._name), "content": self._ref})
+    def write(self, writer):
+        writer.writeElement("meta", {"name": "dtb:{0}".format(self._name), "content": self._ref})
 
 
 class _MetadataItem:
+    __slots__ = ("_tag", "_ref")
+
     def __init__(self, tag, content):
         self._tag = tag
         self._ref = content
 
-    def toElement(self):
-        root = etree.Element(self._tag)
-        textElement = etree.SubElement(root, "text")
-        textElement.text = self._ref
-        return root
\ No newline at end of file
+    def write(self, writer):
+        writer.startElement(self._tag)
+        writer.writeElement("text", text=self._ref)
+        writer.endElement()
\ No newline at end of file
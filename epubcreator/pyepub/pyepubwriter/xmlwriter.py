@@ -0,0 +1,88 @@
+from lxml import etree
+
+
+class XmlWriter:
+    """
+    Escribe un xml de manera incremental, mediante etree.xmlfile, sin necesidad de construir antes el árbol
+    completo. Solamente se conservan en memoria los elementos abiertos, por lo que la memoria necesaria depende
+    de la profundidad del xml, y no de la cantidad de elementos. Si se lo indica, el xml se indenta exactamente
+    de la misma forma en que lo hace etree.tostring con pretty_print.
+
+    Uso:
+        with XmlWriter(file, prettyPrint) as writer:
+            writer.startElement("root")
+            writer.writeElement("child", {"attr": "value"})
+            writer.endElement()
+    """
+
+    def __init__(self, file, prettyPrint=True, doctype=None):
+        """
+        @param file: un objeto de tipo file, en el cual escribir el xml.
+        @param prettyPrint: indica si el xml debe indentarse.
+        @param doctype: un string con el doctype del xml, o None.
+        """
+        self._file = file
+        self._prettyPrint = prettyPrint
+        self._doctype = doctype
+
+        self._xmlFileContext = None
+        self._xmlFile = None
+
+        # Los elementos abiertos: una lista de los context managers que retorna xmlfile.element.
+        self._openedElements = []
+
+    def __enter__(self):
+        self._xmlFileContext = etree.xmlfile(self._file, encoding="utf-8")
+        self._xmlFile = self._xmlFileContext.__enter__()
+
+        self._xmlFile.write_declaration()
+        if self._doctype:
+            self._xmlFile.write_doctype(self._doctype)
+
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self._xmlFileContext.__exit__(excType, excValue, traceback)
+
+        # xmlfile no permite escribir nada luego del elemento raíz, pero etree.tostring agrega un salto de línea.
+        if excType is None and self._prettyPrint:
+            self._file.write(b"\n")
+
+    def startElement(self, tag, attributes=None, nsmap=None):
+        """
+        Abre un elemento, que debe tener al menos un hijo: los elementos vacíos deben escribirse con writeElement.
+        """
+        self._indent()
+
+        element = self._xmlFile.element(tag, attributes or {}, nsmap=nsmap)
+        element.__enter__()
+        self._openedElements.append(element)
+
+    def endElement(self):
+        element = self._openedElements.pop()
+
+        # El tag de cierre va en una nueva línea, incluso el del elemento raíz.
+        if self._prettyPrint:
+            self._xmlFile.write("\n" + "  " * len(self._openedElements))
+        element.__exit__(None, None, None)
+
+    def writeElement(self, tag, attributes=None, text=None):
+        """
+        Escribe un elemento sin hijos.
+
+        @param text: el texto del elemento, o None si el elemento es vacío. Los elementos vacíos no pueden
+                     pertenecer a un namespace.
+        """
+        self._indent()
+
+        if text is None:
+            self._xmlFile.write(etree.Element(tag, attributes or {}))
+        else:
+            # Escribo el elemento a través de xmlfile.element, para que reutilice los namespaces ya declarados en
+            # los elementos abiertos.
+            with self._xmlFile.element(tag, attributes or {}):
+                self._xmlFile.write(text)
+
+    def _indent(self):
+        if self._prettyPrint and self._openedElements:
+            self._xmlFile.write("\n" + "  " * len(self._openedElements))
@@ -0,0 +1,58 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from epubcreator import batch
+
+DOCX_TEST_DATA_DIR = os.path.join(os.path.dirname(__file__), "test_data", "converters", "docx")
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self._inputDir = tempfile.mkdtemp()
+        self._outputDir = tempfile.mkdtemp()
+
+        for docxName in ("footnotes.docx", "table.docx"):
+            shutil.copy(os.path.join(DOCX_TEST_DATA_DIR, docxName), self._inputDir)
+
+    def tearDown(self):
+        shutil.rmtree(self._inputDir, ignore_errors=True)
+        shutil.rmtree(self._outputDir, ignore_errors=True)
+
+    def test_find_input_files_in_manifest(self):
+        with open(os.path.join(self._inputDir, "manifest.txt"), "w", encoding="utf-8") as manifest:
+            manifest.write("# comentario\ntable.docx\n\nfootnotes.docx\n")
+
+        inputFiles = batch.findInputFiles([os.path.join(self._inputDir, "manifest.txt")])
+
+        self.assertEqual(inputFiles, [os.path.join(self._inputDir, "table.docx"), os.path.join(self._inputDir, "footnotes.docx")])
+
+    def test_convert_directory(self):
+        with open(os.path.join(self._inputDir, "footnotes.json"), "w", encoding="utf-8") as metadata:
+            json.dump({"title": "Notas", "authors": ["Edgar Allan Poe"]}, metadata)
+
+        with open(os.path.join(self._inputDir, "invalid.docx"), "w", encoding="utf-8") as invalidDocx:
+            invalidDocx.write("no es un docx")
+
+        reportFile = os.path.join(self._outputDir, "report.json")
+        exitCode = batch.main([self._inputDir, "-o", self._outputDir, "-j", "2", "-r", reportFile])
+
+        with open(reportFile, encoding="utf-8") as report:
+            records = {os.path.basename(r["file"]): r for r in (json.loads(line) for line in report)}
+
+        self.assertEqual(exitCode, 1)
+        self.assertEqual(records["invalid.docx"]["status"], "error")
+        self.assertEqual(records["table.docx"]["status"], "ok")
+        self.assertEqual(os.path.basename(records["footnotes.docx"]["output"]), "Poe, Edgar Allan - Notas [0000] (r1.0 Editor).epub")
+        self.assertTrue(os.path.isfile(records["footnotes.docx"]["output"]))
+
+    def test_timeout_fails_without_sigalrm(self):
+        with mock.patch("epubcreator.batch._canLimitTime", return_value=False):
+            with mock.patch("sys.stderr"), self.assertRaises(SystemExit):
+                batch.main([self._inputDir, "-o", self._outputDir, "-t", "10"])
+
+            self.assertRaises(ValueError, batch.convertFile, os.path.join(self._inputDir, "table.docx"),
+                              self._outputDir, {}, {}, 10)
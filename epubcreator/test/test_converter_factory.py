@@ -0,0 +1,76 @@
+import os
+import subprocess
+import sys
+import unittest
+from importlib import metadata
+from unittest import mock
+
+from epubcreator.converters import converter_factory
+from epubcreator.converters.docx import docx_converter
+
+# El tiempo máximo, en segundos, que pueden llevar los imports necesarios para importar epubcreator y listar los
+# tipos de archivo admitidos en un intérprete nuevo. No incluye el tiempo de inicio del propio intérprete, que
+# depende de la carga de la máquina y no del código de epubcreator.
+IMPORT_TIME_BUDGET = 0.5
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class ConverterFactoryTest(unittest.TestCase):
+    def test_listing_file_types_does_not_import_converters(self):
+        script = ("import sys, epubcreator\n"
+                  "from epubcreator.converters import converter_factory\n"
+                  "assert 'docx' in converter_factory.ConverterFactory.getSupportedFileTypes()\n"
+                  "assert 'lxml' not in sys.modules\n"
+                  "assert 'epubcreator.converters.docx.docx_converter' not in sys.modules\n")
+
+        importTime = getImportTime(script) - getImportTime("pass")
+
+        self.assertLess(importTime, IMPORT_TIME_BUDGET)
+
+    def test_load_entry_points(self):
+        group = converter_factory.ConverterFactory.ENTRY_POINTS_GROUP
+        entryPoints = [metadata.EntryPoint("fb2", "paquete.fb2_converter:Fb2Converter", group),
+                       metadata.EntryPoint("docx", "paquete.docx_converter:DocxConverter", group)]
+        expected = {"fb2": "paquete.fb2_converter:Fb2Converter"}
+
+        # Python 3.10 o posterior.
+        if hasattr(metadata, "EntryPoints"):
+            with mock.patch("importlib.metadata.entry_points", return_value=metadata.EntryPoints(entryPoints)):
+                self.assertEqual(converter_factory.ConverterFactory._loadEntryPoints(), expected)
+
+        # Python 3.8 y 3.9.
+        with mock.patch("importlib.metadata.entry_points", return_value={group: entryPoints}):
+            self.assertEqual(converter_factory.ConverterFactory._loadEntryPoints(), expected)
+
+    def test_register_converter(self):
+        converter_factory.ConverterFactory.registerConverter("docm", "epubcreator.converters.docx.docx_converter:DocxConverter")
+
+        try:
+            self.assertIn("docm", converter_factory.ConverterFactory.getSupportedFileTypes())
+            self.assertIs(converter_factory.ConverterFactory.getConverterClass("docm"), docx_converter.DocxConverter)
+        finally:
+            converter_factory.ConverterFactory._registry.pop("docm")
+            converter_factory.ConverterFactory._converters.pop("docm")
+
+
+def getImportTime(script):
+    """
+    Ejecuta un script en un intérprete nuevo con -X importtime, y retorna cuánto tiempo llevaron sus imports,
+    incluyendo los que el intérprete realiza al iniciar.
+
+    @return: el tiempo en segundos.
+    """
+    process = subprocess.run((sys.executable, "-X", "importtime", "-c", script), cwd=ROOT_DIR,
+                             stderr=subprocess.PIPE, universal_newlines=True, check=True)
+
+    # Cada línea tiene la forma "import time: self [us] | cumulative | imported package". El tiempo acumulado
+    # de los módulos sin indentar ya incluye el de los módulos que estos importan.
+    microseconds = 0
+    for line in process.stderr.splitlines():
+        if line.startswith("import time:"):
+            selfTime, cumulativeTime, module = line[len("import time:"):].split("|")
+            if cumulativeTime.strip().isdigit() and not module[1:].startswith(" "):
+                microseconds += int(cumulativeTime)
+
+    return microseconds / 1000000
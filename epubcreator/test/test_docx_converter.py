@@ -1,8 +1,11 @@
+import io
 import os
 import unittest
 import sys
+import tempfile
+import zipfile
 
-from epubcreator.converters.docx import docx_converter
+from epubcreator.converters.docx import docx_converter, styles, utils as docx_utils
 from epubcreator.misc import utils
 
 TESTS_WITH_CUSTOM_OPTIONS = {"character_styles": dict(ignoreEmptyParagraphs=False),
@@ -19,6 +22,211 @@ class DocxConverterTest(unittest.TestCase):
 
         self.assertEqual(len(list(ebookData.iterImages())), 9)
 
+    def test_xpath_stats(self):
+        docx_utils.enableXPathStats()
+
+        try:
+            converter = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, "formats.docx"))
+            converter.convert()
+
+            stats = {path: (hits, seconds) for path, hits, seconds in docx_utils.getXPathStats()}
+        finally:
+            docx_utils.enableXPathStats(False)
+
+        self.assertGreater(stats["w:rPr"][0], 0)
+        self.assertEqual(docx_utils.getXPathStats(), [])
+
+    def test_streaming_text_digests_are_the_same(self):
+        for docxName in ("footnotes.docx", "table.docx", "shape.docx"):
+            converter = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName))
+            ebookData = converter.convert()
+
+            streamingConverter = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName), streamDocument=True)
+            streamingConverter.convert()
+
+            self.assertEqual(ebookData.compareText(streamingConverter.getTextDigests()), [])
+            self.assertEqual(converter.getTextDigests(), streamingConverter.getTextDigests())
+
+            # En modo streaming no se conserva el texto del documento.
+            self.assertRaises(ValueError, streamingConverter.getRawText)
+
+    def test_stream_sections_output_is_the_same(self):
+        for docxName in ("footnotes_images.docx", "table.docx", "character_styles.docx"):
+            ebookData = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName)).convert()
+            streamedEbookData = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName), streamSections=True).convert()
+
+            for section, streamedSection in zip(ebookData.iterAllSections(), streamedEbookData.iterAllSections()):
+                self.assertEqual(section.toHtml(), streamedSection.toHtml())
+                self.assertEqual(section.toRawText(), streamedSection.toRawText())
+
+            # Lo mismo si las notas se dividen en varios xhtml.
+            for section, streamedSection in zip(ebookData.iterTextSections(), streamedEbookData.iterTextSections()):
+                self.assertEqual(section.toHtml(notesPerFile=1), streamedSection.toHtml(notesPerFile=1))
+            for section, streamedSection in zip(ebookData.iterNotesSections(), streamedEbookData.iterNotesSections()):
+                self.assertEqual(section.toHtmlFiles(1), streamedSection.toHtmlFiles(1))
+
+    def test_spilled_sections_output_is_the_same(self):
+        for docxName in ("footnotes_images.docx", "table.docx", "character_styles.docx"):
+            ebookData = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName)).convert()
+            spilledEbookData = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName), memoryLimit=1).convert()
+
+            for section, spilledSection in zip(ebookData.iterAllSections(), spilledEbookData.iterAllSections()):
+                self.assertEqual(section.toHtml(), spilledSection.toHtml())
+                self.assertEqual(section.toRawText(), spilledSection.toRawText())
+
+            for section, spilledSection in zip(ebookData.iterTextSections(), spilledEbookData.iterTextSections()):
+                self.assertEqual(section.toHtml(notesPerFile=1), spilledSection.toHtml(notesPerFile=1))
+            for section, spilledSection in zip(ebookData.iterNotesSections(), spilledEbookData.iterNotesSections()):
+                self.assertEqual(section.toHtmlFiles(1), spilledSection.toHtmlFiles(1))
+
+    def test_sections_are_split_by_length(self):
+        converter = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, "footnotes.docx"), maxSectionLength=50)
+        ebookData = converter.convert()
+        textSections = {section.name: section for section in ebookData.iterTextSections()}
+
+        self.assertGreater(len(textSections), 2)
+        self.assertEqual(ebookData.compareText(converter.getTextDigests()), [])
+
+        # Los links de retorno de las notas deben apuntar a la sección en la cual quedó cada referencia.
+        notesSection = next(ebookData.iterNotesSections())
+        for href in notesSection.xpath("//a/@href"):
+            sectionName, referenceId = href[len("../Text/"):].split("#")
+            self.assertTrue(textSections[sectionName].xpath("//a[@id='{0}']".format(referenceId)))
+
+    def test_text_digests_match(self):
+        for docxName in ("footnotes.docx", "table.docx", "shape.docx", "pagebreaks_end_paragraph.docx"):
+            converter = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, docxName))
+            ebookData = converter.convert()
+
+            self.assertEqual(ebookData.compareText(converter.getTextDigests()), [])
+
+        textDigests = converter.getTextDigests()
+        lastSectionName = list(ebookData.iterTextSections())[-1].name
+        textDigests[lastSectionName].update("texto perdido")
+
+        self.assertEqual(ebookData.compareText(textDigests), [lastSectionName])
+
+    def test_run_formats_cache(self):
+        converter = docx_converter.DocxConverter(os.path.join(TEST_DATA_DIR, "styles_with_formats.docx"),
+                                                 runFormatsCacheSize=2)
+        converter.convert()
+        stats = converter.getRunFormatsCacheStats()
+
+        self.assertGreater(stats["hits"], 0)
+        self.assertGreater(stats["misses"], 2)
+        self.assertEqual(stats["size"], 2)
+
+    def test_styles_are_resolved_through_based_on(self):
+        stylesXml = io.BytesIO("""<?xml version="1.0" encoding="UTF-8"?>
+            <w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+                <w:docDefaults><w:rPrDefault><w:rPr><w:u w:val="single"/></w:rPr></w:rPrDefault></w:docDefaults>
+                <w:style w:type="character" w:styleId="base"><w:name w:val="base"/><w:rPr><w:i/></w:rPr></w:style>
+                <w:style w:type="character" w:styleId="child"><w:name w:val="epub_child"/><w:basedOn w:val="base"/>
+                    <w:rPr><w:b/><w:u w:val="none"/></w:rPr></w:style>
+                <w:style w:type="paragraph" w:styleId="h2"><w:name w:val="heading 2"/></w:style>
+                <w:style w:type="paragraph" w:styleId="loop"><w:name w:val="loop"/><w:basedOn w:val="loop"/></w:style>
+            </w:styles>""".encode())
+
+        docxStyles = styles.Styles(stylesXml)
+
+        self.assertEqual(docxStyles.getDefaultRunFormats(), ("ins",))
+        self.assertEqual(docxStyles.getStyle("base").formats, ("em",))
+        self.assertEqual(docxStyles.getStyle("child").formats, ("strong", "em"))
+        self.assertEqual(docxStyles.getStyle("child").disabledFormats, ("ins",))
+        self.assertEqual(docxStyles.getStyle("child").className, "child")
+        self.assertEqual(docxStyles.getStyle("h2").headingLevel, 2)
+        self.assertIsNone(docxStyles.getStyle("loop").headingLevel)
+        self.assertIsNone(docxStyles.getStyle("missing"))
+
+    def test_default_and_paragraph_style_formats_reach_runs(self):
+        stylesXml = """<w:styles xmlns:w="{0}">
+                <w:docDefaults><w:rPrDefault><w:rPr><w:b/></w:rPr></w:rPrDefault></w:docDefaults>
+                <w:style w:type="paragraph" w:styleId="cita"><w:name w:val="cita"/><w:rPr><w:i/></w:rPr></w:style>
+            </w:styles>"""
+        body = """<w:p><w:r><w:t>negrita</w:t></w:r></w:p>
+                  <w:p><w:pPr><w:pStyle w:val="cita"/></w:pPr><w:r><w:t>cita</w:t></w:r></w:p>
+                  <w:p><w:pPr><w:pStyle w:val="cita"/></w:pPr><w:r><w:rPr><w:b w:val="0"/></w:rPr><w:t>sin negrita</w:t></w:r></w:p>"""
+        ebookData = docx_converter.DocxConverter(makeDocx(body, stylesXml)).convert()
+        section = next(ebookData.iterTextSections())
+
+        self.assertEqual(section.xpath("//p[1]/strong/text()"), ["negrita"])
+        self.assertEqual(section.xpath("//p[2]/em/strong/text()"), ["cita"])
+        self.assertEqual(section.xpath("//p[3]/em/text()"), ["sin negrita"])
+        self.assertFalse(section.xpath("//p[3]//strong"))
+
+    def test_repeated_footnote_reference(self):
+        footnotesXml = """<w:footnotes xmlns:w="{0}">
+                <w:footnote w:id="1"><w:p><w:r><w:t>nota</w:t></w:r></w:p></w:footnote>
+            </w:footnotes>"""
+        body = """<w:p><w:r><w:t>uno</w:t></w:r><w:r><w:footnoteReference w:id="1"/></w:r></w:p>
+                  <w:p><w:r><w:t>dos</w:t></w:r><w:r><w:footnoteReference w:id="1"/></w:r></w:p>"""
+        converter = docx_converter.DocxConverter(makeDocx(body, footnotesXml=footnotesXml))
+        ebookData = converter.convert()
+        notesSection = next(ebookData.iterNotesSections())
+
+        self.assertEqual(notesSection.xpath("//div[@class='nota']/p/text()[normalize-space()]"), ["nota ", "nota "])
+        self.assertEqual(ebookData.compareText(converter.getTextDigests()), [])
+        self.assertEqual(converter.getRawText(), "unodosnota")
+
+    def test_identical_images_with_different_names(self):
+        body = """<w:p><w:r><w:pict><v:shape><v:imagedata r:id="image1.png"/></v:shape></w:pict></w:r></w:p>
+                  <w:p><w:r><w:pict><v:shape><v:imagedata r:id="image2.png"/></v:shape></w:pict></w:r></w:p>"""
+        images = {"image1.png": b"\x89PNG1", "image2.png": b"\x89PNG1"}
+
+        # Las imágenes de un docx en disco se agregan mediante addZipImage.
+        with tempfile.TemporaryDirectory() as tempDir:
+            docxPath = os.path.join(tempDir, "imagenes.docx")
+            with open(docxPath, "wb") as file:
+                file.write(makeDocx(body, images=images).getvalue())
+
+            ebookData = docx_converter.DocxConverter(docxPath).convert()
+            section = next(ebookData.iterTextSections())
+
+            self.assertEqual([image.name for image in ebookData.iterImages()], ["image1.png"])
+            self.assertEqual(section.xpath("//img/@src"), ["../Images/image1.png", "../Images/image1.png"])
+
+
+def makeDocx(body, stylesXml=None, footnotesXml=None, images=None):
+    """
+    Crea en memoria un docx mínimo.
+
+    @param body: un string con el contenido de w:body.
+    @param stylesXml: un string con el contenido de styles.xml, o None si el docx no tiene estilos. La
+                      cadena "{0}" se reemplaza por el namespace de WordprocessingML.
+    @param footnotesXml: lo mismo que stylesXml, pero con el contenido de footnotes.xml.
+    @param images: un diccionario con el nombre y el contenido de las imágenes de word/media. Cada imagen se
+                   referencia desde body con su nombre como id, por ejemplo: <v:imagedata r:id="image1.png"/>.
+
+    @return: un objeto BytesIO con el docx.
+    """
+    relsNs = "http://schemas.openxmlformats.org/package/2006/relationships"
+    officeRelsNs = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+    wordNs = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+
+    parts = {"styles": stylesXml, "footnotes": footnotesXml}
+    parts = {name: xml for name, xml in parts.items() if xml is not None}
+    images = images or {}
+    documentRels = "".join('<Relationship Id="{0}" Type="{1}/{0}" Target="{0}.xml"/>'.format(name, officeRelsNs)
+                           for name in parts)
+    documentRels += "".join('<Relationship Id="{0}" Type="{1}/image" Target="media/{0}"/>'.format(name, officeRelsNs)
+                            for name in images)
+
+    file = io.BytesIO()
+    with zipfile.ZipFile(file, "w") as docx:
+        docx.writestr("_rels/.rels", '<Relationships xmlns="{0}"><Relationship Id="rId1" Type="{1}/officeDocument" '
+                                     'Target="word/document.xml"/></Relationships>'.format(relsNs, officeRelsNs))
+        docx.writestr("word/_rels/document.xml.rels", '<Relationships xmlns="{0}">{1}</Relationships>'.format(relsNs, documentRels))
+        docx.writestr("word/document.xml", '<w:document xmlns:w="{0}" xmlns:r="{1}" xmlns:v="{2}"><w:body>{3}</w:body>'
+                                           '</w:document>'.format(wordNs, officeRelsNs, docx_utils.NAMESPACES["v"], body))
+        for name, xml in parts.items():
+            docx.writestr("word/{0}.xml".format(name), xml.format(wordNs))
+        for name, content in images.items():
+            docx.writestr("word/media/{0}".format(name), content)
+
+    file.seek(0)
+    return file
+
+
 
 def makeTest(docxFilePath, outputFolder, **options):
     def test(self):
@@ -54,6 +262,9 @@ def generateTests():
 
         setattr(DocxConverterTest, "test_{0}".format(testName), makeTest(test, testExpectedOutputDir, **options))
 
+        # Todos los tests deben dar el mismo resultado al procesar el documento en modo streaming.
+        setattr(DocxConverterTest, "test_{0}_streaming".format(testName), makeTest(test, testExpectedOutputDir, streamDocument=True, **options))
+
 
 def load_tests(loader, tests, pattern):
     generateTests()
@@ -2,6 +2,8 @@ import unittest
 import tempfile
 import datetime
 import io
+import os
+import zipfile
 
 from lxml import etree
 from PIL import Image
@@ -1197,6 +1199,26 @@ class TocTest(unittest.TestCase):
         self.assertEqual(titles, ["Título con un salto de línea manual", "Título con dos saltos de líneas manuales"])
 
 
+    def test_headings_are_recorded_when_sections_are_saved(self):
+        ebookData = ebook_data.EbookData()
+        section = ebookData.createTextSection()
+
+        section.openHeading(1)
+        section.appendText("Título con un")
+        section.openTag("br")
+        section.closeTag("br")
+        section.appendText("salto de línea")
+        section.closeHeading(1)
+
+        self.assertEqual(list(ebookData.iterTextHeadings()), [])
+
+        section.save()
+        ebookData.createNotesSection().save()
+
+        self.assertEqual(list(ebookData.iterTextHeadings()),
+                         [ebook_data.Heading(1, "heading_id_1", "Section0001.xhtml", "Título con un salto de línea")])
+        self.assertEqual(list(ebookData.iterNotesHeadings()), [ebook_data.Heading(1, None, "notas.xhtml", "Notas")])
+
 class EpubFileNameTest(unittest.TestCase):
     def setUp(self):
         self._common = Common()
@@ -1338,6 +1360,34 @@ class ImagesTest(unittest.TestCase):
         coverImage = self._common.outputEpub.read(self._common.outputEpub.getFullPathToFile("cover.jpg"))
         self.assertEqual(coverImage, buffer.getvalue())
 
+    def test_identical_images_are_added_once(self):
+        ebookData = ebook_data.EbookData()
+
+        self.assertEqual(ebookData.addImage("image1.png", b"\x89PNG1"), "image1.png")
+        self.assertEqual(ebookData.addImage("image2.png", b"\x89PNG1"), "image1.png")
+        self.assertEqual(ebookData.addImage("image3.png", b"\x89PNG2"), "image3.png")
+
+        self.assertEqual([image.name for image in ebookData.iterImages()], ["image1.png", "image3.png"])
+
+    def test_identical_zip_images_are_added_once(self):
+        with tempfile.TemporaryDirectory() as tempDir:
+            zipPath = os.path.join(tempDir, "imagenes.zip")
+            with zipfile.ZipFile(zipPath, "w") as file:
+                file.writestr("image1.png", b"\x89PNG1")
+                file.writestr("image2.png", b"\x89PNG1")
+                file.writestr("image3.png", b"\x89PNG2")
+                info = file.getinfo("image2.png")
+
+            ebookData = ebook_data.EbookData()
+
+            self.assertEqual(ebookData.addZipImage("image1.png", zipPath, "image1.png"), "image1.png")
+            self.assertEqual(ebookData.addZipImage("image2.png", zipPath, "image2.png", (info.CRC, info.file_size)),
+                             "image1.png")
+            self.assertEqual(ebookData.addZipImage("image3.png", zipPath, "image3.png"), "image3.png")
+            self.assertEqual(ebookData.addImage("image4.png", b"\x89PNG2"), "image3.png")
+
+            self.assertEqual([image.name for image in ebookData.iterImages()], ["image1.png", "image3.png"])
+
     def test_only_one_author_image_exists_when_no_authors_but_include_optional_files(self):
         self._common.metadata.authors.clear()
 
@@ -1426,6 +1476,183 @@ class MiscTest(unittest.TestCase):
 
         self.assertTrue(self._common.outputEpub.hasFile("com.apple.ibooks.display-options.xml"))
 
+    def test_compact_output_has_the_same_text(self):
+        ebookData = ebook_data.EbookData()
+        section = ebookData.createTextSection()
+        section.openHeading(1)
+        section.appendText("Capítulo 1")
+        section.closeHeading(1)
+        section.openTag("p")
+        section.openTag("em")
+        section.appendText("Párrafo")
+        section.closeTag("em")
+        section.appendText(" con nota.")
+        section.insertNoteReference()
+        section.closeTag("p")
+        section.save()
+
+        notesSection = ebookData.createNotesSection()
+        notesSection.openNote()
+        notesSection.openTag("p")
+        notesSection.appendText("Una nota.")
+        notesSection.closeTag("p")
+        notesSection.closeNote()
+        notesSection.save()
+
+        texts = []
+        sizes = []
+
+        for compactOutput in (False, True):
+            self._common.generateEbook(ebookData, compactOutput=compactOutput)
+
+            text = {}
+            size = 0
+
+            for fileName in ("OEBPS/Text/Section0001.xhtml", "OEBPS/Text/notas.xhtml", "OEBPS/toc.ncx"):
+                content = self._common.outputEpub.read(fileName)
+                text[fileName] = [t.strip() for t in etree.fromstring(content).itertext() if t.strip()]
+                size += len(content)
+
+            texts.append(text)
+            sizes.append(size)
+
+            self._common.release()
+            self._common = Common()
+
+        self.assertEqual(texts[0], texts[1])
+        self.assertLess(sizes[1], sizes[0])
+
+    def test_sections_serialized_in_parallel_keep_their_order(self):
+        ebookData = ebook_data.EbookData()
+
+        for i in range(20):
+            section = ebookData.createTextSection()
+            section.openHeading(1)
+            section.appendText("Capítulo {0}".format(i + 1))
+            section.closeHeading(1)
+            section.save()
+
+        results = []
+
+        for workers in (1, 4):
+            self._common.generateEbook(ebookData, workers=workers)
+
+            outputEpub = self._common.outputEpub
+            fileNames = outputEpub.getHtmlFileNamesReadingOrder()
+            results.append((fileNames, outputEpub.getTitles(),
+                            [outputEpub.read(outputEpub.getFullPathToFile(name)) for name in fileNames]))
+
+            self._common.release()
+            self._common = Common()
+
+        self.assertEqual(results[0], results[1])
+
+    def test_records_have_no_dict(self):
+        # Los registros de los cuales se crean muchas instancias usan __slots__, para no tener un __dict__ cada una.
+        content = b"contenido"
+
+        records = (ebook_data.Image("imagen.jpg", content),
+                   ebook_data.ZipImage("imagen.jpg", "archivo.zip", "imagen.jpg"),
+                   ebook_metadata.Person("Nombre", "Apellido"),
+                   ebook_metadata.Genre("Tipo", "Género", "Subgénero"))
+
+        for record in records:
+            self.assertFalse(hasattr(record, "__dict__"), type(record).__name__)
+
+    def test_zip_image_content_is_read_only(self):
+        image = ebook_data.ZipImage("imagen.jpg", "archivo.zip", "imagen.jpg")
+
+        with self.assertRaises(AttributeError):
+            image.content = b"contenido"
+
+    def test_section_html_is_cached_once_saved(self):
+        section = ebook_data.EbookData().createTextSection()
+        section.openTag("p")
+        section.appendText("Párrafo 1.")
+        section.closeTag("p")
+
+        # Mientras la sección no se guarde, el xhtml no se conserva.
+        self.assertIsNot(section.toHtml(), section.toHtml())
+
+        section.save()
+        html = section.toHtml()
+
+        self.assertIs(section.toHtml(), html)
+        self.assertNotEqual(section.toHtml(prettyPrint=False), html)
+
+        # Solamente se conserva el último xhtml generado.
+        htmlWithNotes = section.toHtml(notesPerFile=1)
+        self.assertIs(section.toHtml(notesPerFile=1), htmlWithNotes)
+        self.assertIsNot(section.toHtml(), html)
+        self.assertEqual(section.toHtml(), html)
+
+        # Si la sección se modifica luego de guardarla, el xhtml vuelve a generarse.
+        html = section.toHtml()
+        section.openTag("p")
+        section.appendText("Párrafo 2.")
+        section.closeTag("p")
+
+        modifiedHtml = section.toHtml()
+        self.assertIn("Párrafo 2.".encode(), modifiedHtml)
+        self.assertNotIn("Párrafo 2.".encode(), html)
+        self.assertIs(section.toHtml(), modifiedHtml)
+
+    def test_spilled_section_html_is_not_cached(self):
+        section = ebook_data.EbookData(memoryLimit=1).createTextSection()
+        section.openTag("p")
+        section.appendText("Párrafo 1.")
+        section.closeTag("p")
+        section.save()
+
+        # Conservar el xhtml de una sección volcada a disco anularía el límite de memoria.
+        html = section.toHtml()
+        self.assertIsNot(section.toHtml(), html)
+        self.assertEqual(section.toHtml(), html)
+
+
+class NotesTest(unittest.TestCase):
+    def setUp(self):
+        self._common = Common()
+
+    def tearDown(self):
+        self._common.release()
+
+    def test_notes_are_split_in_several_files(self):
+        ebookData = ebook_data.EbookData()
+        section = ebookData.createTextSection()
+
+        for i in range(5):
+            section.appendText("Párrafo con nota.")
+            section.insertNoteReference()
+
+        section.save()
+
+        notesSection = ebookData.createNotesSection()
+
+        for i in range(5):
+            notesSection.openNote()
+            notesSection.openTag("p")
+            notesSection.appendText("Nota {0}.".format(i + 1))
+            notesSection.closeTag("p")
+            notesSection.closeNote()
+
+        notesSection.save()
+
+        self._common.generateEbook(ebookData, notesPerFile=2)
+
+        self.assertFalse(self._common.outputEpub.hasFile("notas.xhtml"))
+        self.assertEqual(self._common.outputEpub.getHtmlFileNamesReadingOrder()[-3:], ["notas1.xhtml", "notas2.xhtml", "notas3.xhtml"])
+        self.assertEqual(self._common.outputEpub.getTitles()[-1], ("Notas", "notas1.xhtml", []))
+
+        text = etree.parse(self._common.outputEpub.open("OEBPS/Text/Section0001.xhtml"))
+        self.assertEqual(self._common.xpath(text, "//x:a/@href"), ["../Text/notas1.xhtml#nt1", "../Text/notas1.xhtml#nt2",
+                                                                   "../Text/notas2.xhtml#nt3", "../Text/notas2.xhtml#nt4",
+                                                                   "../Text/notas3.xhtml#nt5"])
+
+        notes = etree.parse(self._common.outputEpub.open("OEBPS/Text/notas2.xhtml"))
+        self.assertEqual(self._common.xpath(notes, "//x:p/@id"), ["nt3", "nt4"])
+        self.assertEqual(self._common.xpath(notes, "//x:a/@href"), ["../Text/Section0001.xhtml#rf3", "../Text/Section0001.xhtml#rf4"])
+
 
 class Common:
     NAMESPACES = {"x": "http://www.w3.org/1999/xhtml"}
@@ -1439,10 +1666,10 @@ class Common:
     def xpath(self, element, xpath):
         return element.xpath(xpath, namespaces=Common.NAMESPACES)
 
-    def generateEbook(self, ebookData=None, includeOptionalFiles=True):
+    def generateEbook(self, ebookData=None, includeOptionalFiles=True, **options):
         ebookData = ebookData or ebook_data.EbookData()
 
-        eebook = ebook.Ebook(ebookData, self.metadata, includeOptionalFiles=includeOptionalFiles)
+        eebook = ebook.Ebook(ebookData, self.metadata, includeOptionalFiles=includeOptionalFiles, **options)
         fileName = eebook.save(self._outputFile)
         self.outputEpub = epub.EpubReader(self._outputFile)
 
@@ -2,10 +2,18 @@ import unittest
 import zipfile
 import tempfile
 import datetime
+import io
+import random
+import sys
+import uuid
+import zlib
+from unittest import mock
 
 from lxml import etree
 
 import epubcreator.pyepub.pyepubwriter.epub
+import epubcreator.pyepub.pyepubwriter.opf
+import epubcreator.pyepub.pyepubwriter.toc
 
 
 class PyEpubWriterTest(unittest.TestCase):
@@ -177,6 +185,173 @@ class PyEpubWriterTest(unittest.TestCase):
         self.assertEqual(len(self._xpath(opf, "/opf:package/opf:manifest/opf:item[@href = 'Styles/style.css' and "
                                               "@id = 'style.css' and @media-type = 'text/css']")), 1)
 
+    def test_adding_image_from_zip(self):
+        with tempfile.NamedTemporaryFile(suffix=".zip") as sourceFile:
+            with zipfile.ZipFile(sourceFile, "w") as sourceZip:
+                sourceZip.writestr("word/media/image1.png", b"\x89PNG" * 1000, compress_type=zipfile.ZIP_DEFLATED)
+            sourceFile.flush()
+
+            self._epub.addImageFromZip("image1.png", sourceFile.name, "word/media/image1.png")
+            self._generateEpub()
+
+        info = self._resultingEpub.getinfo("OEBPS/Images/image1.png")
+
+        self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(self._resultingEpub.read(info), b"\x89PNG" * 1000)
+
+    def test_adding_image_from_zip_with_compression_level(self):
+        words = random.Random(0)
+        content = " ".join(words.choice(("libro", "capítulo", "noche", "ciudad")) for _ in range(5000)).encode()
+
+        with tempfile.NamedTemporaryFile(suffix=".zip") as sourceFile:
+            with zipfile.ZipFile(sourceFile, "w") as sourceZip:
+                sourceZip.writestr("word/media/image1.png", content)
+            sourceFile.flush()
+
+            compression = epubcreator.pyepub.pyepubwriter.epub.CompressionPolicy(level=1, storeImages=False)
+            self._epub = epubcreator.pyepub.pyepubwriter.epub.EpubWriter(compression=compression)
+            self._epub.addImageFromZip("image1.png", sourceFile.name, "word/media/image1.png")
+            self._generateEpub()
+
+        info = self._resultingEpub.getinfo("OEBPS/Images/image1.png")
+        compressor = zlib.compressobj(1, zlib.DEFLATED, -15)
+
+        self.assertEqual(info.compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(info.compress_size, len(compressor.compress(content) + compressor.flush()))
+        self.assertEqual(self._resultingEpub.read(info), content)
+
+    def test_files_are_written_as_they_are_added_when_streaming(self):
+        self._epub = epubcreator.pyepub.pyepubwriter.epub.EpubWriter(outputFile=self._outputFile)
+        self._epub.addHtmlData("Section0000.xhtml", "bla")
+
+        # El archivo ya fue escrito, por lo que no lo conservo en memoria.
+        self.assertEqual(self._epub._files, {})
+
+        self._epub.addImageData("image1.png", b"\x89PNG")
+        self._epub.addNavPoint("Section0000.xhtml", "Título")
+        self._epub.generate()
+        self._resultingEpub = zipfile.ZipFile(self._outputFile)
+
+        self.assertEqual(self._resultingEpub.namelist(), ["mimetype", "META-INF/container.xml", "OEBPS/Text/Section0000.xhtml",
+                                                          "OEBPS/Images/image1.png", "OEBPS/content.opf", "OEBPS/toc.ncx"])
+        self.assertEqual(self._resultingEpub.getinfo("mimetype").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(self._resultingEpub.read("OEBPS/Text/Section0000.xhtml"), b"bla")
+
+    def test_parallel_compression_output_is_the_same(self):
+        def generate(workers, compression):
+            epub = epubcreator.pyepub.pyepubwriter.epub.EpubWriter(workers=workers, compression=compression)
+            words = random.Random(0)
+            for i in range(20):
+                text = " ".join(words.choice(("libro", "capítulo", "noche", "ciudad", "tiempo")) for _ in range(i * 500))
+                epub.addHtmlData("Section{0:04}.xhtml".format(i), "<p>{0}</p>".format(text))
+            epub.addImageData("image1.png", b"\x89PNG" * 1000)
+            epub.addStyleData("style.css", b"p { margin: 0; }")
+
+            outputFile = io.BytesIO()
+            epub.generate(outputFile)
+            return outputFile.getvalue()
+
+        # Fijo la hora y el identificador, para que ambos epubs puedan compararse byte a byte.
+        with mock.patch("time.time", return_value=1400000000), mock.patch("uuid.uuid4", return_value=uuid.UUID(int=0)):
+            for compression in epubcreator.pyepub.pyepubwriter.epub.COMPRESSION_PRESETS.values():
+                parallelOutput = generate(4, compression)
+
+                self.assertEqual(generate(1, compression), parallelOutput)
+                with zipfile.ZipFile(io.BytesIO(parallelOutput)) as resultingEpub:
+                    self.assertIsNone(resultingEpub.testzip())
+
+    def test_parallel_compression_output_is_the_same_with_zip64_entries(self):
+        def generate(workers):
+            epub = epubcreator.pyepub.pyepubwriter.epub.EpubWriter(workers=workers)
+            for i in range(5):
+                epub.addHtmlData("Section{0:04}.xhtml".format(i), "<p>{0}</p>".format("texto " * (i * 2000)))
+
+            outputFile = io.BytesIO()
+            epub.generate(outputFile)
+            return outputFile.getvalue()
+
+        # Reduzco el límite de zipfile para no tener que generar archivos de más de 2 GiB: las entradas grandes se
+        # escriben con los headers ZIP64, tanto al comprimir de a uno como en paralelo.
+        with mock.patch("time.time", return_value=1400000000), mock.patch("uuid.uuid4", return_value=uuid.UUID(int=0)):
+            with mock.patch("zipfile.ZIP64_LIMIT", 4096):
+                serialOutput = generate(1)
+                parallelOutput = generate(4)
+
+        self.assertEqual(serialOutput, parallelOutput)
+        for output in (serialOutput, parallelOutput):
+            with zipfile.ZipFile(io.BytesIO(output)) as resultingEpub:
+                self.assertIsNone(resultingEpub.testzip())
+
+                # El tag 0x0001 indica un campo extra ZIP64.
+                self.assertTrue(resultingEpub.getinfo("OEBPS/Text/Section0004.xhtml").extra.startswith(b"\x01\x00"))
+                self.assertEqual(resultingEpub.read("OEBPS/Text/Section0004.xhtml"),
+                                 "<p>{0}</p>".format("texto " * 8000).encode())
+
+    def test_parallel_compression_falls_back_without_zipfile_internals(self):
+        epubWriter = epubcreator.pyepub.pyepubwriter.epub.EpubWriter
+        epub = epubWriter(workers=4)
+        epub.addHtmlData("Section0000.xhtml", "<p>{0}</p>".format("texto " * 1000))
+
+        outputFile = io.BytesIO()
+        with mock.patch.object(epubWriter, "_ZIPFILE_INTERNALS", epubWriter._ZIPFILE_INTERNALS + ("_noExiste",)), \
+                mock.patch.object(epubWriter, "_writeCompressedFile") as writeCompressedFile:
+            epub.generate(outputFile)
+
+        writeCompressedFile.assert_not_called()
+        with zipfile.ZipFile(outputFile) as resultingEpub:
+            self.assertIsNone(resultingEpub.testzip())
+            self.assertIn(b"texto", resultingEpub.read("OEBPS/Text/Section0000.xhtml"))
+
+    def test_reproducible_output(self):
+        def generate(text):
+            epub = epubcreator.pyepub.pyepubwriter.epub.EpubWriter(reproducible=True)
+            epub.addHtmlData("Section0000.xhtml", text)
+            epub.addTitle("Título")
+
+            outputFile = io.BytesIO()
+            epub.generate(outputFile)
+            return outputFile
+
+        def getIdentifier(outputFile):
+            with zipfile.ZipFile(outputFile) as resultingEpub:
+                return self._xpath(etree.parse(resultingEpub.open("OEBPS/content.opf")), "//dc:identifier/text()")[0]
+
+        with mock.patch.dict("os.environ", {"SOURCE_DATE_EPOCH": "1400000000"}):
+            self.assertEqual(generate("bla").getvalue(), generate("bla").getvalue())
+            self.assertNotEqual(getIdentifier(generate("bla")), getIdentifier(generate("otro bla")))
+
+            self._resultingEpub = zipfile.ZipFile(generate("bla"))
+
+        self.assertEqual({info.date_time for info in self._resultingEpub.infolist()}, {(2014, 5, 13, 16, 53, 20)})
+
+        # En modo reproducible la toc se genera dos veces: una para calcular el identificador, y otra para escribirla.
+        self.assertEqual(len(self._xpath(self._getToc(), "/toc:ncx/toc:head/toc:meta[@name = 'dtb:depth']")), 1)
+
+    def test_compression_policy(self):
+        compression = epubcreator.pyepub.pyepubwriter.epub.CompressionPolicy(level=1, minSize=100)
+        self._epub = epubcreator.pyepub.pyepubwriter.epub.EpubWriter(compression=compression)
+        self._epub.addHtmlData("Section0000.xhtml", "bla" * 100)
+        self._epub.addHtmlData("Section0001.xhtml", "bla")
+        self._epub.addImageData("image1.png", b"\x89PNG" * 100)
+
+        self._generateEpub()
+
+        self.assertEqual(self._resultingEpub.getinfo("mimetype").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(self._resultingEpub.getinfo("OEBPS/Text/Section0000.xhtml").compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(self._resultingEpub.getinfo("OEBPS/Text/Section0001.xhtml").compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(self._resultingEpub.getinfo("OEBPS/Images/image1.png").compress_type, zipfile.ZIP_STORED)
+
+    def test_toc_with_deeply_nested_nav_points(self):
+        navPoint = self._epub.addNavPoint("Section0000.xhtml", "Título")
+        for i in range(sys.getrecursionlimit() * 2):
+            navPoint = navPoint.addNavPoint("Section0000.xhtml#id{0}".format(i), "Título {0}".format(i))
+
+        self._generateEpub()
+        toc = self._resultingEpub.read("OEBPS/toc.ncx")
+
+        self.assertEqual(toc.count(b"<navPoint "), sys.getrecursionlimit() * 2 + 1)
+        self.assertEqual(navPoint.playOrder, sys.getrecursionlimit() * 2 + 1)
+
     def test_adding_file_to_metainf_directory(self):
         self._epub.addMetaFile("file.xml", "file content")
 
@@ -196,6 +371,25 @@ class PyEpubWriterTest(unittest.TestCase):
         self.assertEqual(len(self._xpath(opf, "/opf:package/opf:guide/opf:reference[@href = 'Text/cubierta.xhtml' and "
                                               "@title = 'Cover' and @type = 'cover']")), 1)
 
+    def test_records_have_no_dict(self):
+        # De los items del opf y de los navpoints de la toc se crea una instancia por cada archivo o título, por lo
+        # que usan __slots__ para no tener un __dict__ cada una.
+        epub = epubcreator.pyepub.pyepubwriter.epub
+        opf = epubcreator.pyepub.pyepubwriter.opf
+        toc = epubcreator.pyepub.pyepubwriter.toc
+
+        records = (epub.CompressionPolicy(),
+                   epub._ZipMember("archivo.zip", "imagen.jpg"),
+                   opf._ManifestItem("Text/Section0001.xhtml", "Section0001.xhtml"),
+                   opf._MetadataDCItem("title", "Título"),
+                   opf._MetadataItem("cover", "cover.jpg"),
+                   toc.NavPoint("Section0001.xhtml", "Título"),
+                   toc._HeadItem("dtb:uid", "identificador"),
+                   toc._MetadataItem("docTitle", "Título"))
+
+        for record in records:
+            self.assertFalse(hasattr(record, "__dict__"), type(record).__name__)
+
     def _printToc(self):
         print(self._resultingEpub.read("OEBPS/toc.ncx").decode("utf-8"))
 
@@ -33,7 +33,9 @@ def freezeApp():
 
     options = {}
 
-    includes = ["PyQt4", "PyQt4.QtCore", "PyQt4.QtGui"]
+    # Los converters incluidos se importan recién al necesitarlos, a partir de su path (ver ConverterFactory), por
+    # lo que cx_Freeze no puede encontrarlos por sí solo.
+    includes = ["PyQt4", "PyQt4.QtCore", "PyQt4.QtGui", "epubcreator.converters.docx.docx_converter"]
     packages = ["lxml"]
     excludes = ["PyQt4.QtSvg", "PyQt4.QtNetwork", "PyQt4.QtOpenGL", "PyQt4.QtScript", "PyQt4.QtSql", "PyQt4.Qsci", "PyQt4.QtXml", "PyQt4.QtTest",
                 "PyQt4.uic"]
@@ -87,7 +89,11 @@ def freezeApp():
           options={"build_exe": options},
           executables=[Executable("epubcreator/gui/main.py",
                                   base="Win32GUI" if config.IS_RUNNING_ON_WIN else None,
-                                  targetName="{0}{1}".format(version.APP_NAME, ".exe" if config.IS_RUNNING_ON_WIN else ""))])
+                                  targetName="{0}{1}".format(version.APP_NAME, ".exe" if config.IS_RUNNING_ON_WIN else "")),
+                       # La conversión por lotes, de consola.
+                       Executable("epubcreator/batch.py",
+                                  base=None,
+                                  targetName="{0}-batch{1}".format(version.APP_NAME, ".exe" if config.IS_RUNNING_ON_WIN else ""))])
 
     if config.IS_RUNNING_ON_WIN:
         # Necesito el archivo qt.conf vacío. Si está vacío, Qt carga todos los paths por defecto, que